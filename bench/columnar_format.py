@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## columnar_format.py - wire size and encode time, rows vs columnar
+##
+## builds a wide result set (what query returns today, a list of dicts)
+## and compares the json payload of format='rows' with format='columnar'.
+## the columnar time includes converting the rows.
+##
+## python bench/columnar_format.py [-n ROWS] [-c COLUMNS]
+###############################################################################
+
+from __future__ import absolute_import, print_function
+
+import os, sys, argparse, timeit, json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlbridge.twisted.db.resultfmt import columnar
+
+def make_rows(n, ncol):
+    columns = [ 'column_name_{}'.format(c) for c in range(ncol) ]
+    states = [ 'active', 'disabled', 'pending' ]
+    rv = []
+    for i in range(n):
+        r = {}
+        for ci, c in enumerate(columns):
+            if ci % 3 == 0:
+                # low cardinality, these get dictionary encoded
+                r[c] = states[(i + ci) % len(states)]
+            else:
+                r[c] = str(i * ncol + ci)
+        rv.append(r)
+    return columns, rv
+
+def run():
+    p = argparse.ArgumentParser(description="rows vs columnar result encoding")
+    p.add_argument('-n', '--rows', action='store', type=int, dest='rows', default=20000,
+                        help='rows in the result set, default is 20000')
+    p.add_argument('-c', '--columns', action='store', type=int, dest='columns', default=30,
+                        help='columns in the result set, default is 30')
+    p.add_argument('-r', '--repeat', action='store', type=int, dest='repeat', default=5,
+                        help='timing repeats, default is 5')
+    args = p.parse_args()
+
+    columns, rv = make_rows(args.rows, args.columns)
+
+    def rows():
+        return json.dumps(rv)
+
+    def col():
+        return json.dumps(columnar(rv, columns))
+
+    print("{} rows, {} columns".format(args.rows, args.columns))
+    print("{:<10} {:>12} {:>12} {:>14}".format('format', 'bytes', 'ms', 'rows/sec'))
+    for name, f in ( ('rows', rows), ('columnar', col) ):
+        size = len(f())
+        t = min(timeit.repeat(f, number=1, repeat=args.repeat))
+        print("{:<10} {:>12} {:>12.1f} {:>14.0f}".format(name, size, t * 1000.0, args.rows / t))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## copy_in.py - rows/sec of copy_in vs one operation per row
+##
+## without --dsn this uses a sqlite3 database in a temporary file, and
+## compares one committed INSERT per row (what a loop of operation calls
+## does) with the multi row INSERT fallback copy_in uses.  with --dsn it
+## uses postgres, and compares one INSERT per row with COPY FROM STDIN.
+## the WAMP round trips of the operation loop are not counted, so the real
+## difference is larger.
+##
+## python bench/copy_in.py [-n ROWS] [--dsn 'dbname=autobahn user=autouser']
+###############################################################################
+
+from __future__ import absolute_import, print_function
+
+import os, sys, argparse, time, tempfile, sqlite3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlbridge.twisted.db import bulk
+
+columns = [ 'id', 'login', 'fullname', 'tzname' ]
+
+def make_rows(n):
+    return [ [ i, 'user{}'.format(i), 'Some User {}'.format(i), 'America/Chicago' ] for i in range(n) ]
+
+def report(name, n, elapsed):
+    print("{:<24} {:>10} rows {:>10.3f} sec {:>12.0f} rows/sec".format(name, n, elapsed, n / elapsed))
+
+def bench_sqlite(rows):
+    fd, path = tempfile.mkstemp(suffix='.sq')
+    os.close(fd)
+    try:
+        c = sqlite3.connect(path)
+        c.execute('create table bench_copy (id integer, login text, fullname text, tzname text)')
+        c.commit()
+
+        started = time.time()
+        for r in rows:
+            c.execute('insert into bench_copy (id, login, fullname, tzname) values (?, ?, ?, ?)', r)
+            c.commit()
+        report('insert per row', len(rows), time.time() - started)
+
+        c.execute('delete from bench_copy')
+        c.commit()
+
+        started = time.time()
+        bulk.insert_rows(c.cursor(), 'bench_copy', columns, rows, '?', 999)
+        c.commit()
+        report('copy_in (multi insert)', len(rows), time.time() - started)
+        c.close()
+    finally:
+        os.unlink(path)
+
+def bench_postgres(rows, dsn):
+    import psycopg2
+    from sqlbridge.twisted.db.postgres import copy_rows
+    from sqlbridge.twisted.db import calls
+
+    c = psycopg2.connect(dsn)
+    c.autocommit = True
+    cur = c.cursor()
+    cur.execute('drop table if exists bench_copy')
+    cur.execute('create table bench_copy (id integer, login text, fullname text, tzname text)')
+    try:
+        started = time.time()
+        for r in rows:
+            cur.execute('insert into bench_copy (id, login, fullname, tzname) values (%s, %s, %s, %s)', r)
+        report('insert per row', len(rows), time.time() - started)
+
+        cur.execute('truncate bench_copy')
+
+        started = time.time()
+        copy_rows(dsn, 'copy bench_copy (id, login, fullname, tzname) from stdin', rows, None,
+            calls.Call(None, 0), 0)
+        report('copy_in (COPY)', len(rows), time.time() - started)
+    finally:
+        cur.execute('drop table bench_copy')
+        c.close()
+
+def run():
+    p = argparse.ArgumentParser(description="copy_in rows/sec")
+    p.add_argument('-n', '--rows', action='store', type=int, dest='rows', default=10000,
+                        help='rows to load, default is 10000')
+    p.add_argument('-d', '--dsn', action='store', dest='dsn', default=None,
+                        help='postgres dsn, default is to use sqlite3')
+    args = p.parse_args()
+
+    rows = make_rows(args.rows)
+    if args.dsn:
+        bench_postgres(rows, args.dsn)
+    else:
+        bench_sqlite(rows)
+
+if __name__ == '__main__':
+    run()
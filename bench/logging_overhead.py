@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## logging_overhead.py - cost of logging a result set on the query path
+##
+## compares the old log.msg("PG9_4:rv {}".format(rv)) with dblog at info
+## (disabled), debug (row count and size) and trace (whole result).
+##
+## python bench/logging_overhead.py [-n ROWS] [-r REPEAT]
+###############################################################################
+
+from __future__ import absolute_import, print_function
+
+import os, sys, argparse, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.python import log
+from sqlbridge.twisted import dblog
+
+def make_rows(n):
+    return [ {
+        'id':str(i),
+        'login':'user{}'.format(i),
+        'fullname':'Some User {}'.format(i),
+        'password':'secret',
+        'tzname':'America/Chicago',
+        'modified_by_user':'2',
+        'modified_timestamp':'2014-09-29 10:25:52.38656-05',
+        'email':'user{}@example.com'.format(i)
+    } for i in range(n) ]
+
+def run():
+    p = argparse.ArgumentParser(description="query path logging overhead")
+    p.add_argument('-n', '--rows', action='store', type=int, dest='rows', default=50000,
+                        help='rows in the result set, default is 50000')
+    p.add_argument('-r', '--repeat', action='store', type=int, dest='repeat', default=5,
+                        help='times to log the result set, default is 5')
+    args = p.parse_args()
+
+    rv = make_rows(args.rows)
+
+    # nobody is listening, which is the point.  the old code paid for the
+    # format anyway.
+    def old():
+        log.msg("PG9_4:rv {}".format(rv))
+
+    def new():
+        dblog.debug("PG9_4:rv {}", dblog.rows(rv))
+
+    cases = [
+        ( 'log.msg(format)', old, dblog.INFO ),
+        ( 'dblog info', new, dblog.INFO ),
+        ( 'dblog debug', new, dblog.DEBUG ),
+        ( 'dblog trace', new, dblog.TRACE ),
+    ]
+
+    print("{} rows, {} repeats".format(args.rows, args.repeat))
+    base = None
+    for name, f, level in cases:
+        dblog.setLevel(level)
+        t = min(timeit.repeat(f, number=1, repeat=args.repeat))
+        if base is None:
+            base = t
+        print("{:<20} {:>12.3f} ms {:>10.1f}x".format(name, t * 1000.0, base / t if t > 0 else float('inf')))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## sqlite_concurrency.py - sqlite3 readers and writers, shared pool vs wal
+##
+## runs reader and writer threads against a sqlite3 database in a temporary
+## file for a few seconds, two ways:
+##
+##  shared  every thread has its own connection and any of them may write,
+##          rollback journal.  this is what the driver does without
+##          journal_mode=wal in the dsn.
+##  wal     journal_mode=wal, the writers hand their statements to one
+##          writer connection, the readers have read only connections.
+##
+## python bench/sqlite_concurrency.py [-r READERS] [-w WRITERS] [-s SECONDS]
+###############################################################################
+
+from __future__ import absolute_import, print_function
+
+import os, sys, argparse, time, tempfile, sqlite3, threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlbridge.twisted.db import sqliteopts
+
+def setup(path, rows):
+    c = sqlite3.connect(path)
+    c.execute('create table bench_rw (id integer primary key, grp integer, v text)')
+    c.executemany('insert into bench_rw (grp, v) values (?, ?)',
+        [ (i % 100, 'value {}'.format(i)) for i in range(rows) ])
+    c.commit()
+    c.close()
+
+def percentile(a, p):
+    if not a:
+        return 0.0
+    a = sorted(a)
+    return a[min(len(a) - 1, int(len(a) * p))]
+
+class Stats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reads = []
+        self.writes = []
+        self.errors = 0
+
+    def add(self, which, elapsed):
+        with self.lock:
+            which.append(elapsed)
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+def read_one(c, i):
+    c.execute('select count(*), max(v) from bench_rw where grp = ?', (i % 100,)).fetchall()
+
+def write_one(c, i):
+    c.execute('insert into bench_rw (grp, v) values (?, ?)', (i % 100, 'write {}'.format(i)))
+    c.commit()
+
+def reader(c, stats, stop):
+    i = 0
+    while not stop.is_set():
+        started = time.time()
+        try:
+            read_one(c, i)
+            stats.add(stats.reads, time.time() - started)
+        except sqlite3.OperationalError:
+            stats.error()
+        i += 1
+
+def shared_writer(c, stats, stop):
+    i = 0
+    while not stop.is_set():
+        started = time.time()
+        try:
+            write_one(c, i)
+            stats.add(stats.writes, time.time() - started)
+        except sqlite3.OperationalError:
+            c.rollback()
+            stats.error()
+        i += 1
+
+def queued_writer(q, stats, stop):
+    i = 0
+    done = threading.Event()
+    while not stop.is_set():
+        started = time.time()
+        done.clear()
+        q.put((i, done))
+        done.wait()
+        stats.add(stats.writes, time.time() - started)
+        i += 1
+
+def writer_thread(c, q, stats):
+    while True:
+        w = q.get()
+        if w is None:
+            return
+        try:
+            write_one(c, w[0])
+        except sqlite3.OperationalError:
+            stats.error()
+        w[1].set()
+
+def run_mode(mode, path, nreaders, nwriters, seconds):
+    stats = Stats()
+    stop = threading.Event()
+    threads = []
+    conns = []
+
+    def connect(pragmas, query_only):
+        c = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        sqliteopts.opener(pragmas, query_only)(c)
+        conns.append(c)
+        return c
+
+    if mode == 'wal':
+        pragmas = [ ('journal_mode', 'wal'), ('synchronous', 'normal') ]
+        q = queue.Queue()
+        w = threading.Thread(target=writer_thread, args=(connect(pragmas, False), q, stats))
+        w.start()
+        for i in range(nreaders):
+            threads.append(threading.Thread(target=reader, args=(connect(pragmas, True), stats, stop)))
+        for i in range(nwriters):
+            threads.append(threading.Thread(target=queued_writer, args=(q, stats, stop)))
+    else:
+        pragmas = [ ('journal_mode', 'delete') ]
+        for i in range(nreaders):
+            threads.append(threading.Thread(target=reader, args=(connect(pragmas, False), stats, stop)))
+        for i in range(nwriters):
+            threads.append(threading.Thread(target=shared_writer, args=(connect(pragmas, False), stats, stop)))
+
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    if mode == 'wal':
+        q.put(None)
+        w.join()
+    for c in conns:
+        c.close()
+
+    print("{:<8} {:>10.0f} {:>10.0f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>8}".format(mode,
+        len(stats.reads) / seconds, len(stats.writes) / seconds,
+        percentile(stats.reads, 0.5) * 1000.0, percentile(stats.reads, 0.99) * 1000.0,
+        percentile(stats.writes, 0.5) * 1000.0, percentile(stats.writes, 0.99) * 1000.0,
+        stats.errors))
+
+def run():
+    p = argparse.ArgumentParser(description="sqlite3 concurrency, shared pool vs wal")
+    p.add_argument('-r', '--readers', action='store', type=int, dest='readers', default=4,
+                        help='reader threads, default is 4')
+    p.add_argument('-w', '--writers', action='store', type=int, dest='writers', default=4,
+                        help='writer threads, default is 4')
+    p.add_argument('-s', '--seconds', action='store', type=float, dest='seconds', default=5.0,
+                        help='seconds to run each mode, default is 5')
+    p.add_argument('-n', '--rows', action='store', type=int, dest='rows', default=100000,
+                        help='rows in the table to start with, default is 100000')
+    args = p.parse_args()
+
+    print("{} readers, {} writers, {} seconds".format(args.readers, args.writers, args.seconds))
+    print("{:<8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>8}".format('mode',
+        'reads/s', 'writes/s', 'r p50 ms', 'r p99 ms', 'w p50 ms', 'w p99 ms', 'errors'))
+    for mode in ( 'shared', 'wal' ):
+        d = tempfile.mkdtemp()
+        path = os.path.join(d, 'bench.sq')
+        try:
+            setup(path, args.rows)
+            run_mode(mode, path, args.readers, args.writers, args.seconds)
+        finally:
+            for f in os.listdir(d):
+                os.unlink(os.path.join(d, f))
+            os.rmdir(d)
+
+if __name__ == '__main__':
+    run()
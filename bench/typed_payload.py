@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## typed_payload.py - wire size and encode/decode time, text vs typed
+##
+## builds a wide numeric result set twice, the way the postgres driver
+## returns it by default (every value text) and with --typed (ints,
+## floats and timestamps as numbers), and compares the json and msgpack
+## payloads of each.  msgpack is skipped if it isn't installed.  the
+## client side cost of turning text back into numbers is reported as
+## "parse".
+##
+## python bench/typed_payload.py [-n ROWS] [-c COLUMNS]
+###############################################################################
+
+from __future__ import absolute_import, print_function
+
+import argparse, timeit, json, time
+
+def make_rows(n, ncol):
+    columns = [ 'column_name_{}'.format(c) for c in range(ncol) ]
+    now = time.time()
+    typed = []
+    for i in range(n):
+        r = {}
+        for ci, c in enumerate(columns):
+            k = ci % 4
+            if k == 0:
+                r[c] = i * ncol + ci
+            elif k == 1:
+                r[c] = (i * ncol + ci) * 1.25
+            elif k == 2:
+                # numeric(12,2)
+                r[c] = round((i + ci) * 3.17, 2)
+            else:
+                r[c] = round(now + i, 6)
+        typed.append(r)
+    text = [ dict((c, str(v)) for c, v in r.items()) for r in typed ]
+    return columns, text, typed
+
+def run():
+    p = argparse.ArgumentParser(description="text vs typed results, json vs msgpack")
+    p.add_argument('-n', '--rows', action='store', type=int, dest='rows', default=20000,
+                        help='rows in the result set, default is 20000')
+    p.add_argument('-c', '--columns', action='store', type=int, dest='columns', default=30,
+                        help='columns in the result set, default is 30')
+    p.add_argument('-r', '--repeat', action='store', type=int, dest='repeat', default=5,
+                        help='timing repeats, default is 5')
+    args = p.parse_args()
+
+    columns, text, typed = make_rows(args.rows, args.columns)
+
+    codecs = [ ('json', json.dumps, json.loads) ]
+    try:
+        import msgpack
+        codecs.append(('msgpack', msgpack.packb, msgpack.unpackb))
+    except ImportError:
+        print("msgpack is not installed, only json is measured")
+
+    def parse(rows):
+        for r in rows:
+            for c in columns:
+                float(r[c])
+
+    print("{} rows, {} columns".format(args.rows, args.columns))
+    print("{:<8} {:<8} {:>12} {:>10} {:>10} {:>10}".format('mode', 'codec', 'bytes', 'encode ms', 'decode ms', 'parse ms'))
+    for mode, rows in ( ('text', text), ('typed', typed) ):
+        for name, enc, dec in codecs:
+            b = enc(rows)
+            te = min(timeit.repeat(lambda: enc(rows), number=1, repeat=args.repeat))
+            td = min(timeit.repeat(lambda: dec(b), number=1, repeat=args.repeat))
+            tp = min(timeit.repeat(lambda: parse(rows), number=1, repeat=args.repeat)) if mode == 'text' else 0.0
+            print("{:<8} {:<8} {:>12} {:>10.1f} {:>10.1f} {:>10.1f}".format(mode, name, len(b),
+                te * 1000.0, td * 1000.0, tp * 1000.0))
+
+if __name__ == '__main__':
+    run()
@@ -66,12 +66,15 @@ setup(
       ## mysql needs the python import libraries
       'postgres': ['txpostgres>=1.2.0','psycopg2>=2.5.4'],
       'mysql': ['MySQL-python>=1.2.3'],
+      ## the msgpack WAMP serializer, see --serializer
+      'msgpack': ['msgpack-python>=0.4.0'],
    },
    entry_points = {
       'console_scripts': [
          'sqlbridge = sqlbridge.scripts.cli:run',
          'sqlcmd = sqlbridge.scripts.client:run',
          'sqlrouter = sqlbridge.scripts.basicrouter:run',
+         'sqlbench = sqlbridge.scripts.bench:run',
       ]},
    packages = find_packages(),
    include_package_data = True,
@@ -25,6 +25,8 @@ from autobahn.twisted.wamp import RouterFactory
 from autobahn.twisted.wamp import RouterSessionFactory
 from autobahn.twisted.websocket import WampWebSocketServerFactory
 
+from sqlbridge.twisted import serializers
+
 from twisted.web.server import Site
 from twisted.web.static import File
 from twisted.web.resource import Resource
@@ -526,6 +528,8 @@ def run():
             default=False, help='Verbose logging for debugging')
     p.add_argument('-t', '--topic', action='store', dest='topic_base', default=def_topic_base,
                         help='if you specify --dsn then you will need a topic to root it on, the default ' + def_topic_base + ' is fine.')
+    p.add_argument('--serializer', action='store', dest='serializer', default=serializers.AUTO,
+            help='WAMP serializers clients may use, json and/or msgpack, default is auto, msgpack if it is installed, and json')
 
     args = p.parse_args()
     if args.verbose:
@@ -538,7 +542,8 @@ def run():
 
     router_factory = RouterFactory()
     session_factory = RouterSessionFactory(router_factory)
-    transport_factory = WampWebSocketServerFactory(session_factory, debug = args.verbose)
+    transport_factory = WampWebSocketServerFactory(session_factory, serializers = serializers.serializers(args.serializer),
+        debug = args.verbose)
     transport_factory.setProtocolOptions(failByDrop = False)
     server = serverFromString(reactor, args.endpoint)
     server.listen(transport_factory)
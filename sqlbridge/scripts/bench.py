@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## bench.py - sqlbench, load generator for a running sqlbridge
+##
+## opens K sessions to the router and drives a mix of query, operation and
+## watch calls at topic_base for a number of seconds, then reports calls,
+## errors, throughput and p50/p95/p99/max latency for each kind of call.
+##
+## with --rate R the calls are started on a schedule, R per second over all
+## of the sessions, and latency is measured from when a call was due, so a
+## bridge that falls behind shows it.  without --rate every session keeps
+## one call outstanding at a time, as fast as the bridge answers.
+###############################################################################
+
+from __future__ import absolute_import, print_function
+
+import sys, os, argparse, six, json, time, random
+
+from twisted.python import log
+from twisted.internet import reactor, task
+from twisted.internet.defer import inlineCallbacks, maybeDeferred
+from twisted.internet.endpoints import clientFromString
+
+from autobahn.twisted.wamp import ApplicationSession, ApplicationSessionFactory
+from autobahn.twisted.websocket import WampWebSocketClientFactory
+from autobahn.websocket.protocol import parseWsUrl
+
+from autobahn.wamp import auth
+from autobahn.wamp import types
+
+#
+# the calls sqlbench knows how to make
+#
+KINDS = ( 'query', 'operation', 'watch', )
+
+#
+# the table --setup creates, and the default statements, which work on
+# sqlite, postgres and mysql
+#
+setup_sql = "create table if not exists sqlbench (v varchar(64))"
+def_query = "select count(*) as n from sqlbench"
+def_operation = "insert into sqlbench (v) values ('sqlbench')"
+def_channel = 'sqlbench'
+
+#
+# parse_mix
+#  'query=8,operation=2' as [ (kind, weight) ... ]
+#
+def parse_mix(s):
+    rv = []
+    for w in s.split(','):
+        k, sep, v = w.partition('=')
+        k = k.strip()
+        if k not in KINDS:
+            raise Exception("sqlbench: unknown call {} in --mix, valid calls are {}".format(k, ', '.join(KINDS)))
+        weight = float(v) if sep else 1.0
+        if weight > 0:
+            rv.append((k, weight))
+    if not rv:
+        raise Exception("sqlbench: --mix has nothing to do")
+    return rv
+
+def percentile(a, p):
+    if not a:
+        return 0.0
+    return a[min(len(a) - 1, int(len(a) * p))]
+
+class Stats(object):
+    """
+    latencies and errors of one kind of call
+    """
+
+    def __init__(self):
+        self.latency = []
+        self.errors = 0
+        self.messages = {}
+
+    def ok(self, elapsed):
+        self.latency.append(elapsed)
+
+    def error(self, err):
+        self.errors += 1
+        m = str(err)[:200]
+        self.messages[m] = self.messages.get(m, 0) + 1
+
+    def report(self, seconds):
+        a = sorted(self.latency)
+        return {
+            'calls':len(a) + self.errors,
+            'errors':self.errors,
+            'per_sec':len(a) / seconds if seconds > 0 else 0.0,
+            'p50_ms':percentile(a, 0.50) * 1000.0,
+            'p95_ms':percentile(a, 0.95) * 1000.0,
+            'p99_ms':percentile(a, 0.99) * 1000.0,
+            'max_ms':(a[-1] * 1000.0) if a else 0.0,
+            'error_messages':self.messages
+        }
+
+class BenchSession(ApplicationSession):
+    """
+    one of the K sessions, it only joins, the Bench drives it
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.bench = kwargs.pop('bench')
+        self.authinfo = kwargs.pop('authinfo', None)
+        ApplicationSession.__init__(self, *args, **kwargs)
+
+    def onConnect(self):
+        auth_type = 'none'
+        auth_user = 'anon'
+        if self.authinfo:
+            auth_type = self.authinfo['auth_type']
+            auth_user = self.authinfo['auth_user']
+        self.join(self.config.realm, [six.u(auth_type)], six.u(auth_user))
+
+    def onChallenge(self, challenge):
+        password = 'unknown'
+        if self.authinfo:
+            password = self.authinfo['auth_password']
+        if challenge.method == u'wampcra':
+            if u'salt' in challenge.extra:
+                key = auth.derive_key(password.encode('utf8'),
+                    challenge.extra['salt'].encode('utf8'),
+                    challenge.extra.get('iterations', None),
+                    challenge.extra.get('keylen', None))
+            else:
+                key = password.encode('utf8')
+            signature = auth.compute_wcs(key, challenge.extra['challenge'].encode('utf8'))
+            return signature.decode('ascii')
+        else:
+            raise Exception("don't know how to compute challenge for authmethod {}".format(challenge.method))
+
+    def onJoin(self, details):
+        self.bench.joined(self)
+
+    def onLeave(self, details):
+        self.disconnect()
+
+    def onDisconnect(self):
+        self.bench.left(self)
+
+class Bench(object):
+    """
+    connects the sessions, runs the load, prints the report
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.total_weight = sum(w for k, w in self.mix)
+        self.sessions = []
+        self.stats = dict((k, Stats()) for k, w in self.mix)
+        self.outstanding = 0
+        self.next = 0
+        self.started = None
+        self.stopped = None
+        self.done = False
+        self.due = 0.0
+        self.loop = None
+        self.exit = 0
+
+    def connect(self):
+        is_secure, host, port = parseWsUrl(self.args.wsocket)[:3]
+        cfg = types.ComponentConfig(realm=self.args.realm)
+        ai = {
+            'auth_type':'wampcra',
+            'auth_user':self.args.user,
+            'auth_password':self.args.password
+        }
+        for i in range(self.args.sessions):
+            sf = ApplicationSessionFactory(cfg)
+            sf.session = lambda c, ai=ai: BenchSession(c, bench=self, authinfo=ai)
+            tf = WampWebSocketClientFactory(sf, url=self.args.wsocket, debug=False)
+            ep = clientFromString(reactor, "{}:{}:{}".format('ssl' if is_secure else 'tcp', host, port))
+            d = ep.connect(tf)
+            d.addErrback(self.failed)
+        reactor.callLater(self.args.connect_timeout, self.connect_timeout)
+
+    def failed(self, err):
+        print("sqlbench: connection failed, {}".format(err.getErrorMessage()))
+        self.exit = 1
+        self.stop()
+
+    def connect_timeout(self):
+        if self.started is None and not self.done:
+            print("sqlbench: only {} of {} sessions joined in {} seconds".format(len(self.sessions),
+                self.args.sessions, self.args.connect_timeout))
+            self.exit = 1
+            self.stop()
+
+    def joined(self, session):
+        self.sessions.append(session)
+        if len(self.sessions) == self.args.sessions:
+            self.begin()
+
+    def left(self, session):
+        if session in self.sessions:
+            self.sessions.remove(session)
+        if not self.done:
+            print("sqlbench: a session left before the run was over")
+            self.exit = 1
+            self.stop()
+
+    def procedure(self, kind):
+        return self.args.topic_base + '.' + kind
+
+    @inlineCallbacks
+    def begin(self):
+        if self.args.setup:
+            try:
+                yield self.sessions[0].call(self.procedure('operation'), setup_sql, {})
+            except Exception as err:
+                print("sqlbench: --setup failed, {}".format(err))
+                self.exit = 1
+                self.stop()
+                return
+        print("sqlbench: {} sessions, mix {}, {} for {} seconds".format(len(self.sessions), self.args.mix,
+            '{} calls/sec'.format(self.args.rate) if self.args.rate else 'closed loop', self.args.duration))
+        self.started = time.time()
+        reactor.callLater(self.args.duration, self.finish)
+        if self.args.rate:
+            self.loop = task.LoopingCall(self.tick)
+            self.loop.start(0.01)
+        else:
+            for s in self.sessions:
+                self.closed_loop(s)
+
+    #
+    # pick
+    #  the next kind of call, weighted by the mix
+    #
+    def pick(self):
+        r = random.random() * self.total_weight
+        for k, w in self.mix:
+            r -= w
+            if r < 0:
+                return k
+        return self.mix[-1][0]
+
+    def call(self, session, kind):
+        if kind == 'query':
+            return session.call(self.procedure('query'), self.args.query, self.args.query_args)
+        elif kind == 'operation':
+            return session.call(self.procedure('operation'), self.args.operation, self.args.operation_args)
+        return session.call(self.procedure('watch'), self.args.channel)
+
+    def measure(self, session, kind, due):
+        self.outstanding += 1
+        d = maybeDeferred(self.call, session, kind)
+
+        def ok(rv):
+            self.stats[kind].ok(time.time() - due)
+
+        def error(err):
+            self.stats[kind].error(err.value)
+
+        def both(rv):
+            self.outstanding -= 1
+            if self.stopped is not None and self.outstanding == 0:
+                self.report()
+        d.addCallbacks(ok, error)
+        d.addBoth(both)
+        return d
+
+    def closed_loop(self, session):
+        if self.stopped is not None:
+            return
+        d = self.measure(session, self.pick(), time.time())
+        d.addBoth(lambda _: reactor.callLater(0, self.closed_loop, session))
+
+    #
+    # tick
+    #  start the calls that have come due since the last tick, handing them
+    #  to the sessions in turn
+    #
+    def tick(self):
+        now = time.time()
+        elapsed = now - self.started
+        while self.due <= elapsed:
+            session = self.sessions[self.next % len(self.sessions)]
+            self.next += 1
+            self.measure(session, self.pick(), self.started + self.due)
+            self.due += 1.0 / self.args.rate
+
+    def finish(self):
+        self.stopped = time.time()
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        if self.outstanding == 0:
+            self.report()
+        else:
+            # don't wait forever for calls that never come back
+            reactor.callLater(self.args.drain, self.report)
+
+    def report(self):
+        if self.done:
+            return
+        seconds = self.stopped - self.started
+        rv = {
+            'sessions':self.args.sessions,
+            'rate':self.args.rate,
+            'seconds':seconds,
+            'outstanding':self.outstanding,
+            'calls':dict((k, s.report(seconds)) for k, s in self.stats.items())
+        }
+        total = Stats()
+        for s in self.stats.values():
+            total.latency.extend(s.latency)
+            total.errors += s.errors
+        rv['total'] = total.report(seconds)
+        del rv['total']['error_messages']
+
+        if self.args.json:
+            print(json.dumps(rv, indent=4, sort_keys=True))
+        else:
+            print("{:<10} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format('call',
+                'calls', 'errors', 'calls/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+            rows = [ (k, rv['calls'][k]) for k, w in self.mix ] + [ ('total', rv['total']) ]
+            for k, r in rows:
+                print("{:<10} {:>8} {:>7} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(k,
+                    r['calls'], r['errors'], r['per_sec'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['max_ms']))
+            for k, s in self.stats.items():
+                for m, n in s.messages.items():
+                    print("{} error x{}: {}".format(k, n, m))
+            if self.outstanding:
+                print("{} calls were still outstanding".format(self.outstanding))
+        if total.errors:
+            self.exit = 2
+        self.stop()
+
+    def stop(self):
+        self.done = True
+        for s in list(self.sessions):
+            try:
+                s.leave()
+            except Exception:
+                pass
+        if reactor.running:
+            reactor.callLater(0.5, reactor.stop)
+
+def run():
+    def_wsocket = 'ws://127.0.0.1:8080/ws'
+    def_user = 'client'
+    def_secret = 'clientsecret'
+    def_realm = 'realm1'
+    def_topic_base = 'com.db'
+    def_mix = 'query=8,operation=2'
+
+    p = argparse.ArgumentParser(description="sqlbridge load generator")
+
+    p.add_argument('-w', '--websocket', action='store', dest='wsocket', default=def_wsocket,
+                        help='web socket definition, default is: '+def_wsocket)
+    p.add_argument('-r', '--realm', action='store', dest='realm', default=def_realm,
+                        help='connect to websocket using realm, default is: '+def_realm)
+    p.add_argument('-v', '--verbose', action='store_true', dest='verbose',
+            default=False, help='Verbose logging for debugging')
+    p.add_argument('-u', '--user', action='store', dest='user', default=def_user,
+                        help='connect to websocket as user, default is: '+def_user)
+    p.add_argument('-s', '--secret', action='store', dest='password', default=def_secret,
+                        help='users "secret" password')
+    p.add_argument('-t', '--topic', action='store', dest='topic_base', default=def_topic_base,
+            help='the calls are made against this topic base, the default: ' + def_topic_base)
+    p.add_argument('-k', '--sessions', action='store', type=int, dest='sessions', default=4,
+            help='number of concurrent sessions, default is 4')
+    p.add_argument('-R', '--rate', action='store', type=float, dest='rate', default=0,
+            help='calls per second over all sessions, default is 0, as fast as each session gets answers')
+    p.add_argument('-d', '--duration', action='store', type=float, dest='duration', default=10.0,
+            help='seconds to run, default is 10')
+    p.add_argument('-m', '--mix', action='store', dest='mix', default=def_mix,
+            help='weights of the calls to make, from query, operation and watch, default is: ' + def_mix)
+    p.add_argument('-q', '--query', action='store', dest='query', default=def_query,
+            help='sql of the query calls, default is: ' + def_query)
+    p.add_argument('--query-args', action='store', dest='query_args', default='{}',
+            help='arguments of the query calls, in json, default is {}')
+    p.add_argument('-o', '--operation', action='store', dest='operation', default=def_operation,
+            help='sql of the operation calls, default is: ' + def_operation)
+    p.add_argument('--operation-args', action='store', dest='operation_args', default='{}',
+            help='arguments of the operation calls, in json, default is {}')
+    p.add_argument('--channel', action='store', dest='channel', default=def_channel,
+            help='what the watch calls watch (postgres), default is: ' + def_channel)
+    p.add_argument('--setup', action='store_true', dest='setup', default=False,
+            help='create the table the default statements use: ' + setup_sql)
+    p.add_argument('--json', action='store_true', dest='json', default=False,
+            help='print the report as json, for keeping track of results from release to release')
+    p.add_argument('--connect-timeout', action='store', type=float, dest='connect_timeout', default=10.0,
+            help='seconds to wait for the sessions to join, default is 10')
+    p.add_argument('--drain', action='store', type=float, dest='drain', default=10.0,
+            help='seconds to wait for outstanding calls at the end, default is 10')
+
+    args = p.parse_args()
+    if args.verbose:
+       log.startLogging(sys.stdout)
+    args.query_args = json.loads(args.query_args)
+    args.operation_args = json.loads(args.operation_args)
+
+    bench = Bench(args)
+    reactor.callWhenRunning(bench.connect)
+    reactor.run()
+    sys.exit(bench.exit)
+
+if __name__ == '__main__':
+   run()
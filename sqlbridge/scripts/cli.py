@@ -23,13 +23,14 @@ import sys, os, argparse, six
 
 import twisted
 from twisted.python import log
+from twisted.internet import reactor
 
-from autobahn.twisted.wamp import ApplicationRunner
 from autobahn.wamp import types
 
 from autobahn import util
 
 from sqlbridge.twisted.dbengine import DB
+from sqlbridge.twisted import dblog, workers, serializers
 
 import argparse
 
@@ -60,6 +61,8 @@ def run():
                         help='connect to websocket using realm, default is: '+def_realm)
     p.add_argument('-v', '--verbose', action='store_true', dest='verbose',
             default=False, help='Verbose logging for debugging')
+    p.add_argument('-l', '--log-level', action='store', dest='log_level', default=None, choices=['error', 'info', 'debug', 'trace'],
+            help='query path log level, default is debug with -v, otherwise info.  trace also logs entire result sets')
     p.add_argument('-u', '--user', action='store', dest='user', default=def_user,
                         help='connect to websocket as user, default is: '+def_user)
     p.add_argument('-s', '--secret', action='store', dest='password', default=def_secret,
@@ -77,10 +80,81 @@ def run():
                              '\nSQLITE: Z')
     p.add_argument('-t', '--topic', action='store', dest='topic_base', default=def_topic_base,
                         help='if you specify --dsn then you will need a topic to root it on, the default ' + def_topic_base + ' is fine.')
+    p.add_argument('--serializer', action='store', dest='serializer', default=serializers.AUTO,
+                        help='WAMP serializers to offer the router, json and/or msgpack in order of preference,' +
+                             ' default is auto, msgpack if it is installed, then json')
+    p.add_argument('--typed', action='store_true', dest='typed', default=None,
+                        help='return numbers, booleans, json and timestamps (as seconds since the epoch) in their' +
+                             ' native types instead of text (PG).  best with the msgpack serializer')
+    p.add_argument('--cp-min', action='store', type=int, dest='cp_min', default=None,
+                        help='minimum number of database connections kept open (PG, MYSQL), default is 1 (PG) or 3 (MYSQL).' +
+                             ' cp_min=N in the dsn overrides this')
+    p.add_argument('--cp-max', action='store', type=int, dest='cp_max', default=None,
+                        help='maximum number of database connections (PG, MYSQL), default is cp_min (PG) or 5 (MYSQL).' +
+                             ' cp_max=N in the dsn overrides this')
+    p.add_argument('--no-cp-reconnect', action='store_false', dest='cp_reconnect', default=None,
+                        help='do not reconnect pool connections the server dropped (MYSQL).' +
+                             ' cp_reconnect=0 in the dsn does the same')
+    p.add_argument('--page-size', action='store', type=int, dest='page_size', default=None,
+                        help='rows per progressive result returned by query_stream, default is 1000')
+    p.add_argument('--prepare-max', action='store', type=int, dest='prepare_max', default=None,
+                        help='prepared statements kept per database connection (PG), default is 100, 0 turns preparing off')
+    p.add_argument('--cache-size', action='store', type=int, dest='cache_size', default=None,
+                        help='bytes of query results kept for queries called with cache_ttl, default is 67108864, 0 turns caching off')
+
+    p.add_argument('--replica', action='append', dest='replicas', default=None, metavar='DSN',
+                        help='dsn of a read replica (PG), may be given more than once.  single selects' +
+                             ' are spread over the replicas, everything else runs on the primary, --dsn')
+    p.add_argument('--sticky', action='store', type=float, dest='sticky', default=None,
+                        help='seconds that a caller\'s queries stay on the primary after it writes, so it' +
+                             ' reads its own writes (PG replicas), default is 0, off')
+    p.add_argument('--max-lag', action='store', type=float, dest='max_lag', default=None,
+                        help='seconds a replica may fall behind before it is taken out of rotation, default is 30')
+    p.add_argument('--lag-interval', action='store', type=float, dest='lag_interval', default=None,
+                        help='seconds between replica lag checks, default is 5')
+
+    p.add_argument('--slow-ms', action='store', type=float, dest='slow_ms', default=None,
+                        help='log queries and operations slower than this many milliseconds (PG),' +
+                             ' TOPIC.slowlog returns them.  default is off')
+    p.add_argument('--slow-log-size', action='store', type=int, dest='slow_size', default=None,
+                        help='slow queries kept, default is 100')
+    p.add_argument('--slow-explain', action='store_true', dest='slow_explain', default=None,
+                        help='also keep the EXPLAIN plan of each slow query (PG)')
+
+    p.add_argument('--timeout', action='store', type=float, dest='timeout', default=None,
+                        help='seconds a statement may run before it is cancelled, a call can say otherwise' +
+                             ' with timeout=N.  default is 0, no limit')
+    p.add_argument('--txn-idle', action='store', type=float, dest='txn_idle', default=None,
+                        help='seconds a transaction from TOPIC.begin may sit with no call running before it is' +
+                             ' rolled back (PG), default is 60, 0 is no limit')
+    p.add_argument('--max-in-flight', action='store', type=int, dest='max_in_flight', default=None,
+                        help='calls each procedure runs at once, the rest wait their turn, default is 100.' +
+                             ' 0 turns admission control off')
+    p.add_argument('--max-queue', action='store', type=int, dest='max_queue', default=None,
+                        help='calls each procedure keeps waiting, more are refused with TOPIC.error.overloaded,' +
+                             ' default is 1000')
+    p.add_argument('--limit', action='append', dest='limits', default=None, metavar='PROCEDURE=N[:Q]',
+                        help='--max-in-flight N (and --max-queue Q) for one procedure, like query=20:200.' +
+                             ' may be given more than once')
+
+    p.add_argument('--stats-topic', action='store', dest='stats_topic', default=None,
+                        help='publish the TOPIC.stats snapshot to this topic every --stats-interval seconds')
+    p.add_argument('--stats-interval', action='store', type=float, dest='stats_interval', default=None,
+                        help='seconds between snapshots published to --stats-topic, default is 10')
+
+    p.add_argument('--workers', action='store', type=int, dest='workers', default=0,
+                        help='run this many bridge processes, all serving the same procedures on --topic.' +
+                             ' a supervisor restarts the ones that die and reports on them at TOPIC.workers')
+    p.add_argument('--worker', action='store', type=int, dest='worker', default=None,
+                        help=argparse.SUPPRESS)
 
     args = p.parse_args()
     if args.verbose:
        log.startLogging(sys.stdout)
+    if args.log_level is not None:
+       dblog.setLevel(args.log_level)
+    elif args.verbose:
+       dblog.setLevel(dblog.DEBUG)
 
     component_config = types.ComponentConfig(realm=args.realm)
     ai = {
@@ -88,11 +162,26 @@ def run():
             'auth_user':args.user,
             'auth_password':args.password
             }
-    mdb = DB(config=component_config,
-            authinfo=ai,engine=args.engine,topic_base=args.topic_base,dsn=args.dsn, debug=args.verbose)
+    if args.workers > 1 and args.worker is None:
+        supervisor = workers.Supervisor(args.workers, sys.argv)
+        reactor.callWhenRunning(supervisor.start)
+        mdb = DB(config=component_config,
+                authinfo=ai,topic_base=args.topic_base,debug=args.verbose,supervisor=supervisor)
+        serializers.run(args.wsocket, mdb, args.serializer)
+        return
 
-    runner = ApplicationRunner(args.wsocket, args.realm)
-    runner.run(lambda _: mdb)
+    mdb = DB(config=component_config,
+            authinfo=ai,engine=args.engine,topic_base=args.topic_base,dsn=args.dsn, debug=args.verbose,
+            worker=args.worker,
+            cp_min=args.cp_min,cp_max=args.cp_max,cp_reconnect=args.cp_reconnect,page_size=args.page_size,
+            prepare_max=args.prepare_max,cache_size=args.cache_size,
+            replicas=args.replicas,sticky=args.sticky,max_lag=args.max_lag,lag_interval=args.lag_interval,
+            timeout=args.timeout,slow_ms=args.slow_ms,slow_size=args.slow_size,slow_explain=args.slow_explain,
+            max_in_flight=args.max_in_flight,max_queue=args.max_queue,limits=args.limits,
+            stats_topic=args.stats_topic,stats_interval=args.stats_interval,typed=args.typed,
+            txn_idle=args.txn_idle)
+
+    serializers.run(args.wsocket, mdb, args.serializer)
 
 
 if __name__ == '__main__':
@@ -19,23 +19,109 @@
 
 from __future__ import absolute_import
 
-import sys, os, argparse, six, json
+import sys, os, argparse, six, json, time
 
 import twisted
 from twisted.python import log
-from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import reactor, stdio
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.protocols.basic import LineReceiver
 
-from autobahn.twisted.wamp import ApplicationRunner
 from autobahn.wamp import types
 
 import argparse
 
-from autobahn.twisted.wamp import ApplicationSession,ApplicationRunner
+from autobahn.twisted.wamp import ApplicationSession
+
+from sqlbridge.twisted import serializers
 
 from autobahn.wamp import auth
 from autobahn.wamp import types
 
+class Splitter(object):
+    """
+    turns lines of input into statements and commands.  a statement ends
+    with a line ending in ; (or the end of the input), so it may span
+    lines.  between statements, lines starting with -- and blank lines are
+    skipped, and a line starting with \\ is a command:
+
+     \\call NAME    the following statements are TOPIC.NAME calls
+     \\args JSON    and are given these arguments
+     \\wait         wait for the statements running before going on
+     \\timing       turn the timing output on or off
+     \\q            quit
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def pending(self):
+        return bool(self.lines)
+
+    def feed(self, line):
+        s = line.rstrip()
+        if not self.lines:
+            if not s.strip() or s.lstrip().startswith('--'):
+                return []
+            if s.lstrip().startswith('\\'):
+                return [ ('command', s.strip()) ]
+        self.lines.append(s)
+        if s.endswith(';'):
+            return self.finish()
+        return []
+
+    def finish(self):
+        if not self.lines:
+            return []
+        sql = '\n'.join(self.lines).strip()
+        self.lines = []
+        if sql.endswith(';'):
+            sql = sql[:-1].rstrip()
+        return [ ('statement', sql) ] if sql else []
+
+class Repl(LineReceiver):
+    """
+    sqlcmd -i, statements typed at a prompt, run one at a time on the
+    session
+    """
+
+    delimiter = b'\n'
+
+    def __init__(self, component):
+        self.component = component
+        self.splitter = Splitter()
+
+    def connectionMade(self):
+        self.prompt()
+
+    def prompt(self):
+        self.transport.write(b'...> ' if self.splitter.pending() else b'sqlcmd> ')
+
+    def lineReceived(self, line):
+        items = self.splitter.feed(line.decode('utf8'))
+        if not items:
+            self.prompt()
+            return
+        self.transport.pauseProducing()
+        d = self.component.run_batch(items)
+
+        def failed(err):
+            sys.stderr.write("-- error: {}\n".format(err.getErrorMessage()))
+            return True
+
+        def done(more):
+            if more:
+                self.transport.resumeProducing()
+                self.prompt()
+            else:
+                self.transport.loseConnection()
+
+        d.addErrback(failed)
+        d.addCallback(done)
+
+    def connectionLost(self, reason):
+        self.component.finish()
+
 class Component(ApplicationSession):
     """
     An application component demonstrating client database access
@@ -50,12 +136,23 @@ class Component(ApplicationSession):
         log.msg("got args {}, kwargs {}".format(args,kwargs))
 
         # reap init variables meant only for us
-        for i in ( 'topic_base', 'authinfo', 'debug', 'db_call', 'db_query', 'db_args', ):
+        for i in ( 'topic_base', 'authinfo', 'debug', 'db_call', 'db_query', 'db_args',
+                'db_file', 'interactive', 'concurrency', 'timing', ):
             if i in kwargs:
                 if kwargs[i] is not None:
                     self.svar[i] = kwargs[i]
                 del kwargs[i]
 
+        # batch and interactive mode, see run_batch
+        self.call_name = self.svar.get('db_call', 'query')
+        self.call_args = self.svar.get('db_args', {})
+        self.timing = bool(self.svar.get('timing'))
+        self.concurrency = max(1, int(self.svar.get('concurrency') or 1))
+        self.statements = 0
+        self.errors = 0
+        self.watching = False
+        self.exit = 0
+
         log.msg("sending to super.init args {}, kwargs {}".format(args,kwargs))
         ApplicationSession.__init__(self, *args, **kwargs)
 
@@ -96,11 +193,144 @@ class Component(ApplicationSession):
 
         return
 
+    def watch_event(self, details):
+        print("watch: {}".format(details))
+
+    #
+    # execute
+    #  one statement, returns (ok, result, milliseconds)
+    #
+    @inlineCallbacks
+    def execute(self, call, sql, args):
+        started = time.time()
+        try:
+            rv = yield self.call(self.svar['topic_base'] + '.' + call, sql, args)
+            ok = True
+        except Exception as err:
+            rv = err
+            ok = False
+        returnValue((ok, rv, (time.time() - started) * 1000.0))
+
+    #
+    # show
+    #  the outcome of statement n, a call to call, and its time
+    #
+    @inlineCallbacks
+    def show(self, n, call, outcome):
+        ok, rv, ms = outcome
+        if not ok:
+            self.errors += 1
+            sys.stderr.write("-- {}: error: {}\n".format(n, rv))
+        elif call == 'watch':
+            yield self.subscribe(self.watch_event, rv)
+            self.watching = True
+            print("watching {}".format(rv))
+        elif call != 'operation' and rv is not None:
+            print(json.dumps(rv,indent=4))
+        if self.timing:
+            rows = " ({} rows)".format(len(rv)) if ok and isinstance(rv, list) else ""
+            sys.stderr.write("-- {}: {} {:.1f} ms{}\n".format(n, call, ms, rows))
+
+    #
+    # command
+    #  a \ line, returns False for \q
+    #
+    def command(self, text):
+        w = text.split(None, 1)
+        name, rest = w[0], (w[1] if len(w) > 1 else '')
+        if name == '\\q':
+            return False
+        if name == '\\call' and rest:
+            self.call_name = rest.strip()
+        elif name == '\\args':
+            try:
+                self.call_args = json.loads(rest) if rest.strip() else {}
+            except ValueError as err:
+                self.errors += 1
+                sys.stderr.write("-- \\args: bad json, {}\n".format(err))
+        elif name == '\\timing':
+            self.timing = not self.timing if not rest else rest.strip() in ( 'on', '1', 'true', )
+            sys.stderr.write("-- timing is {}\n".format('on' if self.timing else 'off'))
+        elif name != '\\wait':
+            self.errors += 1
+            sys.stderr.write("-- unknown command {}\n".format(name))
+        return True
+
+    #
+    # run_batch
+    #  items from a Splitter.  up to concurrency statements run at once,
+    #  their output comes in the order they were given.  \wait lets the
+    #  running statements finish first, for statements that depend on
+    #  the ones before them.  returns False if \q was seen.
+    #
+    @inlineCallbacks
+    def run_batch(self, items):
+        running = []
+        more = True
+        for kind, text in items:
+            if kind == 'command':
+                if text.split()[0] == '\\wait' or text == '\\q':
+                    while running:
+                        yield self.shift(running)
+                if not self.command(text):
+                    more = False
+                    break
+                continue
+            self.statements += 1
+            running.append((self.statements, self.call_name, self.execute(self.call_name, text, self.call_args)))
+            while running and (running[0][2].called or len(running) >= self.concurrency):
+                yield self.shift(running)
+        while running:
+            yield self.shift(running)
+        returnValue(more)
+
+    #
+    # shift
+    #  wait for the first of the running statements and show it
+    #
+    @inlineCallbacks
+    def shift(self, running):
+        n, call, d = running.pop(0)
+        outcome = yield d
+        yield self.show(n, call, outcome)
+
+    #
+    # finish
+    #  the batch is done.  stay connected if something is being watched.
+    #
+    def finish(self):
+        started = self.svar.get('started')
+        if self.timing and started is not None:
+            sys.stderr.write("-- {} statements, {} errors, {:.1f} ms\n".format(self.statements, self.errors,
+                (time.time() - started) * 1000.0))
+        if self.errors:
+            self.exit = 1
+        if not self.watching:
+            self.disconnect()
+
     @inlineCallbacks
     def onJoin(self, details):
         log.msg("db:onJoin session attached {}".format(details))
         dcon = False
 
+        # many statements on this one session, from a file, stdin or typed
+        if self.svar.get('interactive'):
+            self.svar['started'] = time.time()
+            stdio.StandardIO(Repl(self))
+            return
+        if 'db_file' in self.svar:
+            self.svar['started'] = time.time()
+            f = sys.stdin if self.svar['db_file'] == '-' else open(self.svar['db_file'])
+            try:
+                s = Splitter()
+                items = [ i for line in f for i in s.feed(line) ] + s.finish()
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+            yield self.run_batch(items)
+            self.finish()
+            return
+
         # query, operation or watch
         try:
             log.msg("topic_base: {}".format(self.svar['topic_base']))
@@ -178,6 +408,18 @@ def run():
             help='this is the first argument to db_call, if db_call is operation or query then this is the sql query to run. If the operation is watch then this is the LISTEN to watch : ' + def_db_query)
     p.add_argument('-a', '--args', action='store', dest='db_args', default=def_db_args,
             help='if your query requires arguments they can be specified in json format here, default is a blank dictionary : ' + def_db_args)
+    p.add_argument('--serializer', action='store', dest='serializer', default=serializers.AUTO,
+            help='WAMP serializers to offer the router, json and/or msgpack in order of preference,' +
+                 ' default is auto, msgpack if it is installed, then json')
+    p.add_argument('-f', '--file', action='store', dest='db_file', default=None,
+            help='run the statements in this file (- is stdin) on one session, each ending with a ; at the end of a line.' +
+                 ' they are --call calls with --args, lines like \\call NAME and \\args JSON change that')
+    p.add_argument('-i', '--interactive', action='store_true', dest='interactive', default=False,
+            help='read statements from a prompt, on one session')
+    p.add_argument('-j', '--concurrency', action='store', type=int, dest='concurrency', default=1,
+            help='statements of --file run at once, default is 1.  a \\wait line waits for the ones running')
+    p.add_argument('--timing', action='store_true', dest='timing', default=False,
+            help='print the time each statement took, on stderr')
 
     args = p.parse_args()
     if args.verbose:
@@ -191,9 +433,10 @@ def run():
             }
     mdb = Component(config=component_config,
             authinfo=ai,topic_base=args.topic_base,debug=args.verbose,
-            db_call=args.db_call,db_query=args.db_query,db_args=json.loads(args.db_args))
-    runner = ApplicationRunner(args.wsocket, args.realm)
-    runner.run(lambda _: mdb)
+            db_call=args.db_call,db_query=args.db_query,db_args=json.loads(args.db_args),
+            db_file=args.db_file,interactive=args.interactive,concurrency=args.concurrency,timing=args.timing)
+    serializers.run(args.wsocket, mdb, args.serializer)
+    sys.exit(mdb.exit)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,79 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## test_dbengine_leave.py - leaving the router stops the stats publisher
+###############################################################################
+
+from __future__ import absolute_import
+import unittest
+
+from twisted.internet import defer, task
+
+from sqlbridge.twisted.dbengine import DB
+
+class FakeRegistration(object):
+    """
+    a registration, unregister succeeds or fails
+    """
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.unregistered = False
+
+    def unregister(self):
+        self.unregistered = True
+        if self.fail:
+            return defer.fail(Exception("transport lost"))
+        return defer.succeed(None)
+
+class TestLeave(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.publishes = []
+        self.publisher = task.LoopingCall(lambda: self.publishes.append(self.clock.seconds()))
+        self.publisher.clock = self.clock
+        self.publisher.start(10.0, now=False)
+
+        self.session = DB.__new__(DB)
+        self.session.db = { 'publisher':self.publisher, 'registration':{} }
+        self.disconnects = []
+        self.session.disconnect = lambda: self.disconnects.append(True)
+
+    def test_leave_stops_publisher(self):
+        self.clock.advance(10)
+        self.assertEqual(len(self.publishes), 1)
+        d = self.session.onLeave('wamp.close.normal')
+        self.assertTrue(d.called)
+        self.assertFalse(self.publisher.running)
+        self.clock.advance(60)
+        self.assertEqual(len(self.publishes), 1)
+        self.assertEqual(self.disconnects, [True])
+
+    def test_leave_unregisters(self):
+        regs = { 'query':FakeRegistration(), 'stats':FakeRegistration(fail=True) }
+        self.session.db['registration'] = dict(regs)
+        self.session.onLeave('wamp.close.normal')
+        self.assertTrue(all(r.unregistered for r in regs.values()))
+        self.assertFalse(self.publisher.running)
+        # a failed unregister doesn't keep the session from disconnecting
+        self.assertEqual(self.disconnects, [True])
+
+if __name__ == '__main__':
+    unittest.main()
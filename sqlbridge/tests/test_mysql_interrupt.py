@@ -0,0 +1,113 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## test_mysql_interrupt.py - KILL QUERY goes out on a connection of its own
+###############################################################################
+
+from __future__ import absolute_import
+import unittest
+
+from sqlbridge.twisted.db import mysql, calls
+
+class FakeCursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, s):
+        self.conn.executed.append(s)
+
+    def close(self):
+        pass
+
+class FakeConnection(object):
+    """
+    a MySQLdb connection, it records the statements run on it
+    """
+
+    def __init__(self, tid=0, **kw):
+        self.tid = tid
+        self.kw = kw
+        self.executed = []
+        self.closed = False
+
+    def thread_id(self):
+        return self.tid
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+class TestKillQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.connects = []
+        def connect(**kw):
+            c = FakeConnection(**kw)
+            self.connects.append(c)
+            return c
+        self.connect = mysql.MySQLdb.connect
+        mysql.MySQLdb.connect = connect
+        self.db = mysql.MYSQL14_14('com.db', None, False)
+        self.db.dsn = 'db=autobahn host=localhost user=autouser'
+        self.call = calls.Call(None, 1.0)
+
+    def tearDown(self):
+        mysql.MySQLdb.connect = self.connect
+
+    def test_kill_on_side_connection(self):
+        self.call.conn = FakeConnection(tid=42)
+        self.db.kill_query(self.call)
+        self.assertEqual(len(self.connects), 1)
+        self.assertEqual(self.connects[0].kw['db'], 'autobahn')
+        self.assertEqual(self.connects[0].executed, [ 'kill query 42' ])
+        # the side connection is kept for the next kill
+        self.call.conn = FakeConnection(tid=43)
+        self.db.kill_query(self.call)
+        self.assertEqual(len(self.connects), 1)
+        self.assertEqual(self.connects[0].executed, [ 'kill query 42', 'kill query 43' ])
+
+    def test_no_kill_once_the_call_let_go(self):
+        # the statement finished and the connection went back to the pool
+        self.call.conn = None
+        self.db.kill_query(self.call)
+        self.assertTrue(all(not c.executed for c in self.connects))
+
+    def test_conn_set_while_interaction_runs(self):
+        seen = []
+        class Pool(object):
+            def runWithConnection(self, f):
+                return f(pooled)
+        class Pooled(FakeConnection):
+            def commit(self):
+                pass
+            def rollback(self):
+                pass
+        pooled = Pooled(tid=9)
+        calls.run_interaction(Pool(), self.call, lambda cur: seen.append(self.call.conn))
+        self.assertEqual(seen, [ pooled ])
+        self.assertTrue(self.call.conn is None)
+        # and a kill after that finds nothing to kill
+        self.db.kill_query(self.call)
+        self.assertTrue(all(not c.executed for c in self.connects))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## test_mysql_stream.py - query_stream pages a server side cursor
+###############################################################################
+
+from __future__ import absolute_import
+import unittest
+
+import MySQLdb.cursors
+
+from sqlbridge.twisted.db.mysql import stream_unbuffered
+
+class FakeCursor(object):
+    """
+    a cursor over rows, it records what was done to it
+    """
+
+    def __init__(self, connection, rows):
+        self.connection = connection
+        self.rows = list(rows)
+        self.executed = None
+        self.closed = False
+
+    def execute(self, s, a):
+        self.executed = (s, a)
+
+    def fetchmany(self, n):
+        page, self.rows = self.rows[:n], self.rows[n:]
+        return page
+
+    def close(self):
+        self.closed = True
+
+class FakeConnection(object):
+    """
+    hands out FakeCursors, and remembers the cursor class asked for
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.cursors = []
+
+    def cursor(self, cursorclass=None):
+        c = FakeCursor(self, self.rows)
+        self.cursors.append((cursorclass, c))
+        return c
+
+class TestStreamUnbuffered(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [ {'n':i} for i in range(7) ]
+        self.conn = FakeConnection(self.rows)
+        # the pool's buffered cursor, the interaction is handed this
+        self.pooled = FakeCursor(self.conn, [])
+
+    def test_uses_server_side_cursor(self):
+        rv = stream_unbuffered(self.pooled, 'select n from t', {}, 3, None)
+        self.assertEqual(rv, self.rows)
+        self.assertEqual(len(self.conn.cursors), 1)
+        cls, c = self.conn.cursors[0]
+        self.assertTrue(cls is MySQLdb.cursors.SSDictCursor)
+        self.assertEqual(c.executed, ('select n from t', {}))
+        self.assertTrue(c.closed)
+        # nothing ran on the buffered cursor
+        self.assertTrue(self.pooled.executed is None)
+
+    def test_closed_on_error(self):
+        def boom(s, a):
+            raise Exception("boom")
+        orig = self.conn.cursor
+        def cursor(cursorclass=None):
+            c = orig(cursorclass)
+            c.execute = boom
+            return c
+        self.conn.cursor = cursor
+        self.assertRaises(Exception, stream_unbuffered, self.pooled, 'select 1', {}, 3, None)
+        self.assertTrue(self.conn.cursors[0][1].closed)
+
+if __name__ == '__main__':
+    unittest.main()
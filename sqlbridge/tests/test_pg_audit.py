@@ -0,0 +1,85 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## test_pg_audit.py - audit_user follows the caller on pooled connections
+###############################################################################
+
+from __future__ import absolute_import
+import unittest
+
+from twisted.internet import defer
+
+from sqlbridge.twisted.db.postgres import PG9_4, RDC
+
+class Details(object):
+
+    def __init__(self, authid):
+        self.authid = authid
+        self.caller = None
+
+class FakeCursor(object):
+    """
+    records the audit_user each statement sets
+    """
+
+    def __init__(self):
+        self.users = []
+
+    def execute(self, s, a=None):
+        self.users.append(a['user_id'])
+        return defer.succeed(self)
+
+class TestBindAudit(unittest.TestCase):
+
+    def setUp(self):
+        self.db = PG9_4.__new__(PG9_4)
+        self.db.session_cache = { 'hits':0, 'misses':0 }
+        self.conn = RDC()
+        self.cur = FakeCursor()
+
+    def bind(self, authid):
+        self.db.bind_audit(self.cur, self.conn, Details(authid) if authid != 'none' else None)
+
+    def test_anonymous_on_new_connection(self):
+        self.bind(None)
+        self.bind('none')
+        self.assertEqual(self.cur.users, [])
+
+    def test_anonymous_clears_earlier_caller(self):
+        self.bind('alice')
+        self.bind('alice')
+        self.bind(None)
+        self.bind(None)
+        self.bind('bob')
+        self.assertEqual(self.cur.users, [ 'alice', '', 'bob' ])
+
+    def test_cleared_after_forget(self):
+        self.bind('alice')
+        # a rollback, the connection may or may not still carry alice
+        self.conn.forget()
+        self.bind(None)
+        self.assertEqual(self.cur.users, [ 'alice', '' ])
+
+    def test_forget_never_audited(self):
+        self.conn.forget()
+        self.bind(None)
+        self.assertEqual(self.cur.users, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## test_pgreplica.py - which statements may run on a read replica
+###############################################################################
+
+from __future__ import absolute_import
+import unittest
+
+from sqlbridge.twisted.db.pgreplica import reads_only
+
+class TestReadsOnly(unittest.TestCase):
+
+    def test_reads(self):
+        for s in (
+            "select * from login",
+            "  SELECT 1",
+            "-- who is there\nselect * from login where id = %(id)s",
+            "/* a comment */ select 1",
+            "(select 1) union (select 2)",
+            "with t as (select 1 as n) select n from t",
+        ):
+            self.assertTrue(reads_only(s), s)
+
+    def test_writes(self):
+        for s in (
+            "insert into login (login, fullname) values ('x', 'x') returning *",
+            "update login set fullname = 'y' where id = 1",
+            "delete from login where id = 1",
+            "select * into login_copy from login",
+            "select * from login where id = 1 for update",
+            "select * from login for share",
+            "select nextval('login_id_seq')",
+            "with d as (delete from login returning *) select * from d",
+            "-- cleanup\ndelete from login",
+            "create table t (n int)",
+            "",
+        ):
+            self.assertFalse(reads_only(s), s)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## admission.py - admission control for the procedures DB registers
+##
+## each procedure runs at most max_in_flight calls at once.  calls beyond
+## that wait, in order, in a queue of at most max_queue calls.  a call that
+## finds the queue full is refused straight away with the ApplicationError
+## topic_base.error.overloaded, whose retry_after keyword says how many
+## seconds the caller should wait before trying again, estimated from how
+## long calls have been taking and how many are ahead.
+##
+## so a flood of callers costs a bounded number of Deferreds instead of
+## growing the bridge until it falls over.
+###############################################################################
+
+from __future__ import absolute_import
+
+import time, collections
+
+from twisted.internet.defer import Deferred, maybeDeferred, fail
+
+from autobahn.wamp.exception import ApplicationError
+
+#
+# defaults, per procedure
+#
+MAX_IN_FLIGHT = 100
+MAX_QUEUE = 1000
+
+#
+# the least retry_after handed out, seconds
+#
+MIN_RETRY = 0.1
+
+#
+# weight of the latest call in the average service time
+#
+ALPHA = 0.2
+
+#
+# parse_limits
+#  [ 'query=20:200', 'operation=5' ] -> { 'query':(20, 200), 'operation':(5, None) }
+#  a missing queue size means the default.
+#
+def parse_limits(limits):
+    rv = {}
+    for w in limits or []:
+        name, _, v = w.partition('=')
+        n, _, q = v.partition(':')
+        try:
+            rv[name.strip()] = (int(n), int(q) if q else None)
+        except ValueError:
+            raise Exception("admission:parse_limits(), bad limit {}, expected PROCEDURE=IN_FLIGHT[:QUEUE]".format(w))
+    return rv
+
+#
+# caller_of
+#  the WAMP session id of a call, from its keyword arguments
+#
+def caller_of(kwargs):
+    return kwargs['details'].caller if 'details' in kwargs else None
+
+class Gate(object):
+    """
+    the limits and counters of one procedure
+    """
+
+    def __init__(self, max_in_flight, max_queue):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        # (deferred, f, args, kwargs) waiting their turn
+        self.queue = collections.deque()
+        self.draining = False
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.cancelled = 0
+        # average seconds a call takes, once one has finished
+        self.service = None
+
+    def observe(self, seconds):
+        if self.service is None:
+            self.service = seconds
+        else:
+            self.service += ALPHA * (seconds - self.service)
+
+    #
+    # retry_after
+    #  seconds until the calls ahead of a new one should be done
+    #
+    def retry_after(self):
+        if self.service is None:
+            return MIN_RETRY
+        ahead = len(self.queue) + self.in_flight
+        return round(max(MIN_RETRY, self.service * ahead / float(self.max_in_flight)), 3)
+
+    def snapshot(self):
+        return {
+            'max_in_flight':self.max_in_flight,
+            'max_queue':self.max_queue,
+            'in_flight':self.in_flight,
+            'queued':len(self.queue),
+            'admitted':self.admitted,
+            'waited':self.waited,
+            'rejected':self.rejected,
+            'cancelled':self.cancelled,
+            'service_ms':self.service * 1000.0 if self.service is not None else None
+        }
+
+class Admission(object):
+    """
+    the gates of every procedure of one DB session
+    """
+
+    def __init__(self, error, max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE, limits=None, clock=time.time):
+        self.error = error
+        self.max_in_flight = int(max_in_flight)
+        self.max_queue = int(max_queue)
+        self.limits = limits or {}
+        self.clock = clock
+        self.gates = {}
+
+    def gate(self, name):
+        if name not in self.gates:
+            n, q = self.limits.get(name, (None, None))
+            self.gates[name] = Gate(self.max_in_flight if n is None else n,
+                self.max_queue if q is None else q)
+        return self.gates[name]
+
+    #
+    # wrap
+    #  f, admitted through the gate of procedure name.  a procedure whose
+    #  max_in_flight is 0 isn't limited.
+    #
+    def wrap(self, name, f):
+        g = self.gate(name)
+        if g.max_in_flight <= 0:
+            return f
+
+        def admitted(*args, **kwargs):
+            if g.in_flight < g.max_in_flight:
+                return self.run(g, f, args, kwargs)
+            if len(g.queue) < g.max_queue:
+                d = Deferred()
+                g.queue.append((d, f, args, kwargs))
+                g.waited += 1
+                return d
+            g.rejected += 1
+            return fail(ApplicationError(self.error, "{} is overloaded, try again later".format(name),
+                procedure=name, retry_after=g.retry_after(), in_flight=g.in_flight, queued=len(g.queue)))
+
+        return admitted
+
+    def run(self, g, f, args, kwargs):
+        g.in_flight += 1
+        g.admitted += 1
+        started = self.clock()
+
+        def done(rv):
+            g.in_flight -= 1
+            g.observe(self.clock() - started)
+            self.drain(g)
+            return rv
+
+        d = maybeDeferred(f, *args, **kwargs)
+        d.addBoth(done)
+        return d
+
+    #
+    # drain
+    #  start the waiting calls there is room for.  a call that finishes
+    #  straight away calls drain again from run, the draining flag keeps
+    #  that from recursing once per queued call.
+    #
+    def drain(self, g):
+        if g.draining:
+            return
+        g.draining = True
+        try:
+            while g.queue and g.in_flight < g.max_in_flight:
+                d, f, args, kwargs = g.queue.popleft()
+                self.run(g, f, args, kwargs).chainDeferred(d)
+        finally:
+            g.draining = False
+
+    #
+    # cancel_caller
+    #  drop the waiting calls of caller (a WAMP session id), it has left.
+    #  returns how many.
+    #
+    def cancel_caller(self, caller):
+        n = 0
+        for g in self.gates.values():
+            gone = [ w for w in g.queue if caller_of(w[3]) == caller ]
+            if not gone:
+                continue
+            g.queue = collections.deque(w for w in g.queue if caller_of(w[3]) != caller)
+            g.cancelled += len(gone)
+            n += len(gone)
+            for w in gone:
+                w[0].cancel()
+        return n
+
+    def snapshot(self):
+        return dict((k, v.snapshot()) for k, v in self.gates.items())
@@ -25,39 +25,42 @@
 
 from __future__ import absolute_import
 
-import sys,os
+import sys,os,time
 import sqlite3
 from twisted.enterprise import adbapi
 from twisted.python import log
 from twisted.internet.defer import inlineCallbacks, returnValue
 
-from .dbbase import dbbase
-
-def dict_factory(cursor, row):
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
- 
-def set_dict_factory(conn):
-    conn.row_factory = dict_factory
+from .dbbase import dbbase, adbapi_stats, stream_pages, args_many, execute_many, run_operation, PAGE_SIZE
+from .resultfmt import check_format, fetch_columnar, fetch_rows
+from .qcache import QueryCache, CACHE_SIZE
+from . import bulk, sqliteopts, calls
+from .. import dblog
 
 class SQLITE3_3_8_2(dbbase):
     """
     basic sqlite3 3.8.2 driver
     """
 
-    def __init__(self, topic_base, app_session, debug):
+    def __init__(self, topic_base, app_session, debug, **kwargs):
         if debug is not None and debug:
             log.startLogging(sys.stdout)
         log.msg("SQLITE3_3_8_2:__init__()")
         self.engine_version = "SQLITE3_3_8_2"
         self.engine = "SQLITE"
         self.conn = None
+        self.readers = None
+        self.journal_mode = None
+        self.pragmas = []
         self.dsn = None
         self.topic_base = topic_base
         self.app_session = app_session
         self.debug = debug
+        self.page_size = int(kwargs.get('page_size') or PAGE_SIZE)
+        self.cache = QueryCache(int(kwargs.get('cache_size') if kwargs.get('cache_size') is not None else CACHE_SIZE))
+        # seconds a statement may run, 0 for no limit, see calls.py
+        self.timeout = float(kwargs.get('timeout') or 0)
+        self.calls = calls.Calls(topic_base, self.interrupt)
         return
  
     #
@@ -69,19 +72,33 @@ class SQLITE3_3_8_2(dbbase):
     #  DBNAME is the database name
     #  MACHINE is the ip address or dns name of the machine
     #  DBUSER is the user to connect as
+    # note:
+    #  the dsn may also carry pragmas, see sqliteopts.py.  with
+    #  journal_mode=wal writes are serialized on one connection and
+    #  query/query_stream run on a pool of read only connections, so
+    #  readers never wait for the writer and writers never see
+    #  'database is locked' from each other.
     #
 
+    @inlineCallbacks
     def connect(self,*args,**kwargs):
         log.msg("SQLITE3_3_8_2:connect({},{})".format(args,kwargs))
         self.dsn = args[0]
-        # there must be an easier way.
-        # this converts db=x host=y shatever=z to a dictionary.
         try:
-            md = dict(s.split('=') for s in self.dsn.split())
-            md['cp_openfun'] = set_dict_factory
-            #self.conn = adbapi.ConnectionPool("sqlite3",**dict(s.split('=') for s in self.dsn.split()))
-            self.conn = adbapi.ConnectionPool("sqlite3",**dict(md))
-            log.msg("SQLITE3_3_8_2:connect() established")
+            md, self.pragmas, readers = sqliteopts.dsn_args(self.dsn)
+            if readers:
+                self.conn = adbapi.ConnectionPool("sqlite3", cp_min=1, cp_max=1,
+                    cp_openfun=sqliteopts.opener(self.pragmas, False), **md)
+                # the writer goes first, it turns on wal for everybody
+                rv = yield self.conn.runQuery('pragma journal_mode')
+                self.readers = adbapi.ConnectionPool("sqlite3", cp_min=1, cp_max=readers,
+                    cp_openfun=sqliteopts.opener(self.pragmas, True), **md)
+            else:
+                self.conn = adbapi.ConnectionPool("sqlite3",
+                    cp_openfun=sqliteopts.opener(self.pragmas, False), **md)
+                rv = yield self.conn.runQuery('pragma journal_mode')
+            self.journal_mode = rv[0][0] if rv else None
+            log.msg("SQLITE3_3_8_2:connect() established, journal_mode {} readers {}".format(self.journal_mode, readers))
         except Exception as err:
             log.msg("SQLITE3_3_8_2:connect({}),error({})".format(self.dsn,err))
             raise err
@@ -94,10 +111,15 @@ class SQLITE3_3_8_2(dbbase):
     #   is currently connected then this does nothing.
     def disconnect(self,*args,**kwargs):
         log.msg("SQLITE3_3_8_2:disconnect({},{})".format(args,kwargs))
+        if self.readers:
+            r = self.readers
+            self.readers = None
+            r.close()
         if self.conn:
             c = self.conn
             self.conn = None
             c.close()
+        self.cache.clear()
 
         return
 
@@ -117,22 +139,106 @@ class SQLITE3_3_8_2(dbbase):
     #  for example, a query that says 'insert into table x (c) values(r)'
     #  by its nature it doesn't return a row, so, this isn't the right
     #  method to use, use operation instead
+    # note:
+    #  the keyword argument format='columnar' returns the result as column
+    #  names plus arrays of values, see resultfmt.py
+    # note:
+    #  the keyword argument cache_ttl=N keeps the result for N seconds, and
+    #  the same query (same arguments, same authid) is answered from the
+    #  cache until then.  cache_channels is a postgres only feature.
+    # note:
+    #  the keyword argument timeout=N interrupts the query after N seconds,
+    #  the default is --timeout.  so does the caller leaving.
     #
 
     @inlineCallbacks
     def query(self,*args,**kwargs):
-        log.msg("SQLITE3_3_8_2:query({},{})".format(args,kwargs))
+        dblog.debug("SQLITE3_3_8_2:query({},{})", args,kwargs)
+        s = args[0]
+        a = args[1]
+        fmt = check_format(kwargs.get('format'))
+        if self.conn:
+            ttl = kwargs.get('cache_ttl')
+            if ttl:
+                if kwargs.get('cache_channels'):
+                    raise Exception("SQLITE3_3_8_2:query(), cache_channels can only be used in postgres")
+                ckey = self.cache.key(s, a, fmt,
+                    kwargs['details'].authid if 'details' in kwargs else None)
+                rv = self.cache.get(ckey)
+                if rv is not None:
+                    dblog.debug("SQLITE3_3_8_2:query() cache hit")
+                    returnValue(rv)
+            try:
+                dblog.debug("SQLITE3_3_8_2:query().running({} with args {})", s,a)
+                pool = self.readers or self.conn
+                if fmt == 'columnar':
+                    rv = yield self.run_call(pool, kwargs, fetch_columnar, s, a)
+                else:
+                    rv = yield self.run_call(pool, kwargs, fetch_rows, s, a)
+                dblog.debug("SQLITE3_3_8_2:query().results({})", dblog.rows(rv))
+                if ttl:
+                    self.cache.put(ckey, rv, float(ttl))
+                returnValue(rv)
+            except Exception as err:
+                dblog.error("SQLITE3_3_8_2:query({}),error({})", s,err)
+                raise err
+
+        # error here, probably should raise exception
+        return
+
+    #
+    # query_stream:
+    #  identical to query, except the rows are returned page_size (keyword
+    #  argument) at a time as progressive results.  the pages are read with
+    #  fetchmany, so only one page is held in the bridge at a time.
+    #
+
+    @inlineCallbacks
+    def query_stream(self,*args,**kwargs):
+        dblog.debug("SQLITE3_3_8_2:query_stream() ARGS:{} KWARGS:{}", args, kwargs)
         s = args[0]
         a = args[1]
+        page_size = int(kwargs.get('page_size') or self.page_size)
+        progress = None
+        if 'details' in kwargs:
+            progress = getattr(kwargs['details'], 'progress', None)
         if self.conn:
             try:
-                log.msg("SQLITE3_3_8_2:query().running({} with args {})".format(s,a))
-                rv = yield self.conn.runQuery(s,a)
-                log.msg("SQLITE3_3_8_2:query().results({})".format(rv))
+                rv = yield self.run_call(self.readers or self.conn, kwargs, stream_pages, s, a, page_size, progress, True)
+                dblog.debug("SQLITE3_3_8_2:query_stream().results({})", dblog.rows(rv))
                 returnValue(rv)
             except Exception as err:
-                log.msg("SQLITE3_3_8_2:query({}),error({})".format(s,err))
+                dblog.error("SQLITE3_3_8_2:query_stream({}),error({})", s,err)
+                raise err
+
+        # error here, probably should raise exception
+        return
+
+    #
+    # copy_in:
+    #  bulk load table t, columns c, with rows r (see dbbase.py).  there is
+    #  no COPY here, the rows go in as multi row INSERTs of at most
+    #  999 placeholders each, all in one transaction.
+    #
+
+    @inlineCallbacks
+    def copy_in(self,*args,**kwargs):
+        dblog.debug("SQLITE3_3_8_2:copy_in() ARGS:{} KWARGS:{}", args[:2], kwargs)
+        if len(args) < 3:
+            raise Exception("SQLITE3_3_8_2:copy_in(), requires table, columns and rows")
+        t = bulk.check_identifier(args[0])
+        c = [ bulk.check_identifier(w) for w in args[1] ]
+        r = bulk.rows_of(args[2], c, bulk.check_format(kwargs.get('format')), kwargs.get('header'))
+        if self.conn:
+            started = time.time()
+            try:
+                n = yield self.run_call(self.conn, kwargs, bulk.insert_rows, t, c, r, '?', 999)
+            except Exception as err:
+                dblog.error("SQLITE3_3_8_2:copy_in({}),error({})", t, err)
                 raise err
+            elapsed = time.time() - started
+            dblog.debug("SQLITE3_3_8_2:copy_in() {} rows in {} seconds", n, elapsed)
+            returnValue({ 'rows':n, 'seconds':elapsed, 'rows_per_sec':(n / elapsed) if elapsed > 0 else None })
 
         # error here, probably should raise exception
         return
@@ -150,17 +256,42 @@ class SQLITE3_3_8_2(dbbase):
 
     @inlineCallbacks
     def operation(self,*args,**kwargs):
-        log.msg("SQLITE3_3_8_2:operation({},{})".format(args,kwargs))
+        dblog.debug("SQLITE3_3_8_2:operation({},{})", args,kwargs)
         s = args[0]
         a = args[1]
         if self.conn:
             try:
-                log.msg("SQLITE3_3_8_2:query().running({} with args {})".format(s,a))
-                rv = yield self.conn.runOperation(s,a)
-                log.msg("SQLITE3_3_8_2:query().results({})".format(rv))
+                dblog.debug("SQLITE3_3_8_2:query().running({} with args {})", s,a)
+                rv = yield self.run_call(self.conn, kwargs, run_operation, s, a)
+                dblog.debug("SQLITE3_3_8_2:query().results({})", dblog.rows(rv))
                 returnValue(rv)
             except Exception as err:
-                log.msg("SQLITE3_3_8_2:query({}),error({})".format(s,err))
+                dblog.error("SQLITE3_3_8_2:query({}),error({})", s,err)
+                raise err
+
+        # error here, probably should raise exception
+        return
+
+    #
+    # operation_many:
+    #  one statement, many argument lists, one executemany in one transaction
+    #
+
+    @inlineCallbacks
+    def operation_many(self,*args,**kwargs):
+        dblog.debug("SQLITE3_3_8_2:operation_many() ARGS:{} KWARGS:{}", args[:1], kwargs)
+        if len(args) < 2:
+            raise Exception("SQLITE3_3_8_2:operation_many(), requires sql and a list of arguments")
+        s = args[0]
+        al = args_many('SQLITE3_3_8_2', args[1])
+        if self.conn:
+            try:
+                dblog.debug("SQLITE3_3_8_2:operation_many().running({} {} times)", s, len(al))
+                n = yield self.run_call(self.conn, kwargs, execute_many, s, al)
+                dblog.debug("SQLITE3_3_8_2:operation_many() {} rows", n)
+                returnValue({ 'statements':len(al), 'rows':n })
+            except Exception as err:
+                dblog.error("SQLITE3_3_8_2:operation_many({}),error({})", s,err)
                 raise err
 
         # error here, probably should raise exception
@@ -174,6 +305,50 @@ class SQLITE3_3_8_2(dbbase):
     def watch(self,*args,**kwargs):
         raise Exception("sqlite3 is trying to add watch, can only do this in postgres")
         return
+
+    def unwatch(self,*args,**kwargs):
+        raise Exception("sqlite3 is trying to remove watch, can only do this in postgres")
+        return
+
+    #
+    # begin, commit, rollback:
+    #  transactions that span calls, postgres only
+    #
+
+    def begin(self,*args,**kwargs):
+        raise Exception("sqlite3 is trying to begin a transaction, can only do this in postgres")
+        return
+
+    def commit(self,*args,**kwargs):
+        raise Exception("sqlite3 is trying to commit a transaction, can only do this in postgres")
+        return
+
+    def rollback(self,*args,**kwargs):
+        raise Exception("sqlite3 is trying to roll back a transaction, can only do this in postgres")
+        return
+
+    #
+    # interrupt:
+    #  stop the statement call is running, sqlite3 lets another thread
+    #  interrupt a connection
+    #
+
+    def interrupt(self, call):
+        conn = call.conn
+        if conn is not None:
+            conn.interrupt()
+
+    #
+    # pool_stats:
+    #  the adbapi pool, see dbbase.py.  in wal mode the writer and the
+    #  readers are separate pools.
+    #
+
+    def pool_stats(self):
+        if self.readers:
+            return { 'writer':adbapi_stats(self.conn), 'readers':adbapi_stats(self.readers) }
+        return adbapi_stats(self.conn)
+
     #
     # info:
     #  return information about this connection
@@ -181,13 +356,20 @@ class SQLITE3_3_8_2(dbbase):
 
     @inlineCallbacks
     def info(self,*args,**kwargs):
-        log.msg("SQLITE3_3_8_2:info({},{})".format(args,kwargs))
+        dblog.debug("SQLITE3_3_8_2:info({},{})", args,kwargs)
         rv = yield [{
             "engine":self.engine,
             "engine_version":self.engine_version,
             "dsn":self.dsn,
             "topic_base":self.topic_base,
-            "debug":self.debug
+            "debug":self.debug,
+            "page_size":self.page_size,
+            "journal_mode":self.journal_mode,
+            "pragmas":dict(self.pragmas),
+            "readers":self.readers.max if self.readers else 0,
+            "cache":self.cache.info(),
+            "timeout":self.timeout,
+            "calls":self.calls.info()
         }]
         returnValue(rv)
         return
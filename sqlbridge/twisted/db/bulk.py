@@ -0,0 +1,146 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## bulk.py - bulk loading helpers for copy_in
+##
+## copy_in takes a table, a list of columns and either rows (arrays, or
+## dictionaries keyed on column) or a csv/tsv blob.  postgres streams the
+## rows through COPY ... FROM STDIN, the other drivers fall back to multi row
+## INSERT statements.  either way the whole load is one transaction.
+###############################################################################
+
+from __future__ import absolute_import
+import re, csv, io
+import six
+
+FORMATS = ( 'csv', 'tsv', )
+
+#
+# identifiers are not quoted (so they mean what they mean in hand written
+# sql), so they have to look like identifiers.
+#
+identifier = re.compile(r'^[A-Za-z_][A-Za-z0-9_$]*(\.[A-Za-z_][A-Za-z0-9_$]*)?$')
+
+def check_identifier(w):
+    if not isinstance(w, six.string_types) or not identifier.match(w):
+        raise Exception("copy_in: bad table or column name {}".format(w))
+    return w
+
+#
+# check_format
+#  the format keyword of copy_in, for blobs
+#
+def check_format(fmt):
+    if fmt is None:
+        return 'csv'
+    if fmt not in FORMATS:
+        raise Exception("copy_in: unknown format {}, valid formats are {}".format(fmt, ', '.join(FORMATS)))
+    return fmt
+
+#
+# rows_of
+#  rows as a list of sequences in column order.  data is a list of rows
+#  (sequences or dictionaries), or a csv/tsv string.
+#
+def rows_of(data, columns, fmt='csv', header=False):
+    if isinstance(data, six.string_types):
+        # the python 2 csv module only reads byte strings
+        if six.PY2:
+            if isinstance(data, six.text_type):
+                data = data.encode('utf8')
+            f = io.BytesIO(data)
+        else:
+            f = io.StringIO(data)
+        if fmt == 'tsv':
+            r = csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+        else:
+            r = csv.reader(f)
+        rows = [ row for row in r if row ]
+        if header:
+            rows = rows[1:]
+        if fmt == 'tsv':
+            rows = [ [ None if v == '\\N' else v for v in row ] for row in rows ]
+        return rows
+    rv = []
+    for row in data:
+        if isinstance(row, dict):
+            rv.append([ row.get(c) for c in columns ])
+        else:
+            rv.append(row)
+    return rv
+
+#
+# text_value
+#  one value in postgres COPY text format
+#
+def text_value(v):
+    if v is None:
+        return '\\N'
+    if isinstance(v, bool):
+        return 't' if v else 'f'
+    if not isinstance(v, six.string_types):
+        v = str(v)
+    return v.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+class CopyReader(object):
+    """
+    file like object that turns rows into COPY text format as it is read,
+    so the whole load is never held as one string
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buf = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buf) < size:
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                break
+            self.buf += '\t'.join(text_value(v) for v in row) + '\n'
+            self.count += 1
+        if size < 0:
+            rv, self.buf = self.buf, ''
+        else:
+            rv, self.buf = self.buf[:size], self.buf[size:]
+        return rv
+
+#
+# insert_rows
+#  adbapi interaction, the fallback for engines without COPY.  the rows go
+#  in as INSERT ... VALUES (...), (...), ... with as many rows per statement
+#  as max_params placeholders allow.  mark is the driver's placeholder.
+#
+def insert_rows(cur, table, columns, rows, mark, max_params):
+    per = max(1, max_params // max(1, len(columns)))
+    head = 'insert into ' + table + ' (' + ', '.join(columns) + ') values '
+    one = '(' + ', '.join([ mark ] * len(columns)) + ')'
+    n = 0
+    for i in range(0, len(rows), per):
+        chunk = rows[i:i + per]
+        params = []
+        for j, row in enumerate(chunk):
+            if len(row) != len(columns):
+                raise Exception("copy_in: row {} has {} values, expected {}".format(i + j, len(row), len(columns)))
+            params.extend(row)
+        cur.execute(head + ', '.join([ one ] * len(chunk)), params)
+        n += len(chunk)
+    return n
@@ -0,0 +1,214 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## calls.py - statement timeouts, and cancelling the calls of a caller
+##
+## every call that runs statements is started here, remembering who the
+## caller is and how long it may take (the timeout keyword, or the driver's
+## --timeout).  a call is stopped when its time is up or when its caller's
+## session leaves the router, by whatever means the driver has to stop a
+## running statement (interrupt):
+##
+##  postgres - statement_timeout for the time limit, cancelling the
+##             running txpostgres Deferred (a cancel request to the
+##             backend, like pg_cancel_backend) when the caller leaves.
+##  sqlite3  - connection.interrupt()
+##  mysql    - KILL QUERY on a connection of its own, outside the pool
+##
+## a stopped call fails with topic_base.error.timeout or
+## topic_base.error.cancelled, and its connection goes straight back to
+## the pool.
+###############################################################################
+
+from __future__ import absolute_import
+import threading
+
+from twisted.internet import reactor
+
+from autobahn.wamp.exception import ApplicationError
+
+from .. import dblog
+
+#
+# why a call was stopped
+#
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+
+class Interrupted(Exception):
+    pass
+
+#
+# timeout_of
+#  the seconds a call may take, its timeout keyword or the default.
+#  0 is no limit.
+#
+def timeout_of(kwargs, default):
+    t = kwargs.get('timeout')
+    if t is None:
+        t = default
+    return float(t or 0)
+
+class Call(object):
+    """
+    one running call
+    """
+
+    def __init__(self, caller, timeout):
+        self.caller = caller
+        self.timeout = timeout
+        self.reason = None
+        # set by the driver while a statement runs, for interrupt
+        self.conn = None
+        # held while conn is set or cleared from a pool thread, so an
+        # interrupt holding it knows conn is still this call's
+        self.lock = threading.Lock()
+        self.d = None
+        self.timer = None
+
+class Calls(object):
+    """
+    the running calls of a driver, by caller
+    """
+
+    def __init__(self, topic_base, interrupt, clock=reactor):
+        self.topic_base = topic_base
+        self.interrupt = interrupt
+        self.clock = clock
+        # caller session -> set of Call
+        self.running = {}
+        self.stats = { TIMEOUT:0, CANCELLED:0 }
+
+    #
+    # start
+    #  kwargs - the call's keyword arguments, for the caller
+    #  timeout - seconds it may run, 0 for no limit
+    #  timer - stop it with interrupt when the time is up.  drivers with
+    #   a server side limit (statement_timeout) leave this off.
+    #
+    def start(self, kwargs, timeout=0, timer=False):
+        caller = kwargs['details'].caller if 'details' in kwargs else None
+        call = Call(caller, timeout)
+        if caller is not None:
+            self.running.setdefault(caller, set()).add(call)
+        if timer and timeout > 0:
+            call.timer = self.clock.callLater(timeout, self.stop, call, TIMEOUT)
+        return call
+
+    #
+    # stop
+    #  stop call for reason.  the driver's interrupt does the stopping, the
+    #  call fails when the statement it was running gives up.
+    #
+    def stop(self, call, reason):
+        self.mark(call, reason)
+        try:
+            self.interrupt(call)
+        except Exception as err:
+            dblog.error("calls:stop() interrupt failed, error({})", err)
+
+    #
+    # mark
+    #  call was stopped for reason, by us or by the server
+    #
+    def mark(self, call, reason):
+        if call.reason is None:
+            call.reason = reason
+            self.stats[reason] += 1
+
+    #
+    # cancel_caller
+    #  stop every call of caller, it has left.  returns how many.
+    #
+    def cancel_caller(self, caller):
+        calls = self.running.pop(caller, ())
+        for call in calls:
+            self.stop(call, CANCELLED)
+        if calls:
+            dblog.info("calls: caller {} left, {} calls cancelled", caller, len(calls))
+        return len(calls)
+
+    #
+    # finish
+    #  d is the Deferred of call.  forget the call when d fires, and turn
+    #  the failure of a stopped call into the error saying why.
+    #
+    def finish(self, call, d):
+        def done(rv):
+            if call.timer is not None and call.timer.active():
+                call.timer.cancel()
+            s = self.running.get(call.caller)
+            if s is not None:
+                s.discard(call)
+                if not s:
+                    del self.running[call.caller]
+            return rv
+
+        def failed(err):
+            if call.reason is not None:
+                raise self.error(call)
+            return err
+
+        d.addBoth(done)
+        d.addErrback(failed)
+        return d
+
+    def error(self, call):
+        if call.reason == TIMEOUT:
+            return ApplicationError(self.topic_base + '.error.timeout',
+                "statement ran longer than {} seconds".format(call.timeout), timeout=call.timeout)
+        return ApplicationError(self.topic_base + '.error.cancelled', "call cancelled, the caller left")
+
+    def info(self):
+        return {
+            'running':sum(len(s) for s in self.running.values()),
+            'callers':len(self.running),
+            'timeouts':self.stats[TIMEOUT],
+            'cancelled':self.stats[CANCELLED]
+        }
+
+#
+# run_interaction
+#  like adbapi's runInteraction, interaction(cursor, *args) in a
+#  transaction on a connection of pool, except that call.conn is the
+#  connection while it runs, so the driver's interrupt can find it.  a call
+#  stopped before it got a connection doesn't run at all.  call.conn is
+#  set and cleared holding call.lock, so the connection can't go back to
+#  the pool while an interrupt holds it.
+#
+def run_interaction(pool, call, interaction, *args):
+    def f(conn):
+        if call.reason is not None:
+            raise Interrupted(call.reason)
+        with call.lock:
+            call.conn = conn
+        try:
+            cur = conn.cursor()
+            try:
+                rv = interaction(cur, *args)
+                cur.close()
+                conn.commit()
+                return rv
+            except:
+                conn.rollback()
+                raise
+        finally:
+            with call.lock:
+                call.conn = None
+    return pool.runWithConnection(f)
@@ -29,6 +29,127 @@
 from __future__ import absolute_import
 from abc import ABCMeta, abstractmethod
 
+import six
+from twisted.internet import reactor
+
+from .resultfmt import columns_of, dict_rows
+from . import calls
+from .. import dblog
+
+#
+# default number of rows per chunk for query_stream
+#
+PAGE_SIZE = 1000
+
+#
+# stream_pages:
+#  run s with arguments a on a DB-API cursor and hand the result to
+#  progress page_size rows at a time.  this runs in an adbapi thread, so the
+#  pages are handed over with callFromThread.  the last page is not handed
+#  to progress, it is returned, and becomes the final result of the call.
+#  if progress is None (the caller did not ask for progressive results)
+#  all of the pages are returned in one list.  dicts=True turns tuple rows
+#  into dictionaries, a page at a time.
+#
+def stream_pages(cur, s, a, page_size, progress, dicts=False):
+    cur.execute(s, a)
+    columns = columns_of(cur.description) if dicts else None
+    rv = []
+    while True:
+        page = cur.fetchmany(page_size)
+        if not page:
+            break
+        if dicts:
+            page = dict_rows(page, columns)
+        if progress is None:
+            rv.extend(page)
+            continue
+        if rv:
+            reactor.callFromThread(progress, rv)
+        rv = list(page)
+    return rv
+
+#
+# query_args:
+#  the arguments of query.  the first is a query or an array of queries, the
+#  second is a dictionary of arguments for all of them or an array of
+#  dictionaries, one per query.
+# returns:
+#  (array of queries, array of argument dictionaries)
+#
+def query_args(name, args):
+    if len(args) < 1:
+        dblog.error("{}:query(), required to have at least one argument", name)
+        raise Exception("{}:query(), required to have at least one argument".format(name))
+    qsa = args[0]
+    if isinstance(qsa, six.string_types):
+        qsa = [ args[0] ]
+    elif not isinstance(qsa, list):
+        dblog.error("{}:query(), first argument must be string or array of strings:{}", name, args[0])
+        raise Exception("{}:query(), first argument must be string or array of strings:{}".format(name, args[0]))
+    if len(args) > 1:
+        asa = args[1]
+        if isinstance(asa, dict):
+            asa = [ args[1] for i in range(len(qsa)) ]
+        elif not isinstance(asa, list):
+            dblog.error("{}:query(), second argument must be dict or array of dicts:{}", name, args[1])
+            raise Exception("{}:query(), second argument must be dict or array of dicts:{}".format(name, args[1]))
+    else:
+        asa = [ {} for i in range(len(qsa)) ]
+    return qsa, asa
+
+#
+# args_many:
+#  the argument list of operation_many, a list of argument dictionaries
+#  (or sequences, for drivers with positional placeholders).
+#
+def args_many(name, al):
+    if not isinstance(al, (list, tuple)):
+        raise Exception("{}:operation_many(), requires a list of arguments".format(name))
+    return list(al)
+
+#
+# execute_many:
+#  adbapi interaction, run s once for each argument in al with the DB-API
+#  executemany, all in the transaction of the interaction.
+# returns:
+#  the number of rows affected, None if the driver doesn't say
+#
+def execute_many(cur, s, al):
+    cur.executemany(s, al)
+    if cur.rowcount is None or cur.rowcount < 0:
+        return None
+    return cur.rowcount
+
+#
+# run_operation:
+#  adbapi interaction, run s with arguments a, no result
+#
+def run_operation(cur, s, a):
+    cur.execute(s, a)
+
+#
+# adbapi_stats:
+#  occupancy of an adbapi.ConnectionPool: its size, the connections open,
+#  the threads busy and the calls waiting for a thread.  newer twisted
+#  threadpools keep these in _team, older ones in working and q.
+#
+def adbapi_stats(pool):
+    if pool is None:
+        return None
+    rv = { 'cp_min':pool.min, 'cp_max':pool.max, 'connections':len(pool.connections) }
+    tp = pool.threadpool
+    team = getattr(tp, '_team', None)
+    if team is not None:
+        s = team.statistics()
+        rv['busy'] = s.busyWorkerCount
+        rv['waiting'] = s.backloggedWorkCount
+    else:
+        rv['busy'] = len(getattr(tp, 'working', []))
+        q = getattr(tp, 'q', None)
+        rv['waiting'] = q.qsize() if q is not None else None
+    return rv
+
 class dbbase(object):
     __metaclass__ = ABCMeta
     """
@@ -79,6 +200,37 @@ class dbbase(object):
     def query(self,s,a):
         pass
 
+    #
+    # query_stream:
+    #  identical to query, except the rows are returned a page at a time
+    #  as progressive call results.  page_size (a keyword argument) is the
+    #  number of rows per page.  the final result of the call is the last
+    #  page.  a caller that doesn't ask for progressive results gets every
+    #  row in the final result, just like query.
+    #
+
+    @abstractmethod
+    def query_stream(self,s,a):
+        pass
+
+    #
+    # copy_in:
+    #  bulk load.
+    #  t - table to load
+    #  c - array of column names
+    #  r - rows, an array of arrays (or dictionaries keyed on column name),
+    #      or a string holding csv (format='csv') or tsv (format='tsv') text.
+    #      header=True skips the first line of the string.
+    # returns:
+    #  { 'rows': number of rows loaded, 'seconds': time taken, 'rows_per_sec': ... }
+    # note:
+    #  the load is one transaction, all of the rows go in or none do.
+    #
+
+    @abstractmethod
+    def copy_in(self,t,c,r):
+        pass
+
     #
     # operation:
     #  identical to query, except, there is no result returned.
@@ -94,6 +246,21 @@ class dbbase(object):
     def operation(self,s,a):
         pass
 
+    #
+    # operation_many:
+    #  run one operation for each entry of an array of arguments.
+    #  s - the sql, like operation
+    #  al - array of arguments, each like the a of operation
+    # returns:
+    #  { 'statements': number of times s was run, 'rows': total number of rows affected }
+    # note:
+    #  all of the runs are one transaction, if one fails none of them happen.
+    #
+
+    @abstractmethod
+    def operation_many(self,s,al):
+        pass
+
     #
     # watch:
     #  this is specific to postgres NOTIFY/LISTEN. other drivers will need to stub this out
@@ -103,6 +270,33 @@ class dbbase(object):
     def watch(self,s,a):
         pass
 
+    #
+    # unwatch:
+    #  let go of a watch, postgres only like watch
+    #
+
+    @abstractmethod
+    def unwatch(self,s,a):
+        pass
+
+    #
+    # begin, commit, rollback:
+    #  transactions that span calls, postgres only.  begin returns a handle
+    #  that query and operation take as txn=HANDLE.
+    #
+
+    @abstractmethod
+    def begin(self):
+        pass
+
+    @abstractmethod
+    def commit(self,txn):
+        pass
+
+    @abstractmethod
+    def rollback(self,txn):
+        pass
+
     #
     # info:
     #  this returns information about the current database connection
@@ -112,3 +306,40 @@ class dbbase(object):
     def info(self,s,a):
         pass
 
+    #
+    # slowlog:
+    #  the slow query log, drivers that don't keep one return None
+    #
+
+    def slowlog(self,*args,**kwargs):
+        return None
+
+    #
+    # pool_stats:
+    #  occupancy of the connection pool(s), for the stats procedure.
+    #  drivers without a pool return None.
+    #
+
+    def pool_stats(self):
+        return None
+
+    #
+    # cancel_caller:
+    #  caller (a WAMP session id) has left, stop its running calls.
+    #  returns how many were stopped.
+    #
+
+    def cancel_caller(self, caller):
+        return self.calls.cancel_caller(caller)
+
+    #
+    # run_call:
+    #  for the adbapi drivers.  interaction(cursor, *args) in a transaction
+    #  on a connection of pool, stopped with self.interrupt when it runs
+    #  longer than its timeout or its caller leaves, see calls.py
+    #
+
+    def run_call(self, pool, kwargs, interaction, *args):
+        call = self.calls.start(kwargs, calls.timeout_of(kwargs, self.timeout), timer=True)
+        return self.calls.finish(call, calls.run_interaction(pool, call, interaction, *args))
+
@@ -24,20 +24,97 @@
 ###############################################################################
 
 from __future__ import absolute_import
-import sys,os
+import sys,os,time,threading
+import six
 import MySQLdb
+import MySQLdb.cursors
 from twisted.enterprise import adbapi
 from twisted.python import log
+from twisted.internet import threads
 from twisted.internet.defer import inlineCallbacks, returnValue
 
-from .dbbase import dbbase
+from .dbbase import dbbase, adbapi_stats, stream_pages, query_args, args_many, execute_many, run_operation, PAGE_SIZE
+from .resultfmt import check_format, columnar, columns_of
+from .qcache import QueryCache, CACHE_SIZE
+from . import bulk, calls
+from .. import dblog
+
+#
+# pool defaults, the same as adbapi's
+#
+CP_MIN = 3
+CP_MAX = 5
+
+#
+# MySQLdb.connect wants these as numbers
+#
+int_args = ( 'port', 'connect_timeout', 'read_timeout', 'write_timeout', 'client_flag', )
+
+#
+# dsn_args
+#  db=x host=y whatever=z as a dictionary of MySQLdb.connect arguments,
+#  and a dictionary of the pool options (cp_min, cp_max, cp_reconnect)
+#  found in it.
+#
+def dsn_args(dsn):
+    kw = dict(s.split('=', 1) for s in dsn.split())
+    opts = {}
+    for k in ( 'cp_min', 'cp_max', 'cp_reconnect', ):
+        if k in kw:
+            opts[k] = kw.pop(k)
+    for k in int_args:
+        if k in kw:
+            kw[k] = int(kw[k])
+    return kw, opts
+
+#
+# truth
+#  a dsn option as a boolean
+#
+def truth(v):
+    if isinstance(v, six.string_types):
+        return v.lower() not in ( '0', 'f', 'false', 'n', 'no', 'off', '' )
+    return bool(v)
+
+#
+# run_queries
+#  adbapi interaction, run each query of qsa with the arguments of asa in
+#  one transaction, the same as the postgres driver does.
+# returns:
+#  array of results, one per query
+#
+def run_queries(cur, qsa, asa, fmt):
+    rsa = []
+    for qi in range(len(qsa)):
+        cur.execute(qsa[qi], asa[qi])
+        rvf = cur.fetchall()
+        if fmt == 'columnar':
+            rvf = columnar(rvf, columns_of(cur.description))
+        else:
+            rvf = list(rvf)
+        rsa.append(rvf)
+    return rsa
+
+#
+# stream_unbuffered
+#  adbapi interaction, stream_pages on a server side cursor.  the pool's
+#  cursors are DictCursors, which read the whole result into the bridge on
+#  execute, an SSDictCursor leaves the rows on the server until they are
+#  fetched.  it is closed before the transaction ends.
+#
+def stream_unbuffered(cur, s, a, page_size, progress):
+    ss = cur.connection.cursor(MySQLdb.cursors.SSDictCursor)
+    try:
+        return stream_pages(ss, s, a, page_size, progress)
+    finally:
+        ss.close()
 
 class MYSQL14_14(dbbase):
     """
     basic mysql 14.14 driver
     """
 
-    def __init__(self, topic_base, app_session, debug):
+    def __init__(self, topic_base, app_session, debug, **kwargs):
         if debug is not None and debug:
             log.startLogging(sys.stdout)
         log.msg("MYSQL14_14:__init__()")
@@ -48,6 +125,19 @@ class MYSQL14_14(dbbase):
         self.topic_base = topic_base
         self.app_session = app_session
         self.debug = debug
+        self.cp_min = int(kwargs.get('cp_min') or CP_MIN)
+        self.cp_max = int(kwargs.get('cp_max') or max(self.cp_min, CP_MAX))
+        self.cp_reconnect = True if kwargs.get('cp_reconnect') is None else truth(kwargs.get('cp_reconnect'))
+        self.pool_info = {}
+        self.page_size = int(kwargs.get('page_size') or PAGE_SIZE)
+        self.cache = QueryCache(int(kwargs.get('cache_size') if kwargs.get('cache_size') is not None else CACHE_SIZE))
+        # seconds a statement may run, 0 for no limit, see calls.py
+        self.timeout = float(kwargs.get('timeout') or 0)
+        self.calls = calls.Calls(topic_base, self.interrupt)
+        # the connection KILL QUERY is sent on, outside the pool, see
+        # interrupt.  kill_lock keeps to one kill on it at a time.
+        self.killer = None
+        self.kill_lock = threading.Lock()
         return
  
     #
@@ -59,16 +149,26 @@ class MYSQL14_14(dbbase):
     #  DBNAME is the database name
     #  MACHINE is the ip address or dns name of the machine
     #  DBUSER is the user to connect as
+    # note:
+    #  the dsn may also carry cp_min=N, cp_max=M and cp_reconnect=0/1.
+    #  these override the values given on the command line.  adbapi runs
+    #  the pool on a threadpool of its own, cp_min to cp_max threads, one
+    #  connection per thread.  rows come back as dictionaries (DictCursor),
+    #  like postgres.
     #
     def connect(self,*args,**kwargs):
         log.msg("MYSQL14_14:connect({} {})".format(args, kwargs))
         self.dsn = args[0]
-        # there must be an easier way.
-        # this converts db=x host=y shatever=z to a dictionary.
-        #dd=json.loads('{'+','.join(re.sub(r'([a-z0-9_-]*)=([a-z0-9_-]*)','"\\1":"\\2"',dsn).split())+'}')
+        kw, opts = dsn_args(self.dsn)
+        cp_min = int(opts.get('cp_min', self.cp_min))
+        cp_max = max(cp_min, int(opts.get('cp_max', self.cp_max)))
+        cp_reconnect = truth(opts.get('cp_reconnect', self.cp_reconnect))
         try:
-            self.conn = adbapi.ConnectionPool("MySQLdb",**dict(s.split('=') for s in self.dsn.split()))
-            log.msg("MYSQL14_14:connect() established")
+            self.conn = adbapi.ConnectionPool("MySQLdb",
+                cp_min=cp_min, cp_max=cp_max, cp_reconnect=cp_reconnect,
+                cursorclass=MySQLdb.cursors.DictCursor, **kw)
+            self.pool_info = { 'cp_min':cp_min, 'cp_max':cp_max, 'cp_reconnect':cp_reconnect }
+            log.msg("MYSQL14_14:connect() established, pool {}".format(self.pool_info))
         except Exception as err:
             log.msg("MYSQL14_14:connect({}),error({})".format(self.dsn,err))
             raise err
@@ -84,6 +184,12 @@ class MYSQL14_14(dbbase):
             c = self.conn
             self.conn = None
             c.close()
+        with self.kill_lock:
+            if self.killer is not None:
+                k = self.killer
+                self.killer = None
+                k.close()
+        self.cache.clear()
 
         return
 
@@ -103,26 +209,113 @@ class MYSQL14_14(dbbase):
     #  for example, a query that says 'insert into table x (c) values(r)'
     #  by its nature it doesn't return a row, so, this isn't the right
     #  method to use, use operation instead
+    # note:
+    #  the keyword argument format='columnar' returns the result as column
+    #  names plus arrays of values, see resultfmt.py
+    # note:
+    #  the keyword argument cache_ttl=N keeps the result for N seconds, and
+    #  the same query (same arguments, same authid) is answered from the
+    #  cache until then.  cache_channels is a postgres only feature.
+    # note:
+    #  like postgres, s may be an array of queries and a an array of
+    #  argument dictionaries.  they are run in one transaction and the
+    #  result is an array of results.
+    # note:
+    #  the keyword argument timeout=N stops the query after N seconds,
+    #  the default is --timeout.  so does the caller leaving.
     #
 
     @inlineCallbacks
     def query(self,*args, **kwargs):
-        log.msg("MYSQL14_14:query() ARGS:{} KWARGS:{}".format(args, kwargs))
+        dblog.debug("MYSQL14_14:query() ARGS:{} KWARGS:{}", args, kwargs)
+        qsa, asa = query_args('MYSQL14_14', args)
+        fmt = check_format(kwargs.get('format'))
+        if self.conn:
+            ttl = kwargs.get('cache_ttl')
+            if ttl:
+                if kwargs.get('cache_channels'):
+                    raise Exception("MYSQL14_14:query(), cache_channels can only be used in postgres")
+                ckey = self.cache.key(qsa, asa, fmt,
+                    kwargs['details'].authid if 'details' in kwargs else None)
+                rv = self.cache.get(ckey)
+                if rv is not None:
+                    dblog.debug("MYSQL14_14:query() cache hit")
+                    returnValue(rv)
+            try:
+                dblog.debug("MYSQL14_14:query().running({} with args {})", qsa,asa)
+                rv = yield self.run_call(self.conn, kwargs, run_queries, qsa, asa, fmt)
+                # a single query gets a single result, like postgres
+                if len(rv) == 1:
+                    rv = rv[0]
+                dblog.debug("MYSQL14_14:query().results({})", dblog.rows(rv))
+                if ttl:
+                    self.cache.put(ckey, rv, float(ttl))
+                returnValue(rv)
+            except Exception as err:
+                dblog.error("MYSQL14_14:query({}),error({})", qsa,err)
+                raise err
+
+        # error here, probably should raise exception
+        return
+
+    #
+    # query_stream:
+    #  identical to query, except the rows are returned page_size (keyword
+    #  argument) at a time as progressive results.  the pages are read with
+    #  fetchmany from a server side cursor, so only one page is held in the
+    #  bridge at a time.
+    #
+
+    @inlineCallbacks
+    def query_stream(self,*args,**kwargs):
+        dblog.debug("MYSQL14_14:query_stream() ARGS:{} KWARGS:{}", args, kwargs)
         s = args[0]
         a = args[1]
+        page_size = int(kwargs.get('page_size') or self.page_size)
+        progress = None
+        if 'details' in kwargs:
+            progress = getattr(kwargs['details'], 'progress', None)
         if self.conn:
             try:
-                log.msg("MYSQL14_14:query().running({} with args {})".format(s,a))
-                rv = yield self.conn.runQuery(s,a)
-                log.msg("MYSQL14_14:query().results({})".format(rv))
+                rv = yield self.run_call(self.conn, kwargs, stream_unbuffered, s, a, page_size, progress)
+                dblog.debug("MYSQL14_14:query_stream().results({})", dblog.rows(rv))
                 returnValue(rv)
             except Exception as err:
-                log.msg("MYSQL14_14:query({}),error({})".format(s,err))
+                dblog.error("MYSQL14_14:query_stream({}),error({})", s,err)
                 raise err
 
         # error here, probably should raise exception
         return
 
+    #
+    # copy_in:
+    #  bulk load table t, columns c, with rows r (see dbbase.py).  there is
+    #  no COPY here, the rows go in as multi row INSERTs of at most
+    #  10000 placeholders each, all in one transaction.
+    #
+
+    @inlineCallbacks
+    def copy_in(self,*args,**kwargs):
+        dblog.debug("MYSQL14_14:copy_in() ARGS:{} KWARGS:{}", args[:2], kwargs)
+        if len(args) < 3:
+            raise Exception("MYSQL14_14:copy_in(), requires table, columns and rows")
+        t = bulk.check_identifier(args[0])
+        c = [ bulk.check_identifier(w) for w in args[1] ]
+        r = bulk.rows_of(args[2], c, bulk.check_format(kwargs.get('format')), kwargs.get('header'))
+        if self.conn:
+            started = time.time()
+            try:
+                n = yield self.run_call(self.conn, kwargs, bulk.insert_rows, t, c, r, '%s', 10000)
+            except Exception as err:
+                dblog.error("MYSQL14_14:copy_in({}),error({})", t, err)
+                raise err
+            elapsed = time.time() - started
+            dblog.debug("MYSQL14_14:copy_in() {} rows in {} seconds", n, elapsed)
+            returnValue({ 'rows':n, 'seconds':elapsed, 'rows_per_sec':(n / elapsed) if elapsed > 0 else None })
+
+        # error here, probably should raise exception
+        return
+
     #
     # operation:
     #  identical to query, except, there is no result returned.
@@ -136,17 +329,42 @@ class MYSQL14_14(dbbase):
 
     @inlineCallbacks
     def operation(self,*args, **kwargs):
-        log.msg("MYSQL14_14:operation() ARGS:{} KWARGS:{}".format(args, kwargs))
+        dblog.debug("MYSQL14_14:operation() ARGS:{} KWARGS:{}", args, kwargs)
         s = args[0]
         a = args[1]
         if self.conn:
             try:
-                log.msg("MYSQL14_14:query().running({} with args {})".format(s,a))
-                rv = yield self.conn.runOperation(s,a)
-                log.msg("MYSQL14_14:query().results({})".format(rv))
+                dblog.debug("MYSQL14_14:query().running({} with args {})", s,a)
+                rv = yield self.run_call(self.conn, kwargs, run_operation, s, a)
+                dblog.debug("MYSQL14_14:query().results({})", dblog.rows(rv))
                 returnValue(rv)
             except Exception as err:
-                log.msg("MYSQL14_14:query({}),error({})".format(s,err))
+                dblog.error("MYSQL14_14:query({}),error({})", s,err)
+                raise err
+
+        # error here, probably should raise exception
+        return
+
+    #
+    # operation_many:
+    #  one statement, many argument lists, one executemany in one transaction
+    #
+
+    @inlineCallbacks
+    def operation_many(self,*args,**kwargs):
+        dblog.debug("MYSQL14_14:operation_many() ARGS:{} KWARGS:{}", args[:1], kwargs)
+        if len(args) < 2:
+            raise Exception("MYSQL14_14:operation_many(), requires sql and a list of arguments")
+        s = args[0]
+        al = args_many('MYSQL14_14', args[1])
+        if self.conn:
+            try:
+                dblog.debug("MYSQL14_14:operation_many().running({} {} times)", s, len(al))
+                n = yield self.run_call(self.conn, kwargs, execute_many, s, al)
+                dblog.debug("MYSQL14_14:operation_many() {} rows", n)
+                returnValue({ 'statements':len(al), 'rows':n })
+            except Exception as err:
+                dblog.error("MYSQL14_14:operation_many({}),error({})", s,err)
                 raise err
 
         # error here, probably should raise exception
@@ -161,6 +379,77 @@ class MYSQL14_14(dbbase):
         raise Exception("mysql is trying to add watch, can only do this in postgres ")
         return
 
+    def unwatch(self,*args,**kwargs):
+        raise Exception("mysql is trying to remove watch, can only do this in postgres ")
+        return
+
+    def begin(self,*args,**kwargs):
+        raise Exception("mysql is trying to begin a transaction, can only do this in postgres ")
+        return
+
+    def commit(self,*args,**kwargs):
+        raise Exception("mysql is trying to commit a transaction, can only do this in postgres ")
+        return
+
+    def rollback(self,*args,**kwargs):
+        raise Exception("mysql is trying to roll back a transaction, can only do this in postgres ")
+        return
+
+    #
+    # interrupt:
+    #  stop the statement call is running.  MySQLdb has no way to do that
+    #  from another thread, so KILL QUERY it from a connection of its own.
+    #  not one of the pool's, the pool is likely full of the very statements
+    #  that need stopping, and a kill waiting behind them never fires.
+    #
+
+    def interrupt(self, call):
+        if call.conn is None or self.conn is None:
+            return
+        d = threads.deferToThread(self.kill_query, call)
+        d.addErrback(lambda err: dblog.error("MYSQL14_14:interrupt(),error({})", err.value))
+
+    #
+    # kill_query:
+    #  runs in a thread.  KILL QUERY the connection call is running on, if
+    #  it still is.  call.lock is held from that check to the kill, so the
+    #  connection can't be back in the pool running another caller's
+    #  statement by then.
+    #
+
+    def kill_query(self, call):
+        with self.kill_lock:
+            if self.killer is None:
+                kw, opts = dsn_args(self.dsn)
+                self.killer = MySQLdb.connect(**kw)
+            with call.lock:
+                conn = call.conn
+                if conn is None:
+                    return
+                tid = int(conn.thread_id())
+                dblog.debug("MYSQL14_14:kill_query() kill query {}", tid)
+                try:
+                    cur = self.killer.cursor()
+                    cur.execute('kill query {}'.format(tid))
+                    cur.close()
+                except Exception:
+                    # try a new connection next time
+                    k = self.killer
+                    self.killer = None
+                    try:
+                        k.close()
+                    except Exception:
+                        pass
+                    raise
+
+    #
+    # pool_stats:
+    #  the adbapi pool, see dbbase.py
+    #
+
+    def pool_stats(self):
+        return adbapi_stats(self.conn)
+
     #
     # info:
     #  return information about this connection
@@ -168,13 +457,18 @@ class MYSQL14_14(dbbase):
 
     @inlineCallbacks
     def info(self,*args,**kwargs):
-        log.msg("MYSQL14_14:info({},{})".format(args,kwargs))
+        dblog.debug("MYSQL14_14:info({},{})", args,kwargs)
         rv = yield [{
             "engine":self.engine,
             "engine_version":self.engine_version,
             "dsn":self.dsn,
             "topic_base":self.topic_base,
-            "debug":self.debug
+            "debug":self.debug,
+            "page_size":self.page_size,
+            "pool":dict(self.pool_info, size=len(self.conn.connections) if self.conn else 0),
+            "cache":self.cache.info(),
+            "timeout":self.timeout,
+            "calls":self.calls.info()
         }]
         returnValue(rv)
         return
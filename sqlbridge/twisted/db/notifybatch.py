@@ -0,0 +1,120 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## notifybatch.py - batched publishing of NOTIFY payloads
+##
+## a bulk update on a table with a NOTIFY trigger sends one notification
+## per row.  published one at a time that is tens of thousands of events a
+## second for the router.  a watch asked for with batching collects the
+## payloads instead, and publishes them as one array when the first of
+## them has waited batch_ms milliseconds or batch_max of them are waiting.
+## with dedup a payload already waiting in the batch isn't added again.
+###############################################################################
+
+from __future__ import absolute_import
+
+from twisted.internet import reactor
+
+#
+# defaults for a batched watch
+#
+BATCH_MS = 100
+BATCH_MAX = 1000
+
+#
+# batch_topic
+#  the topic of a batched watch, derived from the watch's topic and the
+#  batching settings, so watchers that ask for the same batching share it
+#
+def batch_topic(topic, batch_ms, batch_max, dedup):
+    return '{}.batch_{}_{}{}'.format(topic, int(batch_ms), int(batch_max), '_dedup' if dedup else '')
+
+#
+# parse_suffix
+#  the batching settings of a batch_topic suffix, like batch_100_1000_dedup,
+#  or None if it isn't one
+#
+def parse_suffix(suffix):
+    w = suffix.split('_')
+    if len(w) not in ( 3, 4 ) or w[0] != 'batch' or (len(w) == 4 and w[3] != 'dedup'):
+        return None
+    try:
+        return { 'batch_ms':int(w[1]), 'batch_max':int(w[2]), 'dedup':len(w) == 4 }
+    except ValueError:
+        return None
+
+class Batch(object):
+    """
+    payloads waiting to be published to one topic
+    """
+
+    filter = None
+
+    def __init__(self, publish, topic, batch_ms=BATCH_MS, batch_max=BATCH_MAX, dedup=False, clock=reactor):
+        self.publish = publish
+        self.topic = topic
+        self.delay = batch_ms / 1000.0
+        self.max = max(1, int(batch_max))
+        self.dedup = dedup
+        self.clock = clock
+        self.pending = []
+        self.seen = set()
+        self.timer = None
+        self.stats = { 'notifications':0, 'published':0, 'batches':0, 'duplicates':0 }
+
+    def add(self, payload):
+        self.stats['notifications'] += 1
+        if self.dedup:
+            if payload in self.seen:
+                self.stats['duplicates'] += 1
+                return
+            self.seen.add(payload)
+        self.pending.append(payload)
+        if len(self.pending) >= self.max:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.clock.callLater(self.delay, self.flush)
+
+    def flush(self):
+        if self.timer is not None:
+            if self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        payloads, self.pending = self.pending, []
+        self.seen = set()
+        self.stats['batches'] += 1
+        self.stats['published'] += len(payloads)
+        self.publish(self.topic, payloads)
+
+    #
+    # stop
+    #  drop whatever is waiting, the watch is going away
+    #
+    def stop(self):
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        self.pending = []
+        self.seen = set()
+
+    def info(self):
+        return dict(self.stats, batch_ms=self.delay * 1000.0, batch_max=self.max, dedup=self.dedup,
+            waiting=len(self.pending))
@@ -0,0 +1,220 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## pgpool.py - connection pool for the postgres driver
+##
+## txpostgres connections can only run one statement at a time, so a single
+## connection serializes every caller.  this pool keeps between cp_min and
+## cp_max connections open.  callers check a connection out, run their work
+## on it, and check it back in.  when every connection is busy and the pool
+## is at cp_max the caller waits in a fifo queue for the next free one.
+###############################################################################
+
+from __future__ import absolute_import
+import collections
+
+from twisted.python import log
+from twisted.internet import defer
+
+#
+# dsn_options
+#  the dsn is a string of key=value words.  this pulls the words that are
+#  meant for us (like cp_min and cp_max) out of the dsn, and returns the
+#  remaining dsn (suitable for the database driver) and a dictionary of
+#  the words that were removed.
+#
+def dsn_options(dsn, keys):
+    rest = []
+    opts = {}
+    for w in dsn.split():
+        k, sep, v = w.partition('=')
+        if sep and k in keys:
+            opts[k] = v
+        else:
+            rest.append(w)
+    return ' '.join(rest), opts
+
+class PoolClosed(Exception):
+    pass
+
+class ConnectionPool(object):
+    """
+    pool of txpostgres connections
+    """
+
+    def __init__(self, connectionFactory, dsn, cp_min=1, cp_max=1):
+        if cp_min < 0 or cp_max < 1 or cp_min > cp_max:
+            raise Exception("ConnectionPool: bad sizes cp_min {} cp_max {}".format(cp_min, cp_max))
+        self.connectionFactory = connectionFactory
+        self.dsn = dsn
+        self.min = cp_min
+        self.max = cp_max
+        self.size = 0
+        self.idle = []
+        self.busy = set()
+        self.waiting = collections.deque()
+        self.closed = False
+        self.checkouts = 0
+        self.waits = 0
+        return
+
+    #
+    # start
+    #  open cp_min connections.  the deferred fires when they are all
+    #  connected, or errbacks with the first connection error.
+    #
+    @defer.inlineCallbacks
+    def start(self):
+        log.msg("ConnectionPool:start() min {} max {}".format(self.min, self.max))
+        dl = [ self._open() for i in range(self.min) ]
+        conns = yield defer.gatherResults(dl, consumeErrors=True)
+        for c in conns:
+            self.idle.append(c)
+        defer.returnValue(self)
+
+    @defer.inlineCallbacks
+    def _open(self):
+        self.size += 1
+        c = self.connectionFactory()
+        try:
+            yield c.connect(self.dsn)
+        except Exception:
+            self.size -= 1
+            raise
+        defer.returnValue(c)
+
+    #
+    # checkout
+    #  returns a deferred that fires with a connection that belongs to the
+    #  caller until it is handed back with checkin.
+    #
+    def checkout(self):
+        if self.closed:
+            return defer.fail(PoolClosed("connection pool is closed"))
+        self.checkouts += 1
+        if self.idle:
+            c = self.idle.pop()
+            self.busy.add(c)
+            return defer.succeed(c)
+        if self.size < self.max:
+            d = self._open()
+            d.addCallback(self._lend)
+            return d
+        self.waits += 1
+        d = defer.Deferred(self._cancelWait)
+        self.waiting.append(d)
+        return d
+
+    def _lend(self, c):
+        self.busy.add(c)
+        return c
+
+    def _cancelWait(self, d):
+        try:
+            self.waiting.remove(d)
+        except ValueError:
+            pass
+
+    #
+    # checkin
+    #  return a connection to the pool.  broken connections are dropped, and
+    #  if someone is waiting a replacement is opened for them.
+    #
+    def checkin(self, c):
+        self.busy.discard(c)
+        if self.closed or broken(c):
+            self._discard(c)
+            if self.waiting and not self.closed and self.size < self.max:
+                w = self.waiting.popleft()
+                self._open().addCallback(self._lend).chainDeferred(w)
+            return
+        if self.waiting:
+            self.busy.add(c)
+            self.waiting.popleft().callback(c)
+            return
+        self.idle.append(c)
+
+    def _discard(self, c):
+        self.size -= 1
+        try:
+            c.close()
+        except Exception:
+            pass
+
+    #
+    # runWithConnection
+    #  check out a connection, call f(connection, *args, **kwargs), and check
+    #  the connection back in no matter how f turns out.
+    #
+    @defer.inlineCallbacks
+    def runWithConnection(self, f, *args, **kwargs):
+        c = yield self.checkout()
+        try:
+            rv = yield defer.maybeDeferred(f, c, *args, **kwargs)
+        finally:
+            self.checkin(c)
+        defer.returnValue(rv)
+
+    def runInteraction(self, interaction, *args, **kwargs):
+        return self.runWithConnection(lambda c: c.runInteraction(interaction, *args, **kwargs))
+
+    def runOperation(self, *args, **kwargs):
+        return self.runWithConnection(lambda c: c.runOperation(*args, **kwargs))
+
+    def runQuery(self, *args, **kwargs):
+        return self.runWithConnection(lambda c: c.runQuery(*args, **kwargs))
+
+    #
+    # close
+    #  close idle connections now, busy ones as they are checked in, and
+    #  fail anybody still waiting.
+    #
+    def close(self):
+        self.closed = True
+        while self.idle:
+            self._discard(self.idle.pop())
+        while self.waiting:
+            self.waiting.popleft().errback(PoolClosed("connection pool is closed"))
+        return
+
+    #
+    # stats
+    #  pool occupancy, suitable for info()
+    #
+    def stats(self):
+        return {
+            "cp_min":self.min,
+            "cp_max":self.max,
+            "size":self.size,
+            "idle":len(self.idle),
+            "busy":len(self.busy),
+            "waiting":len(self.waiting),
+            "checkouts":self.checkouts,
+            "waits":self.waits
+        }
+
+#
+# broken
+#  true if the underlying psycopg2 connection has gone away
+#
+def broken(c):
+    try:
+        return bool(c.closed)
+    except Exception:
+        return True
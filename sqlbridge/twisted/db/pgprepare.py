@@ -0,0 +1,136 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## pgprepare.py - prepared statement cache for the postgres driver
+##
+## a statement text that has been seen PREPARE_AFTER times is turned into
+## PREPARE sqlbridge_ps_N AS ... with the %(name)s placeholders rewritten as
+## $1, $2, ...  later runs of the same text on that connection send
+## EXECUTE sqlbridge_ps_N(%(name)s, ...) instead, so postgres skips parsing
+## and planning.  each connection keeps at most prepare_max statements, the
+## least recently used one is DEALLOCATEd to make room.
+###############################################################################
+
+from __future__ import absolute_import
+import re, collections
+
+#
+# statements seen this many times get prepared
+#
+PREPARE_AFTER = 2
+
+#
+# default number of prepared statements kept per connection
+#
+PREPARE_MAX = 100
+
+#
+# the sighting counts are forgotten when this many texts have been seen
+#
+SEEN_MAX = 10000
+
+# only these can be prepared
+preparable = ( 'select', 'insert', 'update', 'delete', 'values', 'with', )
+
+placeholder = re.compile(r'%\((\w+)\)s|%%|%')
+
+#
+# translate
+#  s - statement text using %(name)s placeholders
+# returns:
+#  (text using $1..$n, [ name1 .. namen ]), or None if s can't be prepared
+#
+def translate(s):
+    w = s.lstrip().split(None, 1)
+    if not w or w[0].lower() not in preparable:
+        return None
+    if ';' in s.rstrip().rstrip(';'):
+        return None
+    names = []
+    out = []
+    pos = 0
+    for m in placeholder.finditer(s):
+        out.append(s[pos:m.start()])
+        pos = m.end()
+        tok = m.group(0)
+        if tok == '%%':
+            out.append('%')
+        elif tok == '%':
+            # positional %s, leave those to psycopg2
+            return None
+        else:
+            n = m.group(1)
+            if n not in names:
+                names.append(n)
+            out.append('${}'.format(names.index(n) + 1))
+    out.append(s[pos:])
+    return ''.join(out).rstrip().rstrip(';'), names
+
+#
+# plain
+#  true if every argument is a plain value.  lists are adapted to IN (...)
+#  lists (see rdc in postgres.py) which can't be a parameter.
+#
+def plain(a, names):
+    for n in names:
+        if n in a and isinstance(a[n], (list, tuple, dict)):
+            return False
+    return True
+
+class PreparedStatements(object):
+    """
+    prepared statements of one connection, least recently used first
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.statements = collections.OrderedDict()
+        # set after a failed transaction, the statements on the server are
+        # unknown, so they are all DEALLOCATEd before the next PREPARE
+        self.stale = False
+
+    #
+    # get
+    #  (name, names) of the prepared statement for text s, or None
+    #
+    def get(self, s):
+        ps = self.statements.pop(s, None)
+        if ps is not None:
+            self.statements[s] = ps
+        return ps
+
+    #
+    # add
+    #  remember a prepared statement.  returns the name of the statement
+    #  that fell off the end and must be DEALLOCATEd, or None
+    #
+    def add(self, s, name, names):
+        self.statements[s] = (name, names)
+        if len(self.statements) > self.size:
+            old = self.statements.popitem(last=False)
+            return old[1][0]
+        return None
+
+    def forget(self):
+        if self.statements:
+            self.statements.clear()
+            self.stale = True
+
+    def __len__(self):
+        return len(self.statements)
@@ -0,0 +1,274 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## pgreplica.py - read replica routing for the postgres driver
+##
+## the postgres driver can be given replica dsns besides the primary one.
+## each replica gets a connection pool of its own.  single statement
+## queries that only read (see reads_only) go to the replica with the fewest
+## queries outstanding, anything that may write (operation, operation_many,
+## copy_in, arrays of queries, an insert ... returning through query) goes
+## to the primary.
+##
+## every lag_interval seconds each replica is asked how far behind the
+## primary it is.  a replica more than max_lag seconds behind, or one that
+## can't be asked, is taken out of rotation until it catches up.
+##
+## with a sticky window, a caller that wrote reads from the primary for
+## that many seconds afterwards, so it sees its own writes.
+###############################################################################
+
+from __future__ import absolute_import
+import re, time
+
+from twisted.python import log
+from twisted.internet import task
+from twisted.internet.defer import inlineCallbacks, returnValue, DeferredList
+
+from .pgpool import ConnectionPool, dsn_options
+from .. import dblog
+
+#
+# defaults, seconds
+#
+MAX_LAG = 30.0
+LAG_INTERVAL = 5.0
+
+#
+# how far behind the primary a replica is, 0 when it has replayed all it
+# has received (an idle primary sends nothing, so the replay timestamp
+# alone would make the replica look further and further behind).
+# these are the 9.x function names.
+#
+lag_query = """
+select case
+    when not pg_is_in_recovery() then 0
+    when pg_last_xlog_receive_location() = pg_last_xlog_replay_location() then 0
+    else coalesce(extract(epoch from now() - pg_last_xact_replay_timestamp()), 0)
+  end as lag
+"""
+
+#
+# comments and whitespace ahead of a statement's first word
+#
+leading = re.compile(r'^(\s+|--[^\n]*(\n|$)|/\*.*?\*/|\()+', re.S)
+
+#
+# words that make a select or with write, or lock rows, which a standby
+# won't do.  select into creates a table, a with can hold an insert,
+# update or delete, for update/share locks.
+#
+writes = re.compile(r'\b(insert|update|delete|into|share|lock|nextval|setval)\b', re.I)
+
+#
+# reads_only
+#  True if statement s is a select, or a with whose parts are all
+#  selects, so it can run on a replica.  a word from writes anywhere in
+#  it, even in a string, keeps it on the primary, the safe side.  a
+#  select of a function that writes can't be told apart, call it with
+#  primary=True.
+#
+def reads_only(s):
+    s = leading.sub('', s)
+    first = s.split(None, 1)[0].lower() if s.strip() else ''
+    return first in ( 'select', 'with' ) and writes.search(s) is None
+
+class Replica(object):
+    """
+    one replica, its pool and its health
+    """
+
+    def __init__(self, dsn, pool):
+        self.dsn = dsn
+        self.pool = pool
+        self.outstanding = 0
+        self.healthy = False
+        self.lag = None
+        self.queries = 0
+        self.errors = 0
+        self.checked = None
+
+    def info(self):
+        return {
+            'dsn':self.dsn,
+            'healthy':self.healthy,
+            'lag':self.lag,
+            'outstanding':self.outstanding,
+            'queries':self.queries,
+            'errors':self.errors,
+            'pool':self.pool.stats()
+        }
+
+class ReplicaSet(object):
+    """
+    the replicas of one primary
+    """
+
+    def __init__(self, dsns, max_lag=MAX_LAG, lag_interval=LAG_INTERVAL, sticky=0, clock=time.time):
+        self.dsns = list(dsns or [])
+        self.max_lag = float(max_lag)
+        self.lag_interval = float(lag_interval)
+        self.sticky = float(sticky or 0)
+        self.clock = clock
+        self.replicas = []
+        # caller session -> time its reads may go to replicas again
+        self.writers = {}
+        self.next = 0
+        self.loop = None
+        # reads sent to a replica, and reads kept on the primary because
+        # they were pinned there, the caller wrote recently, or no
+        # replica was in rotation
+        self.stats = { 'replica':0, 'pinned':0, 'sticky':0, 'unavailable':0 }
+
+    def __len__(self):
+        return len(self.replicas)
+
+    #
+    # start
+    #  open a pool per replica.  cp_min/cp_max are the defaults, a replica
+    #  dsn may carry its own.  a replica that can't be reached now is kept,
+    #  out of rotation, the lag check brings it in when it comes up.
+    #
+    @inlineCallbacks
+    def start(self, factory, cp_min, cp_max):
+        for dsn in self.dsns:
+            pool_dsn, opts = dsn_options(dsn, ('cp_min', 'cp_max'))
+            rmin = int(opts.get('cp_min', cp_min))
+            rmax = max(rmin, int(opts.get('cp_max', cp_max)))
+            self.replicas.append(Replica(dsn, ConnectionPool(factory, pool_dsn, cp_min=rmin, cp_max=rmax)))
+        for r in self.replicas:
+            try:
+                yield r.pool.start()
+            except Exception as err:
+                log.msg("pgreplica: replica {} not available, error({})".format(r.dsn, err))
+        yield self.check()
+        if self.replicas and self.lag_interval > 0:
+            self.loop = task.LoopingCall(self.check)
+            self.loop.start(self.lag_interval, now=False)
+
+    def close(self):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.loop = None
+        for r in self.replicas:
+            r.pool.close()
+        self.replicas = []
+        self.writers = {}
+
+    #
+    # check
+    #  ask every replica for its lag, and take the ones that are too far
+    #  behind (or don't answer) out of rotation.
+    #
+    def check(self):
+        return DeferredList([ self.check_one(r) for r in self.replicas ])
+
+    @inlineCallbacks
+    def check_one(self, r):
+        try:
+            rv = yield r.pool.runQuery(lag_query)
+            r.lag = float(rv[0]['lag'])
+            healthy = r.lag <= self.max_lag
+        except Exception as err:
+            dblog.error("pgreplica: lag check of {} failed, error({})", r.dsn, err)
+            r.lag = None
+            healthy = False
+        r.checked = self.clock()
+        if healthy != r.healthy:
+            log.msg("pgreplica: replica {} {} rotation, lag {}".format(r.dsn,
+                'back in' if healthy else 'out of', r.lag))
+        r.healthy = healthy
+        self.expire()
+
+    #
+    # wrote
+    #  caller (a WAMP session id) has written, its reads go to the primary
+    #  for the sticky window
+    #
+    def wrote(self, caller):
+        if self.sticky > 0 and caller is not None and self.replicas:
+            self.writers[caller] = self.clock() + self.sticky
+
+    def expire(self):
+        now = self.clock()
+        for caller in [ c for c, t in self.writers.items() if t <= now ]:
+            del self.writers[caller]
+
+    #
+    # pick
+    #  the replica a read by caller should go to, or None for the primary.
+    #  the healthy replica with the fewest outstanding queries wins, ties
+    #  are taken in turn.  pinned reads (arrays of queries, which may
+    #  write) always go to the primary.
+    #
+    def pick(self, caller, pinned=False):
+        if not self.replicas:
+            return None
+        if pinned:
+            self.stats['pinned'] += 1
+            return None
+        if caller is not None and caller in self.writers:
+            if self.writers[caller] > self.clock():
+                self.stats['sticky'] += 1
+                return None
+            del self.writers[caller]
+        n = len(self.replicas)
+        best = None
+        for i in range(n):
+            r = self.replicas[(self.next + i) % n]
+            if r.healthy and (best is None or r.outstanding < best.outstanding):
+                best = r
+        if best is None:
+            self.stats['unavailable'] += 1
+            return None
+        self.next = (self.replicas.index(best) + 1) % n
+        self.stats['replica'] += 1
+        return best
+
+    #
+    # run
+    #  f(conn) on a connection of replica r, counting it as outstanding
+    #  while it runs
+    #
+    def run(self, r, f):
+        r.outstanding += 1
+        r.queries += 1
+
+        def done(rv):
+            r.outstanding -= 1
+            return rv
+
+        def failed(err):
+            r.errors += 1
+            return err
+
+        d = r.pool.runWithConnection(f)
+        d.addErrback(failed)
+        d.addBoth(done)
+        return d
+
+    def info(self):
+        return {
+            'sticky':self.sticky,
+            'max_lag':self.max_lag,
+            'lag_interval':self.lag_interval,
+            'sticky_callers':len(self.writers),
+            'routed':self.stats,
+            'replicas':[ r.info() for r in self.replicas ]
+        }
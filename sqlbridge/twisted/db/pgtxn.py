@@ -0,0 +1,191 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## pgtxn.py - transactions that span calls, for the postgres driver
+##
+## begin checks a connection out of the pool, starts a transaction on it and
+## returns a handle.  query, operation, operation_many and query_stream
+## called with txn=HANDLE run on that connection, in that transaction, one
+## at a time, and commit or rollback ends it and checks the connection back
+## in.  only the session that called begin can use its handle.
+##
+## a pinned connection is one the rest of the callers can't have, so a
+## transaction that sits idle (no call running) for idle_timeout seconds is
+## rolled back, and one whose caller leaves the router is too.
+###############################################################################
+
+from __future__ import absolute_import
+import time, uuid
+
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredLock
+
+from autobahn.wamp.exception import ApplicationError
+
+#
+# seconds a transaction may sit with no call running
+#
+IDLE_TIMEOUT = 60.0
+
+#
+# isolation levels begin takes
+#
+ISOLATION = ( 'read committed', 'repeatable read', 'serializable', )
+
+#
+# begin_sql
+#  the statement that starts a transaction with isolation (None for the
+#  server's default) and read_only
+#
+def begin_sql(isolation=None, read_only=False):
+    modes = []
+    if isolation is not None:
+        level = ' '.join(isolation.lower().replace('_', ' ').split())
+        if level not in ISOLATION:
+            raise Exception("pgtxn: unknown isolation level {}, valid levels are {}".format(isolation,
+                ', '.join(ISOLATION)))
+        modes.append('isolation level ' + level)
+    if read_only:
+        modes.append('read only')
+    if not modes:
+        return 'begin'
+    return 'begin ' + ', '.join(modes)
+
+class Transaction(object):
+    """
+    one open transaction and the connection it has pinned
+    """
+
+    def __init__(self, handle, caller, conn, idle_timeout):
+        self.handle = handle
+        self.caller = caller
+        self.conn = conn
+        self.idle_timeout = idle_timeout
+        # one statement at a time on the connection
+        self.lock = DeferredLock()
+        # the statement_timeout last set in the transaction, ms
+        self.timeout_ms = 0
+        self.busy = 0
+        self.timer = None
+        self.started = time.time()
+        self.calls = 0
+
+    def info(self):
+        return {
+            'caller':self.caller,
+            'age':round(time.time() - self.started, 3),
+            'calls':self.calls,
+            'busy':self.busy > 0,
+            'idle_timeout':self.idle_timeout
+        }
+
+class Transactions(object):
+    """
+    the open transactions of a driver, by handle
+    """
+
+    def __init__(self, topic_base, expire, idle_timeout=IDLE_TIMEOUT, clock=reactor):
+        self.topic_base = topic_base
+        # expire(t) rolls back t, it sat idle too long
+        self.expire = expire
+        self.idle_timeout = float(idle_timeout)
+        self.clock = clock
+        self.open = {}
+        self.stats = { 'begun':0, 'committed':0, 'rolled_back':0, 'expired':0 }
+
+    #
+    # add
+    #  a transaction was started on conn for caller, returns it
+    #
+    def add(self, conn, caller, idle_timeout=None):
+        t = Transaction('txn_' + uuid.uuid4().hex, caller, conn,
+            self.idle_timeout if idle_timeout is None else float(idle_timeout))
+        self.open[t.handle] = t
+        self.stats['begun'] += 1
+        self.idle(t)
+        return t
+
+    #
+    # get
+    #  the transaction of handle, for caller
+    #
+    def get(self, handle, caller):
+        t = self.open.get(handle)
+        if t is None or (t.caller is not None and t.caller != caller):
+            raise ApplicationError(self.topic_base + '.error.no_transaction',
+                "no transaction {}, it was committed, rolled back or timed out".format(handle))
+        return t
+
+    #
+    # start, stop
+    #  a call starts or stops using t.  the idle timer only runs while
+    #  no call is running or waiting.
+    #
+    def start(self, t):
+        t.busy += 1
+        t.calls += 1
+        if t.timer is not None and t.timer.active():
+            t.timer.cancel()
+        t.timer = None
+
+    def stop(self, t):
+        t.busy -= 1
+        if t.busy <= 0 and t.handle in self.open:
+            self.idle(t)
+
+    def idle(self, t):
+        if t.idle_timeout > 0:
+            t.timer = self.clock.callLater(t.idle_timeout, self.expired, t)
+
+    def expired(self, t):
+        t.timer = None
+        if t.handle in self.open and t.busy <= 0:
+            self.stats['expired'] += 1
+            self.expire(t)
+
+    #
+    # remove
+    #  t is ending, it can't be used any more.  returns False if it had
+    #  already ended.
+    #
+    def remove(self, t):
+        if self.open.pop(t.handle, None) is None:
+            return False
+        if t.timer is not None and t.timer.active():
+            t.timer.cancel()
+        t.timer = None
+        return True
+
+    #
+    # ended
+    #  a transaction was committed or rolled back
+    #
+    def ended(self, how):
+        self.stats[how] += 1
+
+    #
+    # of_caller
+    #  the transactions of caller, it has left
+    #
+    def of_caller(self, caller):
+        return [ t for t in self.open.values() if t.caller == caller ]
+
+    def info(self):
+        return dict(self.stats, open=len(self.open), idle_timeout=self.idle_timeout,
+            transactions=[ t.info() for t in self.open.values() ])
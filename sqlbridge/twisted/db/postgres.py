@@ -24,60 +24,242 @@
 ###############################################################################
 
 from __future__ import absolute_import
-import sys,os,string,random,types
+import sys,os,types,itertools,io,time,json,calendar
 import six
 import psycopg2
 import psycopg2.extras
-from psycopg2.extensions import SQL_IN, register_adapter
+from psycopg2.extensions import SQL_IN, register_adapter, register_type, new_type, new_array_type, QueryCanceledError
 from txpostgres import txpostgres
 
 from twisted.python import log
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet import threads
+from twisted.internet.defer import inlineCallbacks, returnValue, DeferredLock, fail
 
-from .dbbase import dbbase
+from .dbbase import dbbase, query_args, args_many, PAGE_SIZE
+from .. import dblog
+from .pgpool import ConnectionPool, dsn_options
+from .resultfmt import check_format, columnar, columns_of
+from . import pgprepare, pgreplica, pgtxn, slowlog, calls, notifybatch, watches, watchfilter
+from .qcache import QueryCache, CACHE_SIZE, channels_of
+from . import bulk
+
+#
+# the typecasters psycopg2 comes with, by oid
+#
+builtin_types = dict(psycopg2.extensions.string_types)
+
+#
+# every column as text
+#
+AS_TEXT = new_type(tuple(builtin_types), 'SQLBRIDGE_TEXT', lambda v, cur: v)
+
+#
+# typed mode (--typed) keeps these as psycopg2 casts them: bool, int2,
+# int4, int8, oid, float4, float8 and their arrays
+#
+NATIVE_OIDS = ( 16, 21, 23, 20, 26, 700, 701, 1000, 1005, 1007, 1016, 1028, 1021, 1022, )
+
+#
+# and numeric comes back a float, rather than a Decimal no serializer
+# knows, and timestamps come back seconds since the epoch (a timestamp
+# without time zone is taken to be UTC)
+#
+def as_float(v, cur):
+    return float(v) if v is not None else None
+
+def as_epoch(caster):
+    def cast(v, cur):
+        t = caster(v, cur)
+        if t is None:
+            return None
+        return calendar.timegm(t.utctimetuple()) + t.microsecond / 1000000.0
+    return cast
+
+NUMERIC = new_type(( 1700, ), 'SQLBRIDGE_NUMERIC', as_float)
+TIMESTAMP = new_type(( 1114, ), 'SQLBRIDGE_TIMESTAMP', as_epoch(builtin_types[1114]))
+TIMESTAMPTZ = new_type(( 1184, ), 'SQLBRIDGE_TIMESTAMPTZ', as_epoch(builtin_types[1184]))
+typed_types = ( NUMERIC, TIMESTAMP, TIMESTAMPTZ,
+    new_array_type(( 1231, ), 'SQLBRIDGE_NUMERICARRAY', NUMERIC),
+    new_array_type(( 1115, ), 'SQLBRIDGE_TIMESTAMPARRAY', TIMESTAMP),
+    new_array_type(( 1185, ), 'SQLBRIDGE_TIMESTAMPTZARRAY', TIMESTAMPTZ), )
+
+#
+# cast_types
+#  the typecasters of connection c.  they belong to the connection, the
+#  process wide ones are left alone.
+#
+def cast_types(c, typed):
+    register_type(AS_TEXT, c)
+    if not typed:
+        return
+    for oid in NATIVE_OIDS:
+        if oid in builtin_types:
+            register_type(builtin_types[oid], c)
+    for t in typed_types:
+        register_type(t, c)
+    psycopg2.extras.register_default_json(c, loads=json.loads)
+    psycopg2.extras.register_default_jsonb(c, loads=json.loads)
 
 def rdc(*args, **kwargs):
+    return connect_rdc(False, args, kwargs)
+
+def typed_rdc(*args, **kwargs):
+    return connect_rdc(True, args, kwargs)
+
+def connect_rdc(typed, args, kwargs):
     kwargs['connection_factory'] = psycopg2.extras.RealDictConnection
-    # this is to let everything pass through as strings
-    psycopg2.extensions.string_types.clear()
     register_adapter(list, SQL_IN)
-    return psycopg2.connect(*args, **kwargs)
+    c = psycopg2.connect(*args, **kwargs)
+    cast_types(c, typed)
+    return c
 
 #
 # this class is set up to use the RealDictConnection instead of the default
 # one.  This means that we can use a dictionary to contain arguments
 # passed to queries.  This is pretty handy.
 #
-# also slipped in here is the extensions.string_types.clear().
-# i like this a lot, but, others may not.  when you run a query, the
-# results are returned in types that make sense for the column queried.  like,
-# a timestamp is returned in a python date object.  A decimal is returned in
-# a number object, etc.. I simply want a behavior where the column
-# is always returned in text. It makes things like serializing a
-# query result.  Otherwise, all types would have to be converted to text
-# before the return value could be serialized (and pushed over the autobahn wire).
+# also slipped in here, every column comes back as text.  when you run a
+# query psycopg2 returns types that make sense for the column queried,
+# like a timestamp is returned in a python date object, a decimal in a
+# Decimal object, etc..  those would have to be converted to text before
+# the return value could be serialized (and pushed over the autobahn
+# wire), so the connection casts everything to text instead.  TypedRDC,
+# the driver's typed mode, keeps the numbers native, see cast_types.
+#
+# each connection also remembers the session context (set_session,
+# audit_user) it is currently bound to, see PG9_4.bind_session, and the
+# statements prepared on it, see PG9_4.execute.  a new connection has no
+# audit_user, and neither does one that never had it set.
 #
 class RDC(txpostgres.Connection):
         connectionFactory = staticmethod(rdc)
 
+        def __init__(self, *args, **kwargs):
+            txpostgres.Connection.__init__(self, *args, **kwargs)
+            self.context = { 'audit_user':'' }
+            self.audited = False
+            self.prepared = None
+
+        #
+        # forget
+        #  after a rollback we no longer know what state the session is in
+        #
+        def forget(self):
+            self.context.clear()
+            if not self.audited:
+                self.context['audit_user'] = ''
+            if self.prepared is not None:
+                self.prepared.forget()
+
+        #
+        # cancel_statement
+        #  ask the backend to cancel what this connection is running, like
+        #  pg_cancel_backend
+        #
+        def cancel_statement(self):
+            self._connection.cancel()
+
+class TypedRDC(RDC):
+        connectionFactory = staticmethod(typed_rdc)
+
+#
+# copy_rows
+#  runs in a thread.  COPY r (rows or a text blob) with statement s, in one
+#  transaction on a connection of its own.  returns the number of rows.
+#  call.conn is the connection while it runs, so PG9_4.interrupt can
+#  cancel it, and ms is its statement_timeout.
+#
+def copy_rows(dsn, s, r, audit, call, ms):
+    if call.reason is not None:
+        raise calls.Interrupted(call.reason)
+    c = psycopg2.connect(dsn)
+    call.conn = c
+    try:
+        cur = c.cursor()
+        if ms > 0:
+            cur.execute("set local statement_timeout = {}".format(ms))
+        if audit is not None:
+            cur.execute("select * from private.set_session_variable('audit_user',%(user_id)s)",
+                {'user_id':audit})
+        if isinstance(r, six.string_types):
+            f = io.StringIO(r) if isinstance(r, six.text_type) else io.BytesIO(r)
+            cur.copy_expert(s, f)
+            n = cur.rowcount
+        else:
+            f = bulk.CopyReader(r)
+            cur.copy_expert(s, f)
+            n = f.count
+        c.commit()
+        return n
+    except Exception:
+        c.rollback()
+        raise
+    finally:
+        call.conn = None
+        c.close()
+
 class PG9_4(dbbase):
     """
     basic postgres 9.4 driver
     """
 
-    def __init__(self, topic_base, app_session, debug):
+    def __init__(self, topic_base, app_session, debug, **kwargs):
         if debug is not None and debug:
             log.startLogging(sys.stdout)
 
         log.msg("PG9_4:__init__()")
         self.engine_version = "PG9_4"
         self.engine = "PG"
+        # self.pool runs query and operation, self.conn is the
+        # connection LISTEN runs on for watch
+        self.pool = None
         self.conn = None
+        # read replicas, see pgreplica.py
+        self.replicas = pgreplica.ReplicaSet(kwargs.get('replicas'),
+            max_lag=kwargs.get('max_lag') if kwargs.get('max_lag') is not None else pgreplica.MAX_LAG,
+            lag_interval=kwargs.get('lag_interval') if kwargs.get('lag_interval') is not None else pgreplica.LAG_INTERVAL,
+            sticky=kwargs.get('sticky'))
         self.dsn = None
+        self.pool_dsn = None
+        self.cp_min = int(kwargs.get('cp_min') or 1)
+        self.cp_max = int(kwargs.get('cp_max') or self.cp_min)
+        # typed mode, native numbers instead of text, see cast_types
+        self.typed = bool(kwargs.get('typed'))
+        self.factory = TypedRDC if self.typed else RDC
+        self.session_cache = { 'hits':0, 'misses':0 }
+        self.page_size = int(kwargs.get('page_size') or PAGE_SIZE)
+        self.cursor_seq = itertools.count(1)
+        # prepared statements, prepare_max per connection, 0 turns it off
+        self.prepare_max = int(kwargs.get('prepare_max') if kwargs.get('prepare_max') is not None else pgprepare.PREPARE_MAX)
+        self.prepare_seq = itertools.count(1)
+        self.prepare_seen = {}
+        self.prepare_stats = { 'hits':0, 'misses':0, 'prepares':0, 'evictions':0, 'failures':0 }
+        # query results cached with cache_ttl, see qcache.py
+        self.cache = QueryCache(int(kwargs.get('cache_size') if kwargs.get('cache_size') is not None else CACHE_SIZE))
+        # statements slower than slow_ms, see slowlog.py.  with slow_explain
+        # their plans are fetched on explain_conn, one at a time.
+        self.slow_log = slowlog.SlowLog(kwargs.get('slow_ms'), int(kwargs.get('slow_size') or slowlog.SLOW_SIZE))
+        self.slow_explain = bool(kwargs.get('slow_explain'))
+        self.explain_conn = None
+        self.explaining = False
+        # seconds a statement may run, 0 for no limit, and the calls
+        # running, so they can be cancelled when their caller leaves.
+        # see calls.py
+        self.timeout = float(kwargs.get('timeout') or 0)
+        self.calls = calls.Calls(topic_base, self.interrupt)
+        # transactions that span calls, see pgtxn.py
+        self.txns = pgtxn.Transactions(topic_base, self.expire_txn,
+            kwargs.get('txn_idle') if kwargs.get('txn_idle') is not None else pgtxn.IDLE_TIMEOUT)
+        # channels LISTENed to on self.conn, for watch and the cache
+        self.listening = set()
+        self.cache_channels = set()
+        # the router's subscription meta events, see watch_subscriptions
+        self.meta_subs = None
+        self.listen_lock = DeferredLock()
         self.d = None
         self.topic_base = topic_base
         self.app_session = app_session
-        self.wlist = {}
+        self.watches = watches.Watches(topic_base + '.watch')
         self.debug = debug
         if debug:
             log.startLogging(sys.stdout)
@@ -93,17 +275,31 @@ class PG9_4(dbbase):
     #  DBNAME is the database name
     #  MACHINE is the ip address or dns name of the machine
     #  DBUSER is the user to connect as
+    # note:
+    #  the dsn may also carry cp_min=N and cp_max=M, the size of the
+    #  connection pool.  these override the values given on the command line.
+    # note:
+    #  replica dsns come from the command line (--replica), each replica
+    #  gets a pool of the same size unless its dsn says otherwise.
     #
     @inlineCallbacks
     def connect(self,*args,**kwargs):
         log.msg("PG9_4:connect({},{})".format(args,kwargs))
         self.dsn = args[0]
-        self.conn = RDC()
+        self.pool_dsn, opts = dsn_options(self.dsn, ('cp_min', 'cp_max'))
+        cp_min = int(opts.get('cp_min', self.cp_min))
+        cp_max = max(cp_min, int(opts.get('cp_max', self.cp_max)))
         try:
-            rv = yield self.conn.connect(self.dsn)
-            log.msg("PG9_4:connect() established")
+            pool = ConnectionPool(self.factory, self.pool_dsn, cp_min=cp_min, cp_max=cp_max)
+            yield pool.start()
+            self.pool = pool
+            log.msg("PG9_4:connect() established, pool {}".format(pool.stats()))
+            if self.replicas.dsns:
+                yield self.replicas.start(self.factory, cp_min, cp_max)
+                log.msg("PG9_4:connect() replicas {}".format([ r.healthy for r in self.replicas.replicas ]))
+            yield self.watch_subscriptions()
         except Exception as err:
-            log.msg("PG9_4:connect({}),error({})".format(dsn,err))
+            log.msg("PG9_4:connect({}),error({})".format(self.dsn,err))
             raise err
         return
 
@@ -113,10 +309,28 @@ class PG9_4(dbbase):
     #   is currently connected then this does nothing.
     def disconnect(self,*args,**kwargs):
         log.msg("PG9_4:disconnect({},{})".format(args,kwargs))
+        # closing a pinned connection ends its transaction
+        for t in list(self.txns.open.values()):
+            self.txns.remove(t)
+            self.txns.ended('rolled_back')
+            t.conn.close()
+        if self.pool:
+            p = self.pool
+            self.pool = None
+            p.close()
+        self.replicas.close()
         if self.conn:
             c = self.conn
             self.conn = None
+            self.watches.stop()
+            self.listening = set()
+            self.cache_channels = set()
             c.close()
+        if self.explain_conn:
+            c = self.explain_conn
+            self.explain_conn = None
+            c.close()
+        self.cache.clear()
 
         return
 
@@ -143,79 +357,487 @@ class PG9_4(dbbase):
     #  are used for all of the queries in s, otherwise, a must be an array of the
     #  same length as s, which would indicate a separate set of arguments for
     #  each of the queries in array s.
+    # note:
+    #  the keyword argument format='columnar' returns each result as column
+    #  names plus arrays of values, see resultfmt.py
+    # note:
+    #  the keyword argument cache_ttl=N keeps the result for N seconds, and
+    #  the same query (same arguments, same authid) is answered from the
+    #  cache until then.  cache_channels=[...] also drops the result when
+    #  one of those channels is NOTIFYed, the names are checked the way
+    #  watch checks them.  only use this for reads.
+    # note:
+    #  with replicas a single select runs on a replica, unless the caller
+    #  wrote within the sticky window or primary=True is given.  arrays,
+    #  and statements that may write (see pgreplica.reads_only), run on
+    #  the primary.
+    # note:
+    #  the keyword argument timeout=N sets statement_timeout to N seconds,
+    #  the default is --timeout.  if the caller leaves, the query is
+    #  cancelled.
+    # note:
+    #  the keyword argument txn=HANDLE runs the query in the transaction
+    #  begin returned, see begin.  it isn't cached and doesn't go to a
+    #  replica.
     #
 
     @inlineCallbacks
     def query(self,*args, **kwargs):
-        log.msg("PG9_4:query() ARGS:{} KWARGS:{}".format(args, kwargs))
-        if len(args) < 1:
-            log.msg("PG9_4:query(), required to have at least one argument")
-            raise Exception("PG9_4:query(), required to have at least one argument")
-        qsa = args[0]
-        if isinstance(qsa, types.StringTypes):
-            qsa = [ args[0] ]
-        elif not isinstance(qsa,types.ListType):
-            log.msg("PG9_4:query(), first argument must be string or array of strings:{}".format(args[0]))
-            raise Exception("PG9_4:query(), first argument must be string or array of strings:{}".format(args[0]))
-        asa = []
-        if len(args) > 1:
-            asa = args[1]
-            if isinstance(asa, types.DictType):
-                asa = [ args[1] for i in range(len(qsa)) ]
-            elif not isinstance(asa,types.ListType):
-                log.msg("PG9_4:query(), second argument must be dict or array of dicts:{}".format(args[1]))
-                raise Exception("PG9_4:query(), second argument must be dict or array of dicts:{}".format(args[1]))
-        else:
-            asa = [ {} for i in range(len(qsa)) ]
+        dblog.debug("PG9_4:query() ARGS:{} KWARGS:{}", args, kwargs)
+        qsa, asa = query_args('PG9_4', args)
+        fmt = check_format(kwargs.get('format'))
 
         # qsa contains an array of queries to run
         # asa contains an array of dicts as arguments for those queries
-        if self.conn:
+        if self.pool:
+            ttl = kwargs.get('cache_ttl') if kwargs.get('txn') is None else None
+            if ttl:
+                # the channels end up in a LISTEN statement, hold them to
+                # the names watch takes
+                channels = tuple(watches.check_channel(c) for c in channels_of(kwargs.get('cache_channels')))
+                ckey = self.cache.key(qsa, asa, fmt,
+                    kwargs['details'].authid if 'details' in kwargs else None)
+                rv = self.cache.get(ckey)
+                if rv is not None:
+                    dblog.debug("PG9_4:query() cache hit")
+                    returnValue(rv)
+                for c in channels:
+                    self.cache_channels.add(c)
+                    yield self.listen(c)
+                mark = self.cache.mark(channels)
+            started = time.time()
             try:
-                log.msg("PG9_4:query().details.caller {}".format(kwargs['details'].caller))
-                log.msg("PG9_4:query().details.authid {}".format(kwargs['details'].authid))
-                log.msg("PG9_4:query().details.authrole {}".format(kwargs['details'].authrole))
-                log.msg("PG9_4:query().details.authmethod {}".format(kwargs['details'].authmethod))
-                log.msg("PG9_4:query().details.caller_transport {}".format(kwargs['details'].caller_transport))
+                if dblog.enabled(dblog.DEBUG) and 'details' in kwargs:
+                    details = kwargs['details']
+                    dblog.debug("PG9_4:query().details caller {} authid {} authrole {} authmethod {} caller_transport {}",
+                        details.caller, details.authid, details.authrole, details.authmethod, details.caller_transport)
                 # we run an interaction to keep together the
                 # set_session_variable() with the 
                 # query.  so, if stuff is deleted/updated/inserted
                 # the auditing mechanisms have the authid
                 # set to create an audit trail
+                writes = len(qsa) > 1 or not pgreplica.reads_only(qsa[0])
+
                 @inlineCallbacks
-                def interaction(cur):
-                    if 'details' in kwargs and kwargs['details'].caller is not None:
-                        details = kwargs['details']
-                        iv = yield cur.execute("select * from private.set_session(%(session_id)s)",
-                            {'session_id':int(details.caller)})
-                        ivf = iv.fetchall()
-                        log.msg("PG9_4:iv {}".format(ivf))
+                def interaction(cur, conn):
+                    yield self.bind_caller(cur, conn, kwargs)
+                    if writes:
+                        yield self.bind_audit(cur, conn, kwargs.get('details'))
                     rsa = []
                     for qi in range(len(qsa)):
-                        log.msg("PG9_4:query index {}:{}:{}".format(qi,qsa[qi],asa[qi]))
-                        rv = yield cur.execute(qsa[qi], asa[qi])
+                        dblog.debug("PG9_4:query index {}:{}:{}", qi,qsa[qi],asa[qi])
+                        rv = yield self.execute(cur, conn, qsa[qi], asa[qi])
                         rvf = rv.fetchall()
-                        log.msg("PG9_4:rv {}".format(rvf))
+                        dblog.debug("PG9_4:rv {}", dblog.rows(rvf))
+                        if fmt == 'columnar':
+                            rvf = columnar(rvf, columns_of(rv.description))
                         rsa.append(rvf)
                     returnValue(rsa)
-                    return
 
-                rv = yield self.conn.runInteraction(interaction)
+                replica = self.read_from(kwargs, writes)
+                rv = yield self.run_bound(interaction, replica, kwargs)
+                if writes:
+                    self.wrote(kwargs)
+                self.slow('query', qsa, asa, kwargs, started)
                 # here is a convenience, if a single query is run (only one
                 # query in args[0]) then a single result is returned eliminating
                 # the need for an array of results.
                 if len(rv) == 1:
-                    returnValue(rv[0])
-                else:
-                    returnValue(rv)
+                    rv = rv[0]
+                if ttl:
+                    self.cache.put(ckey, rv, float(ttl), channels, mark)
+                returnValue(rv)
             except Exception as err:
-                log.msg("PG9_4:query({}),error({})".format(qsa,err))
+                dblog.error("PG9_4:query({}),error({})", qsa,err)
+                self.slow('query', qsa, asa, kwargs, started, err)
                 raise err
 
         # error here, probably should raise exception
-        log.msg("PG9_4:query() attempt, but there is no connection")
+        dblog.error("PG9_4:query() attempt, but there is no connection")
         return
 
+    #
+    # query_stream:
+    #  s - query to run, a - dictionary of arguments, just like query
+    #  page_size - (keyword) rows per page, default is --page-size
+    # returns:
+    #  pages of rows as progressive results, the last page as the result.
+    # note:
+    #  txpostgres connections are asynchronous, and psycopg2 doesn't allow
+    #  named cursors on those, so the server side cursor is made with
+    #  DECLARE and read with FETCH inside the transaction.  only one page
+    #  is ever held in the bridge.
+    #
+
+    @inlineCallbacks
+    def query_stream(self,*args, **kwargs):
+        dblog.debug("PG9_4:query_stream() ARGS:{} KWARGS:{}", args, kwargs)
+        if len(args) < 1 or not isinstance(args[0], types.StringTypes):
+            dblog.error("PG9_4:query_stream(), first argument must be a string")
+            raise Exception("PG9_4:query_stream(), first argument must be a string")
+        s = args[0]
+        a = args[1] if len(args) > 1 else {}
+        page_size = int(kwargs.get('page_size') or self.page_size)
+        progress = None
+        if 'details' in kwargs:
+            progress = getattr(kwargs['details'], 'progress', None)
+        if self.pool is None:
+            raise Exception("PG9_4:query_stream() attempt, but there is no connection")
+
+        name = 'sqlbridge_stream_{}'.format(next(self.cursor_seq))
+
+        @inlineCallbacks
+        def interaction(cur, conn):
+            yield self.bind_caller(cur, conn, kwargs)
+            yield cur.execute('declare ' + name + ' no scroll cursor for ' + s, a)
+            rv = []
+            while True:
+                c = yield cur.execute('fetch forward {} from {}'.format(page_size, name))
+                page = c.fetchall()
+                dblog.debug("PG9_4:query_stream page {}", dblog.rows(page))
+                if not page:
+                    break
+                if progress is None:
+                    rv.extend(page)
+                    continue
+                if rv:
+                    progress(rv)
+                rv = page
+            yield cur.execute('close ' + name)
+            returnValue(rv)
+
+        try:
+            rv = yield self.run_bound(interaction,
+                self.read_from(kwargs, not pgreplica.reads_only(s)), kwargs)
+            returnValue(rv)
+        except Exception as err:
+            dblog.error("PG9_4:query_stream({}),error({})", s, err)
+            raise err
+
+    #
+    # bind_caller:
+    #  bind the connection to the calling WAMP session, so the database
+    #  knows who is asking (private.set_session).
+    #
+
+    @inlineCallbacks
+    def bind_caller(self, cur, conn, kwargs):
+        if 'details' in kwargs and kwargs['details'].caller is not None:
+            details = kwargs['details']
+            iv = yield self.bind_session(cur, conn, 'session_id', int(details.caller),
+                "select * from private.set_session(%(session_id)s)",
+                {'session_id':int(details.caller)})
+            if iv is not None:
+                ivf = iv.fetchall()
+                dblog.debug("PG9_4:iv {}", ivf)
+
+    #
+    # bind_audit:
+    #  bind the connection to the caller's authid, for the audit triggers
+    #  (audit_user).  a call without an authid clears it instead, a pooled
+    #  connection may still carry an earlier caller's.  a connection that
+    #  never had it set is left alone.
+    #
+
+    @inlineCallbacks
+    def bind_audit(self, cur, conn, details):
+        user = str(details.authid) if details is not None and details.authid is not None else ''
+        if user:
+            conn.audited = True
+        yield self.bind_session(cur, conn, 'audit_user', user,
+            "select * from private.set_session_variable('audit_user',%(user_id)s)",
+            {'user_id':user})
+
+    #
+    # read_from:
+    #  the replica a read should run on, None for the primary.  pinned
+    #  reads stay on the primary.
+    #
+
+    def read_from(self, kwargs, pinned):
+        if kwargs.get('primary'):
+            pinned = True
+        caller = kwargs['details'].caller if 'details' in kwargs else None
+        return self.replicas.pick(caller, pinned)
+
+    #
+    # wrote:
+    #  the caller wrote on the primary, keep its reads there for the
+    #  sticky window so it reads its own writes.
+    #
+
+    def wrote(self, kwargs):
+        if 'details' in kwargs:
+            self.replicas.wrote(kwargs['details'].caller)
+
+    #
+    # run_bound:
+    #  check out a pooled connection and run interaction(cur, conn) on it
+    #  in a transaction.  conn is passed along so bind_session can see
+    #  what the connection is bound to.  replica is where to run it, None
+    #  for the primary.  kwargs are the call's, for its timeout and caller.
+    # note:
+    #  if the interaction fails the transaction is rolled back, and that
+    #  undoes a set_session/set_session_variable run inside it, so the
+    #  cached context of the connection is forgotten.
+    # note:
+    #  the timeout is a SET LOCAL statement_timeout, so it ends with the
+    #  transaction and the next user of the connection doesn't inherit it.
+    #  a call whose caller left while it waited for a connection isn't run.
+    # note:
+    #  a call with txn=HANDLE runs in that transaction instead, see run_txn.
+    #
+
+    def run_bound(self, interaction, replica=None, kwargs={}):
+        if kwargs.get('txn') is not None:
+            return self.run_txn(interaction, kwargs)
+        ms = int(calls.timeout_of(kwargs, self.timeout) * 1000)
+        call = self.calls.start(kwargs, ms / 1000.0)
+        run = interaction
+        if ms > 0:
+            @inlineCallbacks
+            def run(cur, conn):
+                yield cur.execute('set local statement_timeout = {}'.format(ms))
+                rv = yield interaction(cur, conn)
+                returnValue(rv)
+
+        def f(conn):
+            def forget(err):
+                conn.forget()
+                return err
+            if call.reason is not None:
+                return fail(calls.Interrupted(call.reason))
+            d = call.d = conn.runInteraction(run, conn)
+            d.addErrback(forget)
+            return d
+        if replica is not None:
+            d = self.replicas.run(replica, f)
+        else:
+            d = self.pool.runWithConnection(f)
+        return self.finish_call(call, d)
+
+    #
+    # run_txn:
+    #  run interaction(cur, conn) on the connection of the transaction
+    #  kwargs['txn'], after the calls already running on it.  the
+    #  statement_timeout is set when it differs from the last call's, and
+    #  lasts until the next call sets it or the transaction ends.
+    # note:
+    #  an error, a timeout included, aborts the transaction, postgres
+    #  refuses everything but rollback after that.
+    #
+
+    def run_txn(self, interaction, kwargs):
+        t = self.txns.get(kwargs['txn'], kwargs['details'].caller if 'details' in kwargs else None)
+        ms = int(calls.timeout_of(kwargs, self.timeout) * 1000)
+        call = self.calls.start(kwargs, ms / 1000.0)
+        self.txns.start(t)
+
+        @inlineCallbacks
+        def run():
+            if call.reason is not None:
+                raise calls.Interrupted(call.reason)
+            # it may have ended while this call waited its turn
+            self.txns.get(t.handle, t.caller)
+            call.conn = t.conn
+            try:
+                cur = t.conn.cursor()
+                if ms != t.timeout_ms:
+                    yield cur.execute('set local statement_timeout = {}'.format(ms))
+                    t.timeout_ms = ms
+                rv = yield interaction(cur, t.conn)
+            finally:
+                call.conn = None
+            returnValue(rv)
+
+        def done(rv):
+            self.txns.stop(t)
+            return rv
+
+        d = t.lock.run(run)
+        d.addBoth(done)
+        return self.finish_call(call, d)
+
+    #
+    # finish_call:
+    #  d is the Deferred of call.  a statement_timeout shows up as
+    #  QueryCanceledError, it is reported as topic_base.error.timeout.
+    #
+
+    def finish_call(self, call, d):
+        def timed_out(err):
+            if err.check(QueryCanceledError) and call.timeout > 0:
+                self.calls.mark(call, calls.TIMEOUT)
+            return err
+        d.addErrback(timed_out)
+        return self.calls.finish(call, d)
+
+    #
+    # interrupt:
+    #  stop the statement call is running.  cancelling a txpostgres
+    #  Deferred sends the backend a cancel request (what pg_cancel_backend
+    #  does), copy_in's plain psycopg2 connection is cancelled directly.
+    #
+
+    def interrupt(self, call):
+        if call.d is not None and not call.d.called:
+            call.d.cancel()
+        elif isinstance(call.conn, RDC):
+            call.conn.cancel_statement()
+        elif call.conn is not None:
+            call.conn.cancel()
+
+    #
+    # bind_session:
+    #  cur, conn - the cursor and connection of the running interaction
+    #  key, value - the session context wanted, like ('audit_user', '12')
+    #  s, a - the statement (and arguments) that sets it
+    # returns:
+    #  the executed cursor, or None when the connection already had
+    #  value for key and the statement was skipped.
+    # note:
+    #  the context is remembered per connection, so two callers sharing
+    #  the pool never see each others audit_user.  this assumes that
+    #  private.set_session() and private.set_session_variable() set session
+    #  (not transaction local) state.
+    #
+
+    @inlineCallbacks
+    def bind_session(self, cur, conn, key, value, s, a):
+        if key in conn.context and conn.context[key] == value:
+            self.session_cache['hits'] += 1
+            returnValue(None)
+        self.session_cache['misses'] += 1
+        conn.context.pop(key, None)
+        rv = yield cur.execute(s, a)
+        conn.context[key] = value
+        returnValue(rv)
+
+    #
+    # execute:
+    #  run s with arguments a on the cursor of an interaction, using a
+    #  prepared statement when there is one.
+    # note:
+    #  a statement text is prepared on a connection the PREPARE_AFTER'th
+    #  time it is seen.  the PREPARE runs inside a savepoint, so a
+    #  statement postgres refuses to prepare (can't infer a parameter type,
+    #  say) doesn't abort the transaction.  it is remembered and not tried
+    #  again.
+    #
+
+    @inlineCallbacks
+    def execute(self, cur, conn, s, a):
+        if self.prepare_max <= 0 or not isinstance(a, types.DictType):
+            rv = yield cur.execute(s, a)
+            returnValue(rv)
+
+        if conn.prepared is None:
+            conn.prepared = pgprepare.PreparedStatements(self.prepare_max)
+        ps = conn.prepared
+        if ps.stale:
+            yield cur.execute('deallocate all')
+            ps.stale = False
+
+        p = ps.get(s)
+        if p is None:
+            seen = self.prepare_seen.get(s, 0)
+            if seen >= 0:
+                seen += 1
+                if len(self.prepare_seen) >= pgprepare.SEEN_MAX:
+                    self.prepare_seen.clear()
+                self.prepare_seen[s] = seen
+            if seen >= pgprepare.PREPARE_AFTER:
+                p = yield self.prepare(cur, ps, s)
+
+        if p is None or not pgprepare.plain(a, p[1]):
+            self.prepare_stats['misses'] += 1
+            rv = yield cur.execute(s, a)
+            returnValue(rv)
+
+        self.prepare_stats['hits'] += 1
+        name, names = p
+        if names:
+            e = 'execute ' + name + '(' + ', '.join('%(' + n + ')s' for n in names) + ')'
+        else:
+            e = 'execute ' + name
+        rv = yield cur.execute(e, a)
+        returnValue(rv)
+
+    #
+    # prepare:
+    #  PREPARE s on the connection of cur, returns (name, names) or None
+    #
+
+    @inlineCallbacks
+    def prepare(self, cur, ps, s):
+        t = pgprepare.translate(s)
+        if t is None:
+            self.prepare_seen[s] = -1
+            returnValue(None)
+        name = 'sqlbridge_ps_{}'.format(next(self.prepare_seq))
+        yield cur.execute('savepoint sqlbridge_prepare')
+        try:
+            yield cur.execute('prepare ' + name + ' as ' + t[0])
+        except Exception as err:
+            dblog.debug("PG9_4:prepare({}),error({})", s, err)
+            yield cur.execute('rollback to savepoint sqlbridge_prepare')
+            self.prepare_stats['failures'] += 1
+            self.prepare_seen[s] = -1
+            returnValue(None)
+        yield cur.execute('release savepoint sqlbridge_prepare')
+        self.prepare_stats['prepares'] += 1
+        old = ps.add(s, name, t[1])
+        if old is not None:
+            self.prepare_stats['evictions'] += 1
+            yield cur.execute('deallocate ' + old)
+        returnValue((name, t[1]))
+
+    #
+    # copy_in:
+    #  bulk load table t, columns c, with rows r (see dbbase.py)
+    # note:
+    #  psycopg2 can't COPY on an asynchronous connection, so the load runs
+    #  on a plain psycopg2 connection of its own in a thread.  rows are
+    #  turned into COPY text as postgres reads them.
+    #
+
+    @inlineCallbacks
+    def copy_in(self,*args,**kwargs):
+        dblog.debug("PG9_4:copy_in() ARGS:{} KWARGS:{}", args[:2], kwargs)
+        if len(args) < 3:
+            raise Exception("PG9_4:copy_in(), requires table, columns and rows")
+        if self.pool is None:
+            raise Exception("PG9_4:copy_in() attempt, but there is no connection")
+        if kwargs.get('txn') is not None:
+            raise Exception("PG9_4:copy_in() runs on a connection of its own, it can't be part of a transaction")
+        t = bulk.check_identifier(args[0])
+        c = [ bulk.check_identifier(w) for w in args[1] ]
+        r = args[2]
+        s = 'copy ' + t + ' (' + ', '.join(c) + ') from stdin'
+        if isinstance(r, six.string_types):
+            if bulk.check_format(kwargs.get('format')) == 'csv':
+                s += ' with (format csv' + (', header true)' if kwargs.get('header') else ')')
+            else:
+                r = r.partition('\n')[2] if kwargs.get('header') else r
+        else:
+            r = bulk.rows_of(r, c)
+        audit = None
+        if 'details' in kwargs and kwargs['details'].authid is not None:
+            audit = str(kwargs['details'].authid)
+
+        ms = int(calls.timeout_of(kwargs, self.timeout) * 1000)
+        call = self.calls.start(kwargs, ms / 1000.0)
+        started = time.time()
+        try:
+            n = yield self.finish_call(call, threads.deferToThread(copy_rows, self.pool_dsn, s, r, audit, call, ms))
+        except Exception as err:
+            dblog.error("PG9_4:copy_in({}),error({})", s, err)
+            raise err
+        self.wrote(kwargs)
+        elapsed = time.time() - started
+        dblog.debug("PG9_4:copy_in() {} rows in {} seconds", n, elapsed)
+        returnValue({ 'rows':n, 'seconds':elapsed, 'rows_per_sec':(n / elapsed) if elapsed > 0 else None })
+
     #
     # operation:
     #  identical to query, except, there is no result returned.
@@ -226,83 +848,483 @@ class PG9_4(dbbase):
 
     @inlineCallbacks
     def operation(self,*args, **kwargs):
-        log.msg("PG9_4:operation() ARGS:{} KWARGS:{}".format(args, kwargs))
+        dblog.debug("PG9_4:operation() ARGS:{} KWARGS:{}", args, kwargs)
         s = args[0]
         a = args[1]
-        if self.conn:
+        if self.pool:
+            started = time.time()
             try:
-                log.msg("PG9_4:operation().running({} with args {})".format(s,a))
-                if 'details' in kwargs and kwargs['details'].authid is not None:
-                    details = kwargs['details']
-                    log.msg("details.authid {}".format(details.authid))
-
-                    # we run an interaction to keep together the
-                    # set_session_variable() with the 
-                    # operation.  so, if stuff is deleted/updated/inserted
-                    # the auditing mechanisms have the authid
-                    # set to create an audit trail
-                    @inlineCallbacks
-                    def interaction(cur):
-                        yield cur.execute("select * from private.set_session_variable('audit_user',%(user_id)s)",
-                            {'user_id':str(details.authid)})
-                        rv = yield cur.execute(s, a)
-                        returnValue(True)
-                        return
-                    rv = yield self.conn.runInteraction(interaction)
-                    returnValue(rv)
-                else:
-                    rv = yield self.conn.runOperation(s,a)
-                    returnValue(rv)
-                log.msg("PG9_4:operation().results({})".format(rv))
+                dblog.debug("PG9_4:operation().running({} with args {})", s,a)
+                details = kwargs.get('details')
+                if details is not None and details.authid is not None:
+                    dblog.debug("details.authid {}", details.authid)
+
+                # we run an interaction to keep together the
+                # set_session_variable() with the 
+                # operation.  so, if stuff is deleted/updated/inserted
+                # the auditing mechanisms have the authid
+                # set to create an audit trail.  the interaction is also
+                # what carries the timeout, and what is cancelled if
+                # the caller leaves.
+                @inlineCallbacks
+                def interaction(cur, conn):
+                    yield self.bind_audit(cur, conn, details)
+                    rv = yield self.execute(cur, conn, s, a)
+                    returnValue(True)
+
+                rv = yield self.run_bound(interaction, None, kwargs)
+                self.wrote(kwargs)
+                self.slow('operation', s, a, kwargs, started)
+                dblog.debug("PG9_4:operation().results({})", dblog.rows(rv))
+                returnValue(rv)
             except Exception as err:
-                log.msg("PG9_4:operation({}),error({})".format(s,err))
+                dblog.error("PG9_4:operation({}),error({})", s,err)
+                self.slow('operation', s, a, kwargs, started, err)
                 raise err
 
         # error here, probably should raise exception
         return
 
+    #
+    # operation_many:
+    #  txpostgres runs psycopg2 in async mode, which has no executemany.
+    #  instead every run goes through execute() on one pooled connection in
+    #  one transaction, so after the first couple of runs the statement is
+    #  prepared and each run is just an EXECUTE.
+    #
+
+    @inlineCallbacks
+    def operation_many(self,*args, **kwargs):
+        dblog.debug("PG9_4:operation_many() ARGS:{} KWARGS:{}", args[:1], kwargs)
+        if len(args) < 2:
+            raise Exception("PG9_4:operation_many(), requires sql and a list of arguments")
+        if self.pool is None:
+            raise Exception("PG9_4:operation_many() attempt, but there is no connection")
+        s = args[0]
+        al = args_many('PG9_4', args[1])
+        details = kwargs.get('details')
+
+        @inlineCallbacks
+        def interaction(cur, conn):
+            yield self.bind_audit(cur, conn, details)
+            n = 0
+            for a in al:
+                yield self.execute(cur, conn, s, a)
+                if cur.rowcount is not None and cur.rowcount > 0:
+                    n += cur.rowcount
+            returnValue(n)
+
+        try:
+            dblog.debug("PG9_4:operation_many().running({} {} times)", s, len(al))
+            n = yield self.run_bound(interaction, None, kwargs)
+        except Exception as err:
+            dblog.error("PG9_4:operation_many({}),error({})", s,err)
+            raise err
+        self.wrote(kwargs)
+        dblog.debug("PG9_4:operation_many() {} rows", n)
+        returnValue({ 'statements':len(al), 'rows':n })
+
+    #
+    # begin:
+    #  start a transaction that spans calls, on a connection checked out
+    #  of the pool until commit or rollback (see pgtxn.py).
+    #  isolation - (keyword) 'read committed', 'repeatable read' or
+    #   'serializable', default is the server's
+    #  read_only - (keyword) True for a read only transaction
+    #  idle_timeout - (keyword) seconds it may sit with no call running
+    #   before it is rolled back, default is --txn-idle, 0 is no limit
+    # returns:
+    #  the transaction's handle.  query, query_stream, operation and
+    #  operation_many called with txn=HANDLE run in the transaction.
+    #
+
+    @inlineCallbacks
+    def begin(self,*args,**kwargs):
+        dblog.debug("PG9_4:begin() KWARGS:{}", kwargs)
+        if self.pool is None:
+            raise Exception("PG9_4:begin() attempt, but there is no connection")
+        s = pgtxn.begin_sql(kwargs.get('isolation'), kwargs.get('read_only'))
+        details = kwargs.get('details')
+        conn = yield self.pool.checkout()
+        try:
+            cur = conn.cursor()
+            yield cur.execute(s)
+            yield self.bind_caller(cur, conn, kwargs)
+            yield self.bind_audit(cur, conn, details)
+        except Exception as err:
+            dblog.error("PG9_4:begin(),error({})", err)
+            conn.forget()
+            try:
+                yield conn.cursor().execute('rollback')
+            except Exception:
+                pass
+            self.pool.checkin(conn)
+            raise err
+        t = self.txns.add(conn, details.caller if details is not None else None, kwargs.get('idle_timeout'))
+        dblog.debug("PG9_4:begin() {}", t.handle)
+        returnValue(t.handle)
+
+    #
+    # commit, rollback:
+    #  end the transaction of the handle begin returned, after the calls
+    #  running in it, and give its connection back to the pool
+    #
+
+    @inlineCallbacks
+    def commit(self,*args,**kwargs):
+        dblog.debug("PG9_4:commit() ARGS:{}", args)
+        t = self.txns.get(args[0] if args else kwargs.get('txn'), kwargs['details'].caller if 'details' in kwargs else None)
+        yield self.end_txn(t, 'commit')
+        self.wrote(kwargs)
+        returnValue(True)
+
+    @inlineCallbacks
+    def rollback(self,*args,**kwargs):
+        dblog.debug("PG9_4:rollback() ARGS:{}", args)
+        t = self.txns.get(args[0] if args else kwargs.get('txn'), kwargs['details'].caller if 'details' in kwargs else None)
+        yield self.end_txn(t, 'rollback')
+        returnValue(True)
+
+    #
+    # end_txn:
+    #  run s (commit or rollback) in t and check its connection in.  a
+    #  failed commit (a serialization failure, say) has rolled back.
+    #
+
+    @inlineCallbacks
+    def end_txn(self, t, s):
+        yield t.lock.acquire()
+        try:
+            # somebody else ended it while this waited
+            if not self.txns.remove(t):
+                self.txns.get(t.handle, t.caller)
+            try:
+                yield t.conn.cursor().execute(s)
+            except Exception as err:
+                dblog.error("PG9_4:end_txn({}),error({})", s, err)
+                t.conn.forget()
+                self.txns.ended('rolled_back')
+                raise err
+            finally:
+                if self.pool is not None:
+                    self.pool.checkin(t.conn)
+                else:
+                    t.conn.close()
+            if s == 'rollback':
+                t.conn.forget()
+            self.txns.ended('committed' if s == 'commit' else 'rolled_back')
+        finally:
+            t.lock.release()
+
+    #
+    # expire_txn:
+    #  t sat idle longer than its idle_timeout, roll it back so its
+    #  connection goes back to the pool
+    #
+
+    def expire_txn(self, t):
+        dblog.info("PG9_4: transaction of caller {} idle for {} seconds, rolling back", t.caller, t.idle_timeout)
+        d = self.end_txn(t, 'rollback')
+        d.addErrback(lambda err: dblog.error("PG9_4:expire_txn(), rollback error({})", err.value))
+
+    #
+    # slow:
+    #  kind - 'query' or 'operation'
+    #  s, a - the statement and arguments, arrays of them for query
+    #  started - time.time() when the statement started
+    #  err - the error, if it failed
+    # note:
+    #  remembers s in the slow log if it took longer than slow_ms.  with
+    #  slow_explain a single statement is also EXPLAINed, unless another
+    #  EXPLAIN is still running.
+    #
+
+    def slow(self, kind, s, a, kwargs, started, err=None):
+        if isinstance(s, list) and len(s) == 1:
+            s, a = s[0], a[0]
+        authid = kwargs['details'].authid if 'details' in kwargs else None
+        e = self.slow_log.record(kind, s, a, authid, started, err)
+        if e is None:
+            return
+        dblog.info("PG9_4:{}() slow, {} ms, {}", kind, int(e['ms']), e['sql'])
+        if self.slow_explain and not self.explaining and isinstance(s, six.string_types):
+            self.explain(e, s, a)
+
+    #
+    # explain:
+    #  add the plan of s to slow log entry e
+    # note:
+    #  ANALYZE is off, so the statement isn't run again, not even an
+    #  operation.  this runs on a connection of its own, so a slow pool
+    #  doesn't hold it up and it doesn't take a pooled connection away
+    #  from callers.  it doesn't see the caller's session variables.
+    #
+
+    @inlineCallbacks
+    def explain(self, e, s, a):
+        self.explaining = True
+        try:
+            if self.explain_conn is None:
+                c = RDC()
+                yield c.connect(self.pool_dsn)
+                self.explain_conn = c
+            rv = yield self.explain_conn.runQuery('explain (analyze off, format json) ' + s, a)
+            plan = list(rv[0].values())[0]
+            e['plan'] = json.loads(plan) if isinstance(plan, six.string_types) else plan
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as err:
+            dblog.error("PG9_4:explain() connection lost, error({})", err)
+            e['plan'] = { 'error':str(err) }
+            c, self.explain_conn = self.explain_conn, None
+            if c is not None:
+                try:
+                    c.close()
+                except Exception:
+                    pass
+        except Exception as err:
+            dblog.debug("PG9_4:explain({}),error({})", s, err)
+            e['plan'] = { 'error':str(err) }
+        finally:
+            self.explaining = False
+
+    #
+    # slowlog:
+    #  limit - (optional) the most entries to return
+    #  clear - (keyword) empty the log after reading it
+    # returns:
+    #  the slow query log, newest first, see slowlog.py
+    #
+
+    def slowlog(self,*args,**kwargs):
+        dblog.debug("PG9_4:slowlog({},{})", args, kwargs)
+        limit = args[0] if len(args) > 0 else kwargs.get('limit')
+        rv = self.slow_log.snapshot(limit)
+        rv['explain'] = self.slow_explain
+        if kwargs.get('clear'):
+            self.slow_log.clear()
+        return rv
+
     #
     # watch:
     #  for LISTEN side of NOTIFY.
     # note:
     #  handy function that lets us register a function to call
     #  when a LISTEN is triggered.  This is async database notification.
+    #  returns the topic, topic_base.watch.CHANNEL, to subscribe to.
+    #
+    # note:
+    #  the keyword arguments batch_ms=N and batch_max=M ask for the payloads
+    #  in arrays instead, published when the first of them has waited N
+    #  milliseconds or M of them are waiting.  dedup=True leaves out
+    #  payloads already waiting.  each batching gets a topic of its own,
+    #  derived from the watch's topic, see notifybatch.py.
+    # note:
+    #  the keyword argument filter publishes only the notifications that
+    #  pass it, on a topic derived from the filter, see watchfilter.py.
+    # note:
+    #  watches are counted per caller, see watches.py.  unwatch, the caller
+    #  leaving, or (on a router with subscription meta events) the last
+    #  subscriber going lets go of them, and a channel nobody watches is
+    #  UNLISTENed.
     #
     # see also:
     #  http://txpostgres.readthedocs.org/en/latest/usage.html#listening-for-database-notifications
     #
 
-    @inlineCallbacks
     def watch_func(self, notify):
-        log.msg("PG9_4:watch_func: notify {}".format(notify))
+        dblog.debug("PG9_4:watch_func: notify {}", notify)
 
-        if notify.channel in self.wlist:
-            log.msg("PG9_4:watch_func: word in list, publish to {}".format(self.wlist[notify.channel]['topic']))
-            yield self.app_session.publish(six.u(self.wlist[notify.channel]['topic']), notify.payload)
+        self.cache.invalidate(notify.channel)
+        self.watches.notify(notify.channel, notify.payload)
 
     @inlineCallbacks
     def watch(self,*args,**kwargs):
-        log.msg("PG9_4:watch() ARGS:{} KWARGS:{}".format(args, kwargs))
-        word = args[0].lower()
-        if self.conn is None:
+        dblog.debug("PG9_4:watch() ARGS:{} KWARGS:{}", args, kwargs)
+        word = watches.check_channel(args[0].lower())
+        if self.pool is None:
             raise Exception("cannot add watch because there is no connection {}".format(word))
 
-        # if there is nothing in the watch list, then this is the first watch
-        # call.  that being the case we need to set a method to receive the
-        # listen event.
+        topic, sink = self.watch_topic(word, kwargs)
+        caller = kwargs['details'].caller if 'details' in kwargs else None
+        if self.watches.hold(word, topic, sink, caller):
+            try:
+                yield self.listen(word)
+            except Exception:
+                self.watches.release(topic, caller)
+                raise
 
-        if len(self.wlist) == 0:
-            self.conn.addNotifyObserver(self.watch_func)
+        returnValue(topic)
 
-        if word not in self.wlist:
-            s = 'listen' + word
-            rv = yield self.conn.runOperation('listen ' + word)
-            self.wlist[word] = { 'topic':self.topic_base + '.watch.' +
-                    ''.join(random.choice(string.ascii_lowercase) for _ in range(8)) }
+        return
 
-        returnValue(self.wlist[word]['topic'])
+    #
+    # unwatch:
+    #  let go of a watch, once.  the argument is the topic watch returned,
+    #  or the channel name with the same keyword arguments watch was given.
+    # returns:
+    #  True if the topic is still watched (by someone else)
+    #
 
-        return
+    @inlineCallbacks
+    def unwatch(self,*args,**kwargs):
+        dblog.debug("PG9_4:unwatch() ARGS:{} KWARGS:{}", args, kwargs)
+        w = args[0]
+        if w.startswith(self.watches.prefix + '.'):
+            topic = w
+        else:
+            topic = self.watch_topic(watches.check_channel(w.lower()), kwargs)[0]
+        caller = kwargs['details'].caller if 'details' in kwargs else None
+        yield self.unlisten(self.watches.release(topic, caller))
+        returnValue(topic in self.watches.topics)
+
+    #
+    # watch_topic:
+    #  the topic of a watch of word with keyword arguments kwargs, and a
+    #  function making its sink
+    #
+
+    def watch_topic(self, word, kwargs):
+        topic = self.watches.topic(word)
+        f = None
+        if kwargs.get('filter') is not None:
+            f = watchfilter.Filter(kwargs['filter'])
+            topic = watchfilter.filter_topic(topic, f)
+        if kwargs.get('batch_ms') is not None or kwargs.get('batch_max') is not None or kwargs.get('dedup'):
+            batch_ms = float(kwargs.get('batch_ms') or notifybatch.BATCH_MS)
+            batch_max = int(kwargs.get('batch_max') or notifybatch.BATCH_MAX)
+            dedup = bool(kwargs.get('dedup'))
+            topic = notifybatch.batch_topic(topic, batch_ms, batch_max, dedup)
+            make = lambda: notifybatch.Batch(self.publish_watch, topic, batch_ms, batch_max, dedup)
+        else:
+            make = lambda: watches.Plain(self.publish_watch, topic)
+
+        def sink():
+            s = make()
+            s.filter = f
+            return s
+        return topic, sink
+
+    def publish_watch(self, topic, payload):
+        dblog.debug("PG9_4:publish_watch: publish to {}", topic)
+        self.app_session.publish(six.u(topic), payload)
+
+    #
+    # watch_subscriptions:
+    #  subscribe to the router's subscription meta events.  a client that
+    #  subscribes to a watch topic is watching it, even without calling
+    #  watch, and when its last subscriber goes the topic is let go.  a
+    #  router without the meta events just doesn't send them, then only
+    #  watch, unwatch and callers leaving count.
+    #
+
+    @inlineCallbacks
+    def watch_subscriptions(self):
+        if self.meta_subs is not None:
+            return
+        self.meta_subs = []
+        for t, f in ( (u'wamp.subscription.on_create', self.subscription_created),
+                      (u'wamp.subscription.on_delete', self.subscription_deleted), ):
+            try:
+                s = yield self.app_session.subscribe(f, t)
+                self.meta_subs.append(s)
+            except Exception as err:
+                log.msg("PG9_4:watch_subscriptions() can't subscribe to {}, error({})".format(t, err))
+
+    @inlineCallbacks
+    def subscription_created(self, *args, **kwargs):
+        sub = args[1] if len(args) > 1 else {}
+        topic = sub.get('uri') if isinstance(sub, dict) else None
+        if topic is None or not topic.startswith(self.watches.prefix + '.') or self.pool is None:
+            return
+        if not self.watches.subscribed(sub.get('id'), topic):
+            word, _, suffix = topic[len(self.watches.prefix) + 1:].partition('.')
+            kw = notifybatch.parse_suffix(suffix) if suffix else {}
+            if kw is None or not watches.channel_name.match(word):
+                return
+            t, sink = self.watch_topic(word, kw)
+            if t != topic:
+                return
+            dblog.debug("PG9_4:subscription_created: watching {} for its subscribers", topic)
+            new = self.watches.hold(word, topic, sink, None)
+            self.watches.subscribed(sub.get('id'), topic)
+            self.watches.release(topic, None)
+            if new:
+                yield self.listen(word)
+
+    def subscription_deleted(self, *args, **kwargs):
+        if len(args) > 1:
+            return self.unlisten(self.watches.unsubscribed(args[1]))
+
+    #
+    # cancel_caller:
+    #  the caller left, stop its calls, roll back its transactions and
+    #  let go of its watches
+    #
+
+    def cancel_caller(self, caller):
+        n = self.calls.cancel_caller(caller)
+        for t in self.txns.of_caller(caller):
+            d = self.end_txn(t, 'rollback')
+            d.addErrback(lambda err: dblog.error("PG9_4:cancel_caller({}), rollback error({})", caller, err.value))
+        d = self.unlisten(self.watches.caller_left(caller))
+        d.addErrback(lambda err: dblog.error("PG9_4:cancel_caller({}), unlisten error({})", caller, err.value))
+        return n
+
+    #
+    # listen:
+    #  LISTEN to word.  notifications are delivered to the connection that
+    #  ran LISTEN, so this is done on a connection of its own outside of
+    #  the pool, and watch_func receives the notifications.
+    #
+
+    @inlineCallbacks
+    def listen(self, word):
+        yield self.listen_lock.acquire()
+        try:
+            if self.conn is None:
+                c = RDC()
+                yield c.connect(self.pool_dsn)
+                c.addNotifyObserver(self.watch_func)
+                self.conn = c
+            if word not in self.listening:
+                yield self.conn.runOperation('listen ' + word)
+                self.listening.add(word)
+        finally:
+            self.listen_lock.release()
+
+    #
+    # unlisten:
+    #  UNLISTEN the channels of words that nobody watches any more, unless
+    #  the cache still needs them.
+    #
+
+    @inlineCallbacks
+    def unlisten(self, words):
+        if not words:
+            return
+        yield self.listen_lock.acquire()
+        try:
+            for word in words:
+                if self.conn is None:
+                    break
+                if word in self.listening and word not in self.watches.channels and word not in self.cache_channels:
+                    dblog.debug("PG9_4:unlisten {}", word)
+                    yield self.conn.runOperation('unlisten ' + word)
+                    self.listening.discard(word)
+        finally:
+            self.listen_lock.release()
+
+    #
+    # pool_stats:
+    #  the primary's pool, and each replica's
+    #
+
+    def pool_stats(self):
+        if self.pool is None:
+            return None
+        rv = self.pool.stats()
+        if len(self.replicas):
+            rv = { 'primary':rv, 'replicas':dict((r.dsn, r.pool.stats()) for r in self.replicas.replicas) }
+        return rv
 
     #
     # info:
@@ -311,13 +1333,25 @@ class PG9_4(dbbase):
 
     @inlineCallbacks
     def info(self,*args,**kwargs):
-        log.msg("PG9_4:info({},{})".format(args,kwargs))
+        dblog.debug("PG9_4:info({},{})", args,kwargs)
         rv = yield [{
             "engine":self.engine,
             "engine_version":self.engine_version,
             "dsn":self.dsn,
             "topic_base":self.topic_base,
-            "debug":self.debug
+            "debug":self.debug,
+            "page_size":self.page_size,
+            "typed":self.typed,
+            "pool":self.pool.stats() if self.pool else None,
+            "replicas":self.replicas.info(),
+            "session_cache":self.session_cache,
+            "prepared":dict(self.prepare_stats, prepare_max=self.prepare_max),
+            "cache":self.cache.info(),
+            "timeout":self.timeout,
+            "calls":self.calls.info(),
+            "transactions":self.txns.info(),
+            "listening":sorted(self.listening),
+            "watches":self.watches.info()
         }]
 
         returnValue(rv)
@@ -0,0 +1,170 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## qcache.py - query result cache
+##
+## a query called with cache_ttl=N keeps its result here for N seconds,
+## keyed on the statement, the arguments, the result format and the
+## caller's authid.  the cache holds at most cache_size bytes (measured as
+## json), the least recently used results are dropped to make room.
+##
+## a result can also name channels (cache_channels).  when the postgres
+## driver receives a NOTIFY on one of those channels every result that
+## named it is dropped.
+###############################################################################
+
+from __future__ import absolute_import
+import time, json, collections
+
+#
+# default size of the cache, in bytes
+#
+CACHE_SIZE = 64 * 1024 * 1024
+
+class QueryCache(object):
+    """
+    LRU cache of query results with per entry expiry
+    """
+
+    def __init__(self, size=CACHE_SIZE, clock=time.time):
+        self.size = size
+        self.clock = clock
+        self.bytes = 0
+        # key -> (expires, bytes, result, channels), oldest first
+        self.entries = collections.OrderedDict()
+        # channel -> set of keys
+        self.channels = {}
+        # channel -> number of NOTIFYs seen, see mark()
+        self.generation = {}
+        self.stats = { 'hits':0, 'misses':0, 'inserts':0, 'evictions':0,
+                'expirations':0, 'invalidations':0, 'too_big':0 }
+
+    #
+    # key
+    #  the cache key for a query.  scope is whatever separates callers,
+    #  the drivers use the authid.
+    #
+    def key(self, s, a, fmt, scope):
+        return json.dumps([ s, a, fmt, scope ], sort_keys=True, default=str)
+
+    #
+    # get
+    #  the cached result for key, or None
+    #
+    def get(self, key):
+        e = self.entries.pop(key, None)
+        if e is None:
+            self.stats['misses'] += 1
+            return None
+        if e[0] <= self.clock():
+            self._drop(key, e)
+            self.stats['expirations'] += 1
+            self.stats['misses'] += 1
+            return None
+        self.entries[key] = e
+        self.stats['hits'] += 1
+        return e[2]
+
+    #
+    # mark
+    #  take this before running the query, and hand it to put.  if a NOTIFY
+    #  arrived on one of the channels while the query ran, the result may
+    #  already be out of date and isn't cached.
+    #
+    def mark(self, channels):
+        return tuple(self.generation.get(c, 0) for c in channels)
+
+    #
+    # put
+    #  cache rv under key for ttl seconds
+    #
+    def put(self, key, rv, ttl, channels=(), mark=None):
+        if self.size <= 0:
+            return
+        if mark is not None and mark != self.mark(channels):
+            return
+        nbytes = len(key) + len(json.dumps(rv, default=str))
+        if nbytes > self.size:
+            self.stats['too_big'] += 1
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self._drop(key, old)
+        while self.entries and self.bytes + nbytes > self.size:
+            k, e = self.entries.popitem(last=False)
+            self._drop(k, e)
+            self.stats['evictions'] += 1
+        self.entries[key] = (self.clock() + ttl, nbytes, rv, tuple(channels))
+        self.bytes += nbytes
+        for c in channels:
+            self.channels.setdefault(c, set()).add(key)
+        self.stats['inserts'] += 1
+
+    #
+    # invalidate
+    #  drop every result that named channel
+    #
+    def invalidate(self, channel):
+        self.generation[channel] = self.generation.get(channel, 0) + 1
+        keys = self.channels.pop(channel, None)
+        if not keys:
+            return
+        for k in keys:
+            e = self.entries.pop(k, None)
+            if e is not None:
+                self._drop(k, e)
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.channels.clear()
+        self.bytes = 0
+
+    def _drop(self, key, e):
+        self.bytes -= e[1]
+        for c in e[3]:
+            keys = self.channels.get(c)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.channels[c]
+
+    #
+    # info
+    #  cache statistics, suitable for info()
+    #
+    def info(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return dict(self.stats,
+            size=self.size,
+            bytes=self.bytes,
+            entries=len(self.entries),
+            hit_rate=(float(self.stats['hits']) / lookups) if lookups else 0.0)
+
+#
+# channels_of
+#  the cache_channels keyword, a channel name or a list of them.  channel
+#  names are folded to lower case like LISTEN does.
+#
+def channels_of(c):
+    if c is None:
+        return ()
+    if not isinstance(c, (list, tuple)):
+        c = [ c ]
+    return tuple(sorted(set(str(w).lower() for w in c)))
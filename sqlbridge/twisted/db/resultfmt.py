@@ -0,0 +1,132 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## resultfmt.py - result set encodings
+##
+## query normally returns a list of dictionaries, one per row, which repeats
+## every column name in every row.  format='columnar' returns this instead:
+##
+##  {
+##    "columns": [ "id", "login", "tzname" ],
+##    "rows": [ [ "1", "greg", 0 ], [ "2", "mary", 0 ], [ "3", "bob", 1 ] ],
+##    "dicts": { "tzname": [ "America/Chicago", "America/New_York" ] }
+##  }
+##
+## columns named in dicts are dictionary encoded, the value in the row is
+## an index into the list of distinct values for that column.  a column is
+## dictionary encoded when it has few distinct values compared to the
+## number of rows.
+###############################################################################
+
+from __future__ import absolute_import
+import itertools
+
+FORMATS = ( 'rows', 'columnar', )
+
+#
+# a column is dictionary encoded when the result has at least DICT_MIN_ROWS
+# rows and no more than one distinct value per DICT_RATIO rows.
+#
+DICT_MIN_ROWS = 16
+DICT_RATIO = 4
+
+#
+# check_format
+#  the format keyword of a query call, None means 'rows'
+#
+def check_format(fmt):
+    if fmt is None:
+        return 'rows'
+    if fmt not in FORMATS:
+        raise Exception("unknown result format {}, valid formats are {}".format(fmt, ', '.join(FORMATS)))
+    return fmt
+
+#
+# columns_of
+#  column names from a DB-API cursor description
+#
+def columns_of(description):
+    if description is None:
+        return []
+    return [ d[0] for d in description ]
+
+#
+# dict_rows
+#  tuple rows as dictionaries keyed on column name, the shape query returns
+#  by default.  the column names are looked up once per result rather than
+#  once per row, which is what a row factory does.
+#
+def dict_rows(rows, columns):
+    return list(map(dict, map(zip, itertools.repeat(columns), rows)))
+
+#
+# fetch_rows
+#  adbapi interaction, run s with arguments a and return the rows as
+#  dictionaries, for drivers whose cursors return tuples
+#
+def fetch_rows(cur, s, a):
+    cur.execute(s, a)
+    return dict_rows(cur.fetchall(), columns_of(cur.description))
+
+#
+# columnar
+#  rows - the fetched rows, dictionaries or sequences
+#  columns - the column names, in order
+# returns:
+#  the columnar encoding described above
+#
+def columnar(rows, columns):
+    if rows and isinstance(rows[0], dict):
+        arrays = [ [ r[c] for c in columns ] for r in rows ]
+    else:
+        arrays = [ list(r) for r in rows ]
+
+    dicts = {}
+    n = len(arrays)
+    if n >= DICT_MIN_ROWS:
+        limit = n // DICT_RATIO
+        for ci in range(len(columns)):
+            index = {}
+            try:
+                for r in arrays:
+                    if r[ci] not in index:
+                        index[r[ci]] = len(index)
+                        if len(index) > limit:
+                            break
+            except TypeError:
+                # unhashable values (arrays, json) are left alone
+                continue
+            if len(index) > limit:
+                continue
+            values = [ None ] * len(index)
+            for v, i in index.items():
+                values[i] = v
+            for r in arrays:
+                r[ci] = index[r[ci]]
+            dicts[columns[ci]] = values
+
+    return { 'columns':columns, 'rows':arrays, 'dicts':dicts }
+
+#
+# fetch_columnar
+#  adbapi interaction, run s with arguments a and return the result columnar
+#
+def fetch_columnar(cur, s, a):
+    cur.execute(s, a)
+    return columnar(cur.fetchall(), columns_of(cur.description))
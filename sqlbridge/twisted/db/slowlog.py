@@ -0,0 +1,138 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## slowlog.py - slow query log for the postgres driver
+##
+## a query or operation that takes longer than slow_ms milliseconds is
+## remembered here: the statement with its literals and whitespace squeezed
+## out (so the same statement always reads the same), the shape of its
+## arguments (names and types, never the values), the caller's authid and
+## how long it took.  the driver can also attach the plan postgres would
+## use, from EXPLAIN (ANALYZE off, FORMAT JSON).
+##
+## only the last slow_size entries are kept.  topic_base.slowlog returns
+## them, newest first.
+###############################################################################
+
+from __future__ import absolute_import
+import re, time, collections
+
+import six
+
+#
+# default number of entries kept
+#
+SLOW_SIZE = 100
+
+# quoted strings, and numbers that aren't part of a name or a $n
+literal = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?(?:e[+-]?\d+)?", re.I)
+space = re.compile(r'\s+')
+
+#
+# normalize
+#  s with its literals replaced by ? and its whitespace squeezed
+#
+def normalize(s):
+    if not isinstance(s, six.string_types):
+        return s
+    return space.sub(' ', literal.sub('?', s)).strip()
+
+#
+# args_shape
+#  the names and types of the arguments a, without their values
+#
+def args_shape(a):
+    if isinstance(a, dict):
+        return dict((k, args_shape(v)) for k, v in a.items())
+    if isinstance(a, (list, tuple)):
+        return '{}[{}]'.format(type(a).__name__, len(a))
+    if a is None:
+        return None
+    return type(a).__name__
+
+class SlowLog(object):
+    """
+    ring buffer of slow statements
+    """
+
+    def __init__(self, slow_ms, size=SLOW_SIZE, clock=time.time):
+        self.threshold = float(slow_ms) / 1000.0 if slow_ms else None
+        self.size = int(size)
+        self.clock = clock
+        self.entries = collections.deque(maxlen=self.size)
+        self.recorded = 0
+
+    def enabled(self):
+        return self.threshold is not None and self.size > 0
+
+    #
+    # record
+    #  kind - 'query' or 'operation'
+    #  s, a - the statement (or array of them) and arguments
+    #  authid - the caller, or None
+    #  started - when it started, from clock
+    #  err - the error it ended with, if it failed
+    # returns:
+    #  the entry, or None when it wasn't slow.  the driver adds the plan
+    #  to the entry when EXPLAIN comes back.
+    #
+    def record(self, kind, s, a, authid, started, err=None):
+        if not self.enabled():
+            return None
+        elapsed = self.clock() - started
+        if elapsed < self.threshold:
+            return None
+        if isinstance(s, (list, tuple)):
+            sql = [ normalize(w) for w in s ]
+            shape = [ args_shape(w) for w in a ]
+        else:
+            sql = normalize(s)
+            shape = args_shape(a)
+        e = {
+            'kind':kind,
+            'sql':sql,
+            'args':shape,
+            'authid':authid,
+            'at':started,
+            'ms':elapsed * 1000.0,
+            'error':str(err) if err is not None else None,
+            'plan':None
+        }
+        self.entries.append(e)
+        self.recorded += 1
+        return e
+
+    #
+    # snapshot
+    #  the last limit entries, newest first
+    #
+    def snapshot(self, limit=None):
+        rv = list(self.entries)
+        rv.reverse()
+        if limit is not None:
+            rv = rv[:int(limit)]
+        return {
+            'slow_ms':self.threshold * 1000.0 if self.threshold is not None else None,
+            'size':self.size,
+            'recorded':self.recorded,
+            'entries':rv
+        }
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,100 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## sqliteopts.py - sqlite3 dsn options and connection setup
+##
+## besides the sqlite3.connect arguments (database=, timeout=, ...) the
+## sqlite dsn may carry pragmas, run on every connection as it is opened:
+##
+##  journal_mode=wal      write ahead log, readers don't block the writer
+##  synchronous=normal    off, normal, full or extra
+##  cache_size=-20000     pages, or KiB when negative
+##  mmap_size=268435456   bytes of the file to memory map
+##  busy_timeout=5000     milliseconds to wait for a lock
+##
+## with journal_mode=wal the driver runs one writer connection, which every
+## operation, operation_many and copy_in goes through in turn, and a pool of
+## readers=N (default 4) read only connections for query and query_stream.
+###############################################################################
+
+from __future__ import absolute_import
+import re
+
+#
+# pragmas that may be given in the dsn, in the order they are run
+#
+PRAGMAS = ( 'journal_mode', 'busy_timeout', 'synchronous', 'cache_size', 'mmap_size', )
+
+#
+# default number of reader connections in wal mode
+#
+READERS = 4
+
+# pragma values are put in the statement text, so they must be plain words
+pragma_value = re.compile(r'^-?\w+$')
+
+# sqlite3.connect wants these as numbers
+float_args = ( 'timeout', )
+int_args = ( 'cached_statements', )
+
+#
+# dsn_args
+#  database=x timeout=y journal_mode=wal ... split up.
+# returns:
+#  (sqlite3.connect arguments, [ (pragma, value) ... ], number of readers)
+#  readers is 0 unless journal_mode is wal.
+#
+def dsn_args(dsn):
+    kw = dict(s.split('=', 1) for s in dsn.split())
+    pragmas = []
+    for k in PRAGMAS:
+        if k in kw:
+            v = kw.pop(k)
+            if not pragma_value.match(v):
+                raise Exception("SQLITE3_3_8_2: bad value for pragma {}: {}".format(k, v))
+            pragmas.append((k, v.lower()))
+    readers = int(kw.pop('readers', READERS))
+    for k in float_args:
+        if k in kw:
+            kw[k] = float(kw[k])
+    for k in int_args:
+        if k in kw:
+            kw[k] = int(kw[k])
+    if dict(pragmas).get('journal_mode') != 'wal' or kw.get('database', ':memory:') == ':memory:':
+        # an in memory database is private to its connection, it
+        # can't have readers
+        readers = 0
+    return kw, pragmas, readers
+
+#
+# opener
+#  the cp_openfun of a pool: set the row factory, run the pragmas and, for
+#  readers, make the connection read only.  python 2's sqlite3 can't open
+#  a file:...?mode=ro uri, so read only is PRAGMA query_only, which sqlite
+#  has had since 3.8.0.
+#
+def opener(pragmas, query_only=False, row_factory=None):
+    def openfun(conn):
+        if row_factory is not None:
+            conn.row_factory = row_factory
+        for k, v in pragmas:
+            conn.execute('pragma {} = {}'.format(k, v)).fetchall()
+        if query_only:
+            conn.execute('pragma query_only = 1')
+    return openfun
@@ -0,0 +1,236 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## watches.py - the watched NOTIFY channels of the postgres driver
+##
+## the topic of a watch is topic_base.watch.CHANNEL, so every bridge and
+## every client agrees on it, and a batched watch adds a suffix to that
+## (see notifybatch.py), as does a filtered watch (see watchfilter.py).
+## each topic has a sink that publishes the payloads, plainly or in
+## batches, and may have a filter.  when a notification comes each
+## distinct filter of the channel is evaluated once, and the payload is
+## handed to the sinks whose filter passed it.
+##
+## a topic is held by the callers that asked for it with watch and haven't
+## let go with unwatch (counted, a caller may watch more than once), and,
+## on a router with subscription meta events, by having subscribers.  when
+## nothing holds a topic its sink goes, and when a channel has no topics
+## left the driver UNLISTENs it.
+###############################################################################
+
+from __future__ import absolute_import
+import re
+
+from .watchfilter import Payload
+
+#
+# channel names are kept to what is both a plain postgres identifier and
+# a strict WAMP uri component
+#
+channel_name = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+def check_channel(word):
+    if not channel_name.match(word):
+        raise Exception("watch: bad channel name {}, expected lower case letters, digits and _".format(word))
+    return word
+
+class Plain(object):
+    """
+    publishes each payload as it comes
+    """
+
+    filter = None
+
+    def __init__(self, publish, topic):
+        self.publish = publish
+        self.topic = topic
+        self.stats = { 'notifications':0, 'published':0 }
+
+    def add(self, payload):
+        self.stats['notifications'] += 1
+        self.stats['published'] += 1
+        self.publish(self.topic, payload)
+
+    def stop(self):
+        pass
+
+    def info(self):
+        return dict(self.stats)
+
+class Channel(object):
+    """
+    one LISTENed channel and its topics
+    """
+
+    def __init__(self, word):
+        self.word = word
+        # topic -> sink
+        self.sinks = {}
+        # topic -> { caller: number of watch calls }
+        self.holders = {}
+        # topics the router says have subscribers
+        self.subscribed = set()
+        self.notifications = 0
+
+    def notify(self, payload):
+        self.notifications += 1
+        p = Payload(payload)
+        passed = {}
+        for s in self.sinks.values():
+            f = s.filter
+            if f is not None:
+                if f.key not in passed:
+                    passed[f.key] = f.match(p)
+                if not passed[f.key]:
+                    continue
+            s.add(payload)
+
+    def held(self, topic):
+        return bool(self.holders.get(topic)) or topic in self.subscribed
+
+    #
+    # sweep
+    #  stop the sinks of the topics nothing holds, returns those topics
+    #
+    def sweep(self):
+        idle = [ t for t in self.sinks if not self.held(t) ]
+        for t in idle:
+            self.sinks.pop(t).stop()
+            self.holders.pop(t, None)
+        return idle
+
+class Watches(object):
+    """
+    every watched channel, by name
+    """
+
+    def __init__(self, prefix):
+        # topic_base.watch
+        self.prefix = prefix
+        self.channels = {}
+        # topic -> channel name
+        self.topics = {}
+        # router subscription id -> topic, from the meta events
+        self.subscriptions = {}
+
+    def topic(self, word):
+        return self.prefix + '.' + word
+
+    #
+    # hold
+    #  caller wants topic of channel word.  sink() makes the topic's sink
+    #  if it is new.  returns True if the channel is new, so the driver
+    #  LISTENs to it.
+    #
+    def hold(self, word, topic, sink, caller):
+        new = word not in self.channels
+        c = self.channels.setdefault(word, Channel(word))
+        if topic not in c.sinks:
+            c.sinks[topic] = sink()
+            self.topics[topic] = word
+        h = c.holders.setdefault(topic, {})
+        h[caller] = h.get(caller, 0) + 1
+        return new
+
+    #
+    # release
+    #  caller lets go of topic, once.  returns the channels left with no
+    #  topics, for the driver to UNLISTEN.
+    #
+    def release(self, topic, caller):
+        word = self.topics.get(topic)
+        if word is None:
+            return []
+        h = self.channels[word].holders.get(topic, {})
+        if caller in h:
+            h[caller] -= 1
+            if h[caller] <= 0:
+                del h[caller]
+        return self.sweep([ word ])
+
+    #
+    # caller_left
+    #  caller let go of everything.  returns the channels left empty.
+    #
+    def caller_left(self, caller):
+        words = []
+        for c in self.channels.values():
+            for h in c.holders.values():
+                if h.pop(caller, None) is not None and c.word not in words:
+                    words.append(c.word)
+        return self.sweep(words)
+
+    #
+    # subscribed, unsubscribed
+    #  the router's subscription meta events.  the last subscriber going
+    #  lets go of the topic for everybody, the subscribers were what the
+    #  watch calls were for.
+    #
+    def subscribed(self, sid, topic):
+        word = self.topics.get(topic)
+        if word is None:
+            return False
+        self.subscriptions[sid] = topic
+        self.channels[word].subscribed.add(topic)
+        return True
+
+    def unsubscribed(self, sid):
+        topic = self.subscriptions.pop(sid, None)
+        word = self.topics.get(topic)
+        if word is None:
+            return []
+        c = self.channels[word]
+        c.subscribed.discard(topic)
+        c.holders.pop(topic, None)
+        return self.sweep([ word ])
+
+    def sweep(self, words):
+        empty = []
+        for w in words:
+            c = self.channels.get(w)
+            if c is None:
+                continue
+            for t in c.sweep():
+                del self.topics[t]
+            if not c.sinks:
+                del self.channels[w]
+                empty.append(w)
+        return empty
+
+    def notify(self, word, payload):
+        c = self.channels.get(word)
+        if c is not None:
+            c.notify(payload)
+
+    def stop(self):
+        for c in self.channels.values():
+            for s in c.sinks.values():
+                s.stop()
+        self.channels = {}
+        self.topics = {}
+        self.subscriptions = {}
+
+    def info(self):
+        return dict((w, {
+            'notifications':c.notifications,
+            'topics':dict((t, dict(s.info(),
+                holders=sum(c.holders.get(t, {}).values()), subscribed=t in c.subscribed,
+                filter=[ x.canonical() for x in s.filter.terms ] if s.filter is not None else None))
+                for t, s in c.sinks.items())
+        }) for w, c in self.channels.items())
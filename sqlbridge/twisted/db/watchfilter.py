@@ -0,0 +1,183 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## watchfilter.py - server side filters for watch payloads
+##
+## watch can be given a filter, and only the notifications that pass it are
+## published, to a topic of their own derived from the filter.  a filter is
+## a term, or an array of terms that must all hold.  a term names what it
+## looks at and one test:
+##
+##  { "path": "$.table", "eq": "employee" }  a json path into the payload
+##  { "key": "region", "prefix": "us-" }     a key of a json object payload
+##  { "prefix": "employee:" }                the payload text itself
+##
+## the tests are eq, ne, lt, le, gt, ge, in (an array of values), prefix
+## and exists (true or false).  a payload that isn't json only passes terms
+## on the payload text.
+##
+## watchers asking for the same filter (however they spell it) share its
+## topic, and each filter is evaluated once per notification, the payload
+## parsed once for all of them.
+###############################################################################
+
+from __future__ import absolute_import
+import re, json, hashlib
+
+import six
+
+tests = ( 'eq', 'ne', 'lt', 'le', 'gt', 'ge', 'in', 'prefix', 'exists', )
+
+path_step = re.compile(r'\.([^.\[\]]+)|\[(\d+)\]')
+
+MISSING = object()
+
+#
+# parse_path
+#  '$.a.b[0]' (or 'a.b[0]') -> [ 'a', 'b', 0 ]
+#
+def parse_path(p):
+    s = p.strip()
+    if s.startswith('$'):
+        s = s[1:]
+    elif s and not s.startswith('.') and not s.startswith('['):
+        s = '.' + s
+    rv = []
+    at = 0
+    for m in path_step.finditer(s):
+        if m.start() != at:
+            raise Exception("watchfilter: bad path {}".format(p))
+        rv.append(m.group(1) if m.group(1) is not None else int(m.group(2)))
+        at = m.end()
+    if at != len(s):
+        raise Exception("watchfilter: bad path {}".format(p))
+    return rv
+
+class Payload(object):
+    """
+    a notification payload, parsed as json at most once
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.doc = MISSING
+        self.parsed = False
+
+    def json(self):
+        if not self.parsed:
+            self.parsed = True
+            try:
+                self.doc = json.loads(self.raw)
+            except (TypeError, ValueError):
+                self.doc = MISSING
+        return self.doc
+
+class Term(object):
+    """
+    one test on one part of the payload
+    """
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise Exception("watchfilter: a filter term must be an object, not {}".format(spec))
+        t = [ k for k in spec if k in tests ]
+        if len(t) != 1 or len(spec) - len(t) > 1 or (len(spec) == 2 and 'path' not in spec and 'key' not in spec):
+            raise Exception("watchfilter: a filter term is a path (or key) and one of {}, not {}".format(tests, spec))
+        self.test = t[0]
+        self.value = spec[self.test]
+        if 'path' in spec:
+            self.path = parse_path(spec['path'])
+        elif 'key' in spec:
+            self.path = [ spec['key'] ]
+        else:
+            self.path = None
+        if self.test == 'in' and not isinstance(self.value, list):
+            raise Exception("watchfilter: in wants an array, not {}".format(self.value))
+        if self.test == 'prefix' and not isinstance(self.value, six.string_types):
+            raise Exception("watchfilter: prefix wants a string, not {}".format(self.value))
+
+    def canonical(self):
+        return [ self.path, self.test, self.value ]
+
+    def find(self, payload):
+        if self.path is None:
+            return payload.raw
+        v = payload.json()
+        for step in self.path:
+            if isinstance(step, int) and isinstance(v, list) and step < len(v):
+                v = v[step]
+            elif isinstance(v, dict) and not isinstance(step, int) and step in v:
+                v = v[step]
+            else:
+                return MISSING
+        return v
+
+    def match(self, payload):
+        v = self.find(payload)
+        t = self.test
+        if t == 'exists':
+            return (v is not MISSING) == bool(self.value)
+        if v is MISSING:
+            return False
+        if t == 'eq':
+            return v == self.value
+        if t == 'ne':
+            return v != self.value
+        if t == 'in':
+            return v in self.value
+        if t == 'prefix':
+            return isinstance(v, six.string_types) and v.startswith(self.value)
+        # order only between numbers, or between strings
+        number = ( six.integer_types + ( float, ) )
+        if isinstance(v, bool) or not ((isinstance(v, number) and isinstance(self.value, number)) or
+                (isinstance(v, six.string_types) and isinstance(self.value, six.string_types))):
+            return False
+        if t == 'lt':
+            return v < self.value
+        if t == 'le':
+            return v <= self.value
+        if t == 'gt':
+            return v > self.value
+        return v >= self.value
+
+class Filter(object):
+    """
+    terms that must all hold
+    """
+
+    def __init__(self, spec):
+        specs = spec if isinstance(spec, list) else [ spec ]
+        if not specs:
+            raise Exception("watchfilter: empty filter")
+        self.terms = [ Term(s) for s in specs ]
+        # the same filter spelled differently gets the same key
+        self.key = json.dumps(sorted(json.dumps(t.canonical(), sort_keys=True) for t in self.terms))
+
+    def match(self, payload):
+        return all(t.match(payload) for t in self.terms)
+
+    def suffix(self):
+        return 'f_' + hashlib.sha1(self.key.encode('utf8')).hexdigest()[:16]
+
+#
+# filter_topic
+#  the topic of watch topic with filter f
+#
+def filter_topic(topic, f):
+    return topic + '.' + f.suffix()
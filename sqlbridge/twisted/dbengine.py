@@ -23,7 +23,8 @@ import sys,os,argparse,six
 
 from twisted.python import log
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import defer, task
+from twisted.internet.defer import inlineCallbacks, returnValue
 from twisted.internet.endpoints import clientFromString
 
 #from myapprunner import MyApplicationRunner
@@ -36,6 +37,49 @@ from autobahn.wamp.exception import ApplicationError
 from autobahn.twisted import wamp, websocket
 from autobahn.twisted.wamp import ApplicationSession
 
+from . import dbstats, admission
+
+#
+# init variables that are handed through to the database driver
+#  cp_min, cp_max - connection pool size
+#  cp_reconnect - reconnect dropped pool connections (MYSQL)
+#  page_size - rows per progressive result for query_stream
+#  prepare_max - prepared statements kept per connection (PG)
+#  cache_size - bytes of query results kept for cache_ttl queries
+#  replicas - dsns of read replicas (PG)
+#  sticky - seconds a caller's reads stay on the primary after a write (PG)
+#  max_lag, lag_interval - replica lag allowed, and how often it is checked (PG)
+#  slow_ms, slow_size, slow_explain - the slow query log (PG)
+#  timeout - seconds a statement may run, 0 for no limit
+#
+driver_options = ( 'cp_min', 'cp_max', 'cp_reconnect', 'page_size', 'prepare_max', 'cache_size',
+    'replicas', 'sticky', 'max_lag', 'lag_interval', 'slow_ms', 'slow_size', 'slow_explain', 'timeout',
+    'typed', 'txn_idle', )
+
+#
+# the procedures registered under topic_base
+#
+procedures = ( 'connect', 'disconnect', 'query', 'query_stream', 'copy_in',
+    'operation', 'operation_many', 'watch', 'unwatch', 'info', 'slowlog',
+    'begin', 'commit', 'rollback', )
+
+#
+# the router meta events saying a session has left, see caller_left.  the
+# second is what older routers call it.
+#
+leave_topics = ( u'wamp.session.on_leave', u'wamp.metaevent.session.on_leave', )
+
+#
+# seconds between registration attempts of a worker standing by, see
+# register_procedures
+#
+STANDBY_RETRY = 10.0
+
+#
+# seconds between snapshots published to stats_topic
+#
+STATS_INTERVAL = 10.0
+
 class DB(ApplicationSession):
     """
     An application component providing db access
@@ -50,7 +94,8 @@ class DB(ApplicationSession):
         log.msg("got args {}, kwargs {}".format(args,kwargs))
 
         # reap init variables meant only for us
-        for i in ( 'engine', 'topic_base', 'dsn', 'authinfo', 'debug', ):
+        for i in ( 'engine', 'topic_base', 'dsn', 'authinfo', 'debug', 'worker', 'supervisor',
+                'stats_topic', 'stats_interval', 'max_in_flight', 'max_queue', 'limits', ) + driver_options:
             if i in kwargs:
                 if kwargs[i] is not None:
                     self.svar[i] = kwargs[i]
@@ -92,16 +137,25 @@ class DB(ApplicationSession):
     def onJoin(self, details):
         log.msg("db:onJoin session attached {}".format(details))
 
+        if 'supervisor' in self.svar and 'topic_base' in self.svar:
+            # the supervisor of --workers has no driver, it reports on the workers
+            self.db = { 'registration': {} }
+            self.db['registration']['workers'] = yield self.register(self.svar['supervisor'].stats,
+                self.svar['topic_base']+'.workers')
+            log.msg("db supervisor procedures registered")
+            return
+
         if 'engine' in self.svar and 'topic_base' in self.svar:
+            dopts = dict((i, self.svar[i]) for i in driver_options if i in self.svar)
             if self.svar['engine'] == 'PG9_4' or self.svar['engine'] == 'PG':
                 from .db import postgres
-                dbo = postgres.PG9_4(topic_base = self.svar['topic_base'], app_session = self, debug = self.svar['debug'])
+                dbo = postgres.PG9_4(topic_base = self.svar['topic_base'], app_session = self, debug = self.svar['debug'], **dopts)
             elif self.svar['engine'] == 'MYSQL14_14' or self.svar['engine'] == 'MYSQL':
                 from .db import mysql
-                dbo = mysql.MYSQL14_14(topic_base = self.svar['topic_base'], app_session = self, debug = self.svar['debug'])
+                dbo = mysql.MYSQL14_14(topic_base = self.svar['topic_base'], app_session = self, debug = self.svar['debug'], **dopts)
             elif self.svar['engine'] == 'SQLITE3_3_8_2' or self.svar['engine'] == 'SQLITE3' or self.svar['engine'] == 'SQLITE':
                 from .db import ausqlite3
-                dbo = ausqlite3.SQLITE3_3_8_2(topic_base = self.svar['topic_base'], app_session = self, debug = self.svar['debug'])
+                dbo = ausqlite3.SQLITE3_3_8_2(topic_base = self.svar['topic_base'], app_session = self, debug = self.svar['debug'], **dopts)
             else:
                 raise Exception("Unsupported dbtype {} ".format(self.svar['engine']))
         else:
@@ -109,14 +163,30 @@ class DB(ApplicationSession):
 
         self.db = { 'instance': dbo }
         self.db['registration'] = {}
+        self.db['stats'] = dbstats.Stats()
+        self.db['admission'] = admission.Admission(self.svar['topic_base'] + '.error.overloaded',
+            max_in_flight=self.svar.get('max_in_flight', admission.MAX_IN_FLIGHT),
+            max_queue=self.svar.get('max_queue', admission.MAX_QUEUE),
+            limits=admission.parse_limits(self.svar.get('limits')))
+
+        if 'stats_topic' in self.svar:
+            self.db['publisher'] = task.LoopingCall(self.publish_stats)
+            self.db['publisher'].start(float(self.svar.get('stats_interval', STATS_INTERVAL)), now=False)
+
+        yield self.watch_callers()
+
+        if 'worker' in self.svar:
+            # with shared registrations .connect goes to any worker, so
+            # each worker connects its own driver, before it registers
+            if 'dsn' in self.svar:
+                log.msg("db:onJoin worker {} connecting... {}".format(self.svar['worker'], self.svar['dsn']))
+                yield defer.maybeDeferred(dbo.connect, self.svar['dsn'])
+            from . import workers
+            self.db['reporter'] = workers.StatsReporter(dbo, self.svar['worker'])
+            yield self.register_procedures(dbo)
+            return
 
-        r = types.RegisterOptions(details_arg = 'details')
-        self.db['registration']['connect'] = yield self.register(dbo.connect, self.svar['topic_base']+'.connect', options = r)
-        self.db['registration']['disconnect'] = yield self.register(dbo.disconnect, self.svar['topic_base']+'.disconnect', options = r)
-        self.db['registration']['query'] = yield self.register(dbo.query, self.svar['topic_base']+'.query', options = r)
-        self.db['registration']['operation'] = yield self.register(dbo.operation, self.svar['topic_base']+'.operation', options = r)
-        self.db['registration']['watch'] = yield self.register(dbo.watch, self.svar['topic_base']+'.watch', options = r)
-        self.db['registration']['info'] = yield self.register(dbo.info, self.svar['topic_base']+'.info', options = r)
+        yield self.register_procedures(dbo)
 
         if 'dsn' in self.svar:
             log.msg("db:onJoin connecting... {}".format(self.svar['dsn']))
@@ -125,15 +195,125 @@ class DB(ApplicationSession):
 
         log.msg("db bootstrap procedures registered")
 
+    #
+    # register_options
+    #  workers share their registrations, the router hands each call to the
+    #  next worker in turn.  an autobahn too old to know about shared
+    #  registrations gets plain ones.
+    #
+    def register_options(self):
+        if 'worker' in self.svar:
+            try:
+                return types.RegisterOptions(details_arg = 'details', invoke = u'roundrobin')
+            except TypeError:
+                log.msg("db: this autobahn can't share registrations")
+        return types.RegisterOptions(details_arg = 'details')
+
+    #
+    # register_procedures
+    #  register the driver's procedures under topic_base.  each call is
+    #  let in by admission control (see admission.py) and counted (see
+    #  dbstats.py), the counts include the time spent waiting to get in
+    #  and the calls refused.  a worker whose
+    #  router doesn't share registrations finds them taken by another
+    #  worker, it stands by and tries again every STANDBY_RETRY seconds,
+    #  so it takes over if that worker dies.
+    #
+    @inlineCallbacks
+    def register_procedures(self, dbo):
+        r = self.register_options()
+        try:
+            for p in procedures:
+                f = self.db['admission'].wrap(p, getattr(dbo, p))
+                self.db['registration'][p] = yield self.register(self.db['stats'].wrap(p, f),
+                    self.svar['topic_base']+'.'+p, options = r)
+            self.db['registration']['stats'] = yield self.register(self.stats_snapshot,
+                self.svar['topic_base']+'.stats', options = r)
+        except ApplicationError as err:
+            if 'worker' not in self.svar:
+                raise
+            log.msg("db: worker {} standing by, registration failed ({})".format(self.svar['worker'], err))
+            for reg in list(self.db['registration'].values()):
+                yield reg.unregister()
+            self.db['registration'] = {}
+            reactor.callLater(STANDBY_RETRY, self.register_procedures, dbo)
+            returnValue(False)
+        log.msg("db: procedures registered on {}".format(self.svar['topic_base']))
+        returnValue(True)
+
+    #
+    # watch_callers:
+    #  subscribe to the router's session meta events, so the calls of a
+    #  caller that leaves can be stopped.  a router without them just
+    #  doesn't tell us, the calls then run to the end (or their timeout).
+    #
+    @inlineCallbacks
+    def watch_callers(self):
+        self.db['leave'] = []
+        for t in leave_topics:
+            try:
+                s = yield self.subscribe(self.caller_left, t)
+                self.db['leave'].append(s)
+            except Exception as err:
+                log.msg("db: can't subscribe to {}, error({})".format(t, err))
+
+    #
+    # caller_left:
+    #  a session left the router.  its calls waiting for admission are
+    #  dropped and the driver stops the ones running, freeing their
+    #  connections.
+    #
+    def caller_left(self, *args, **kwargs):
+        if not args:
+            return
+        caller = args[0]
+        if isinstance(caller, dict):
+            caller = caller.get('session')
+        if caller is None or 'instance' not in self.db:
+            return
+        n = self.db['admission'].cancel_caller(caller)
+        n += self.db['instance'].cancel_caller(caller)
+        if n:
+            log.msg("db: session {} left, {} calls cancelled".format(caller, n))
+
+    #
+    # stats_snapshot:
+    #  the topic_base.stats procedure.  the counters of every procedure
+    #  (see dbstats.py), their admission gates (see admission.py) and the
+    #  occupancy of the driver's pool.
+    #
+    def stats_snapshot(self, *args, **kwargs):
+        rv = self.db['stats'].snapshot()
+        rv['admission'] = self.db['admission'].snapshot()
+        rv['pool'] = self.db['instance'].pool_stats()
+        if 'worker' in self.svar:
+            rv['worker'] = self.svar['worker']
+        return rv
+
+    #
+    # publish_stats:
+    #  every stats_interval seconds when stats_topic is set
+    #
+    def publish_stats(self):
+        try:
+            self.publish(self.svar['stats_topic'], self.stats_snapshot())
+        except Exception as err:
+            log.msg("db: stats publish failed, error({})".format(err))
+
+    @inlineCallbacks
     def onLeave(self, details):
         print("onLeave: {}").format(details)
 
-        yield self.db['registration']['connect'].unregister()
-        yield self.db['registration']['disconnect'].unregister()
-        yield self.db['registration']['query'].unregister()
-        yield self.db['registration']['operation'].unregister()
-        yield self.db['registration']['watch'].unregister()
-        yield self.db['registration']['info'].unregister()
+        if 'publisher' in self.db and self.db['publisher'].running:
+            self.db['publisher'].stop()
+
+        # the session is going away, an unregister that fails mustn't
+        # keep it from disconnecting
+        for reg in list(self.db.get('registration', {}).values()):
+            try:
+                yield reg.unregister()
+            except Exception as err:
+                log.msg("db: unregister on leave failed, error({})".format(err))
 
         del self.db
 
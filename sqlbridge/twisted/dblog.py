@@ -0,0 +1,122 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## dblog.py - leveled logging for the query path
+##
+## log.msg("...".format(x)) builds the string whether or not anybody reads
+## the log.  the functions here take the format string and the arguments
+## separately, and only format when the level is enabled.  a disabled call
+## costs one comparison.
+##
+## result sets are wrapped in rows(), which logs as a row count and size
+## unless the level is TRACE, in which case the whole result is logged.
+###############################################################################
+
+from __future__ import absolute_import
+
+from twisted.python import log
+
+ERROR = 40
+INFO = 20
+DEBUG = 10
+TRACE = 5
+
+names = { 'error':ERROR, 'info':INFO, 'debug':DEBUG, 'trace':TRACE }
+
+level = INFO
+
+#
+# setLevel
+#  l is one of the names above ('debug') or a number
+#
+def setLevel(l):
+    global level
+    if l in names:
+        l = names[l]
+    level = int(l)
+    return
+
+def enabled(l):
+    return l >= level
+
+def msg(l, fmt, *args):
+    if l >= level:
+        log.msg(fmt.format(*args) if args else fmt)
+
+def error(fmt, *args):
+    if ERROR >= level:
+        log.msg(fmt.format(*args) if args else fmt)
+
+def info(fmt, *args):
+    if INFO >= level:
+        log.msg(fmt.format(*args) if args else fmt)
+
+def debug(fmt, *args):
+    if DEBUG >= level:
+        log.msg(fmt.format(*args) if args else fmt)
+
+def trace(fmt, *args):
+    if TRACE >= level:
+        log.msg(fmt.format(*args) if args else fmt)
+
+#
+# rows
+#  wrap a result set for logging.  nothing is computed until the wrapper is
+#  formatted, which only happens when the log level is enabled.
+#
+class rows(object):
+    __slots__ = ( 'rv', )
+
+    def __init__(self, rv):
+        self.rv = rv
+
+    def __str__(self):
+        if TRACE >= level:
+            return str(self.rv)
+        return summary(self.rv)
+
+    __repr__ = __str__
+
+#
+# summary
+#  describe a result without formatting it, like '500 rows, 9 columns, 61234 bytes'.
+#  bytes is the size of the values as text, which is close to what goes over
+#  the wire.
+#
+def summary(rv):
+    if rv is None:
+        return 'None'
+    if isinstance(rv, dict):
+        rv = [ rv ]
+    if not isinstance(rv, (list, tuple)):
+        return '{} bytes'.format(len(str(rv)))
+    ncol = 0
+    nbytes = 0
+    for r in rv:
+        if isinstance(r, dict):
+            ncol = len(r)
+            for k in r:
+                nbytes += len(k) + len(str(r[k]))
+        elif isinstance(r, (list, tuple)):
+            ncol = len(r)
+            for v in r:
+                nbytes += len(str(v))
+        else:
+            nbytes += len(str(r))
+    return '{} rows, {} columns, {} bytes'.format(len(rv), ncol, nbytes)
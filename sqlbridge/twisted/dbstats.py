@@ -0,0 +1,211 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## dbstats.py - per procedure call statistics
+##
+## DB wraps every procedure it registers, so each call is counted: calls,
+## errors, calls in flight, rows and bytes returned, and the latency in a
+## histogram.  topic_base.stats returns a snapshot, and with --stats-topic
+## the snapshot is also published every --stats-interval seconds.
+##
+## the histogram buckets are HDR style, 16 linear buckets per power of two
+## microseconds, so any latency is recorded within about 6% and the whole
+## range (a microsecond to hours) fits in a few hundred counters.
+###############################################################################
+
+from __future__ import absolute_import
+
+import time, json
+
+from twisted.internet.defer import maybeDeferred
+
+#
+# sub buckets per power of two, as bits
+#
+SUB_BITS = 4
+SUB = 1 << SUB_BITS
+
+#
+# bytes are estimated from this many rows of a result
+#
+BYTES_SAMPLE = 16
+
+def bucket(us):
+    if us < 2 * SUB:
+        return us
+    e = us.bit_length() - SUB_BITS - 1
+    return e * SUB + (us >> e)
+
+#
+# bucket_range
+#  the lowest and highest microsecond values that land in bucket i
+#
+def bucket_range(i):
+    if i < 2 * SUB:
+        return i, i
+    e = i // SUB - 1
+    m = i - e * SUB
+    return m << e, ((m + 1) << e) - 1
+
+class Histogram(object):
+    """
+    latency histogram, microseconds
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds):
+        us = max(0, int(seconds * 1000000))
+        i = bucket(us)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.count += 1
+        self.total += us
+        if self.min is None or us < self.min:
+            self.min = us
+        if us > self.max:
+            self.max = us
+
+    #
+    # percentile
+    #  the top of the bucket holding the p'th value, microseconds
+    #
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        want = max(1, int(round(self.count * p)))
+        seen = 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= want:
+                return min(bucket_range(i)[1], self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count':self.count,
+            'min_ms':(self.min or 0) / 1000.0,
+            'max_ms':self.max / 1000.0,
+            'mean_ms':(self.total / float(self.count) / 1000.0) if self.count else 0.0,
+            'p50_ms':self.percentile(0.50) / 1000.0,
+            'p90_ms':self.percentile(0.90) / 1000.0,
+            'p99_ms':self.percentile(0.99) / 1000.0,
+            'p999_ms':self.percentile(0.999) / 1000.0,
+            # [ top of bucket in ms, calls ], the empty buckets are left out
+            'buckets':[ [ bucket_range(i)[1] / 1000.0, self.counts[i] ] for i in sorted(self.counts) ]
+        }
+
+#
+# size_of
+#  (rows, bytes) of a result.  bytes is the json size, estimated from the
+#  first BYTES_SAMPLE rows so a large result isn't serialized twice.
+#
+def size_of(rv):
+    if rv is None:
+        return 0, 0
+    rows = rv
+    if isinstance(rv, dict):
+        rows = rv.get('rows') if isinstance(rv.get('rows'), list) else [ rv ]
+    if not isinstance(rows, (list, tuple)):
+        return 0, len(json.dumps(rv, default=str))
+    n = len(rows)
+    if n <= BYTES_SAMPLE:
+        return n, len(json.dumps(rv, default=str))
+    sample = len(json.dumps(rows[:BYTES_SAMPLE], default=str))
+    return n, int(sample * n / float(BYTES_SAMPLE))
+
+class ProcedureStats(object):
+    """
+    the counters of one procedure
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.rows = 0
+        self.bytes = 0
+        self.latency = Histogram()
+
+    def snapshot(self):
+        return {
+            'calls':self.calls,
+            'errors':self.errors,
+            'in_flight':self.in_flight,
+            'max_in_flight':self.max_in_flight,
+            'rows':self.rows,
+            'bytes':self.bytes,
+            'latency':self.latency.snapshot()
+        }
+
+class Stats(object):
+    """
+    the counters of every procedure of one DB session
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started = clock()
+        self.procedures = {}
+
+    #
+    # wrap
+    #  f, counted as procedure name
+    #
+    def wrap(self, name, f):
+        ps = self.procedures.setdefault(name, ProcedureStats())
+
+        def counted(*args, **kwargs):
+            ps.calls += 1
+            ps.in_flight += 1
+            if ps.in_flight > ps.max_in_flight:
+                ps.max_in_flight = ps.in_flight
+            started = self.clock()
+
+            def ok(rv):
+                ps.in_flight -= 1
+                ps.latency.record(self.clock() - started)
+                n, b = size_of(rv)
+                ps.rows += n
+                ps.bytes += b
+                return rv
+
+            def failed(err):
+                ps.in_flight -= 1
+                ps.errors += 1
+                ps.latency.record(self.clock() - started)
+                return err
+
+            d = maybeDeferred(f, *args, **kwargs)
+            d.addCallbacks(ok, failed)
+            return d
+
+        return counted
+
+    def snapshot(self):
+        return {
+            'started':self.started,
+            'uptime':self.clock() - self.started,
+            'procedures':dict((k, v.snapshot()) for k, v in self.procedures.items())
+        }
@@ -0,0 +1,91 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## serializers.py - the WAMP serializers the scripts offer
+##
+## sqlbridge, sqlcmd and sqlrouter take --serializer, a comma separated
+## list of json and msgpack in order of preference.  the websocket
+## handshake picks the first the other side also speaks.  the default,
+## auto, is msgpack when the msgpack package is installed, then json, so
+## peers that both have msgpack use it and everything else still talks
+## json.  msgpack is binary, and smaller and faster than json for typed
+## results (see --typed and bench/typed_payload.py).
+###############################################################################
+
+from __future__ import absolute_import
+
+from twisted.python import log
+from twisted.internet.endpoints import clientFromString
+
+from autobahn.websocket.protocol import parseWsUrl
+
+NAMES = ( 'msgpack', 'json', )
+AUTO = 'auto'
+
+#
+# serializers
+#  spec - 'auto', or names from NAMES, like 'msgpack,json'
+# returns:
+#  the autobahn serializers, in order of preference
+#
+def serializers(spec=AUTO):
+    names = [ n.strip() for n in (spec or AUTO).split(',') if n.strip() ]
+    auto = names == [ AUTO ]
+    if auto:
+        names = list(NAMES)
+    rv = []
+    for n in names:
+        if n == 'msgpack':
+            try:
+                from autobahn.wamp.serializer import MsgPackSerializer
+            except ImportError:
+                if auto:
+                    continue
+                raise Exception("serializers: msgpack needs the msgpack package, pip install msgpack-python")
+            rv.append(MsgPackSerializer())
+        elif n == 'json':
+            from autobahn.wamp.serializer import JsonSerializer
+            rv.append(JsonSerializer())
+        else:
+            raise Exception("serializers: unknown serializer {}, valid serializers are {} or {}".format(n,
+                ', '.join(NAMES), AUTO))
+    return rv
+
+#
+# run
+#  what ApplicationRunner.run does, with the serializers of spec.  session
+#  is the ApplicationSession to connect to the router at url.
+#
+def run(url, session, spec=AUTO):
+    # imported here, sqlrouter installs its own reactor
+    from twisted.internet import reactor
+    from autobahn.twisted.websocket import WampWebSocketClientFactory
+
+    is_secure, host, port = parseWsUrl(url)[:3]
+    tf = WampWebSocketClientFactory(lambda: session, serializers=serializers(spec), url=url, debug=False)
+    ep = clientFromString(reactor, "{}:{}:{}".format('ssl' if is_secure else 'tcp', host, port))
+    d = ep.connect(tf)
+
+    def failed(err):
+        log.msg("serializers:run() connecting to {} failed, {}".format(url, err.getErrorMessage()))
+        if reactor.running:
+            reactor.stop()
+
+    d.addErrback(failed)
+    reactor.run()
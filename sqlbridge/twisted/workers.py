@@ -0,0 +1,270 @@
+###############################################################################
+##
+##  Copyright (C) 2014 Greg Fausak
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##        http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+###############################################################################
+## workers.py - multi process mode for sqlbridge
+##
+## one bridge process runs on one core.  sqlbridge --workers N starts a
+## supervisor that runs N copies of itself (the same command line, less
+## --workers, plus --worker I).  each worker is a DB session with its own
+## driver, all registering the same topic_base procedures.  the router
+## spreads the calls over them if it supports shared registrations, if it
+## doesn't the first worker serves and the rest stand by.
+##
+## the supervisor restarts a worker that dies.  every STATS_INTERVAL
+## seconds each worker writes its driver's info() as a line of json on
+## STATS_FD, the supervisor adds them up, logs them, and answers
+## topic_base.workers with them.
+###############################################################################
+
+from __future__ import absolute_import
+
+import sys, os, json, time
+
+from twisted.python import log
+from twisted.internet import reactor, protocol, task, defer
+from twisted.internet.defer import inlineCallbacks
+
+#
+# the file descriptor a worker reports its stats on
+#
+STATS_FD = 3
+
+#
+# seconds between stats reports
+#
+STATS_INTERVAL = 10.0
+
+#
+# a worker that dies sooner than this after starting is restarted after a
+# delay, doubling each time up to RESTART_MAX seconds
+#
+RESTART_QUICK = 10.0
+RESTART_MAX = 30.0
+
+#
+# worker_argv
+#  the command line of worker i: ours, without --workers
+#
+def worker_argv(argv, i):
+    rv = []
+    skip = False
+    for w in argv:
+        if skip:
+            skip = False
+            continue
+        if w == '--workers':
+            skip = True
+            continue
+        if w.startswith('--workers='):
+            continue
+        rv.append(w)
+    return rv + [ '--worker', str(i) ]
+
+#
+# add_up
+#  add the numbers of d into total, recursively.  ratios don't add up, so
+#  anything named like one is left out, as are strings, lists and flags.
+#
+def add_up(total, d):
+    for k, v in d.items():
+        if isinstance(v, bool) or k.endswith('rate') or k.endswith('ratio'):
+            continue
+        if isinstance(v, (int, float)):
+            total[k] = total.get(k, 0) + v
+        elif isinstance(v, dict):
+            sub = total.get(k)
+            if not isinstance(sub, dict):
+                sub = total[k] = {}
+            add_up(sub, v)
+    return total
+
+class StatsReporter(object):
+    """
+    worker side, writes the driver's info() to the supervisor
+    """
+
+    def __init__(self, dbo, worker, fd=STATS_FD, interval=STATS_INTERVAL):
+        self.dbo = dbo
+        self.worker = worker
+        self.out = os.fdopen(fd, 'w')
+        self.loop = task.LoopingCall(self.report)
+        self.loop.start(interval, now=False)
+
+    @inlineCallbacks
+    def report(self):
+        try:
+            rv = yield self.dbo.info()
+            self.out.write(json.dumps({ 'worker':self.worker, 'pid':os.getpid(),
+                'info':rv[0] if isinstance(rv, list) else rv }, default=str) + '\n')
+            self.out.flush()
+        except Exception as err:
+            log.msg("worker {}: stats report failed, error({})".format(self.worker, err))
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+class WorkerProtocol(protocol.ProcessProtocol):
+    """
+    supervisor side, one worker process
+    """
+
+    def __init__(self, supervisor, worker):
+        self.supervisor = supervisor
+        self.worker = worker
+        self.buf = b''
+        self.started = time.time()
+        self.pid = None
+
+    def connectionMade(self):
+        self.pid = self.transport.pid
+        log.msg("worker {}: started, pid {}".format(self.worker, self.pid))
+
+    def childDataReceived(self, fd, data):
+        if fd != STATS_FD:
+            return
+        self.buf += data
+        while b'\n' in self.buf:
+            line, self.buf = self.buf.split(b'\n', 1)
+            try:
+                self.supervisor.reported(self.worker, json.loads(line.decode('utf8')))
+            except ValueError:
+                log.msg("worker {}: bad stats line {!r}".format(self.worker, line))
+
+    def processEnded(self, reason):
+        log.msg("worker {}: pid {} ended, {}".format(self.worker, self.pid, reason.value))
+        self.supervisor.ended(self)
+
+class Supervisor(object):
+    """
+    starts the workers, restarts the ones that die, adds up their stats
+    """
+
+    def __init__(self, workers, argv, executable=sys.executable, interval=STATS_INTERVAL):
+        self.workers = workers
+        self.argv = argv
+        self.executable = executable
+        self.interval = interval
+        self.procs = {}
+        self.restarts = dict((i, 0) for i in range(workers))
+        self.delay = dict((i, 1.0) for i in range(workers))
+        self.reports = {}
+        self.stopping = False
+        self.stopped = None
+        self.loop = None
+
+    def start(self):
+        for i in range(self.workers):
+            self.spawn(i)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        if self.interval > 0:
+            self.loop = task.LoopingCall(self.log_stats)
+            self.loop.start(self.interval, now=False)
+
+    def spawn(self, i):
+        if self.stopping:
+            return
+        p = WorkerProtocol(self, i)
+        args = [ self.executable ] + worker_argv(self.argv, i)
+        self.procs[i] = p
+        reactor.spawnProcess(p, self.executable, args, env=os.environ,
+            childFDs={ 0:'w', 1:1, 2:2, STATS_FD:'r' })
+
+    def ended(self, p):
+        if self.procs.get(p.worker) is p:
+            del self.procs[p.worker]
+        self.reports.pop(p.worker, None)
+        if self.stopping:
+            if not self.procs and self.stopped is not None:
+                d, self.stopped = self.stopped, None
+                d.callback(None)
+            return
+        if time.time() - p.started < RESTART_QUICK:
+            delay = self.delay[p.worker]
+            self.delay[p.worker] = min(delay * 2, RESTART_MAX)
+        else:
+            delay = self.delay[p.worker] = 1.0
+        self.restarts[p.worker] += 1
+        log.msg("worker {}: restarting in {} seconds".format(p.worker, delay))
+        reactor.callLater(delay, self.spawn, p.worker)
+
+    def reported(self, worker, report):
+        report['received'] = time.time()
+        self.reports[worker] = report
+
+    #
+    # stop
+    #  TERM every worker, KILL the ones still there after 10 seconds
+    #
+    def stop(self):
+        self.stopping = True
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        if not self.procs:
+            return None
+        self.stopped = defer.Deferred()
+        for p in list(self.procs.values()):
+            try:
+                p.transport.signalProcess('TERM')
+            except Exception:
+                pass
+
+        def kill():
+            for p in list(self.procs.values()):
+                try:
+                    p.transport.signalProcess('KILL')
+                except Exception:
+                    pass
+        reactor.callLater(10, kill)
+        return self.stopped
+
+    #
+    # stats
+    #  the workers, and the sum of their last reports
+    #
+    def stats(self):
+        now = time.time()
+        totals = {}
+        processes = []
+        for i in range(self.workers):
+            p = self.procs.get(i)
+            r = self.reports.get(i)
+            if r is not None:
+                add_up(totals, r.get('info') or {})
+            processes.append({
+                'worker':i,
+                'pid':p.pid if p else None,
+                'running':p is not None,
+                'uptime':(now - p.started) if p else None,
+                'restarts':self.restarts[i],
+                'report_age':(now - r['received']) if r else None,
+                'info':r.get('info') if r else None
+            })
+        return {
+            'workers':self.workers,
+            'running':len(self.procs),
+            'restarts':sum(self.restarts.values()),
+            'totals':totals,
+            'processes':processes
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        log.msg("workers: {} of {} running, {} restarts, totals {}".format(s['running'],
+            s['workers'], s['restarts'], json.dumps(s['totals'], sort_keys=True, default=str)))